@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Benchmark for canonicalize_rectangles() in pin_check.py.
+#
+# usage: python bench/bench_canonicalize.py [--rects N]
+#
+# Builds a port made of many small overlapping rectangles, like a power pin
+# drawn as a mesh of short stripe segments, and times canonicalize_rectangles()
+# against the previous implementation.
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections.abc import Iterable
+from numbers import Real
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pin_check import canonicalize_rectangles  # noqa: E402
+
+
+def sweep_rebuild_canonicalize_rectangles(
+    rects: Iterable[Iterable[Real]],
+) -> Iterable[Iterable[Real]]:
+    # the previous implementation, kept as a baseline: rebuilds the open
+    # rectangles and re-sorts the whole cross section on every sweep line
+
+    sweep_events = {}
+    for lx, by, rx, ty in rects:
+        sweep_events[by] = sweep_events.get(by, {})
+        sweep_events[by][lx] = sweep_events[by].get(lx, 0) + 1
+        sweep_events[by][rx] = sweep_events[by].get(rx, 0) - 1
+        sweep_events[ty] = sweep_events.get(ty, {})
+        sweep_events[ty][lx] = sweep_events[ty].get(lx, 0) - 1
+        sweep_events[ty][rx] = sweep_events[ty].get(rx, 0) + 1
+
+    closed_rects = []
+    open_rects = {}
+    cross_section_events = {}
+    for y, sweep_line_events in sorted(sweep_events.items()):
+        old_multiplicity = 0
+        new_multiplicity = 0
+        is_covered, covered_intervals, covered_start = False, [], None
+        is_removed, removed_intervals, removed_start = False, [], None
+        for x in sorted(set(cross_section_events).union(sweep_line_events)):
+            old_delta = cross_section_events.get(x, 0)
+            new_delta = sweep_line_events.get(x, 0) + old_delta
+            old_multiplicity += old_delta
+            new_multiplicity += new_delta
+            assert old_multiplicity >= 0
+            assert new_multiplicity >= 0
+            was_covered, was_removed = is_covered, is_removed
+            is_covered = new_multiplicity > 0
+            is_removed = old_multiplicity > 0 and new_multiplicity == 0
+            if was_covered and not is_covered:
+                assert covered_start is not None
+                covered_intervals.append((covered_start, x))
+                covered_start = None
+            if was_removed and not is_removed:
+                assert removed_start is not None
+                removed_intervals.append((removed_start, x))
+                removed_start = None
+            if is_covered and not was_covered:
+                assert covered_start is None
+                covered_start = x
+            if is_removed and not was_removed:
+                assert removed_start is None
+                removed_start = x
+
+        for x, m in sorted(sweep_line_events.items()):
+            cross_section_events[x] = cross_section_events.get(x, 0) + m
+            if cross_section_events[x] == 0:
+                del cross_section_events[x]
+
+        for (lx, rx), by in open_rects.items():
+            closed = False
+            for ix, jx in removed_intervals:
+                if ix < rx and lx < jx:
+                    closed = True
+            if closed:
+                closed_rects.append((lx, by, rx, y))
+
+        kept_intervals = [
+            (b, c)
+            for ((a, b), (c, d)) in zip(
+                [(None, None)] + removed_intervals, removed_intervals + [(None, None)]
+            )
+        ]
+        open_rects_new = {}
+        for ix, jx in covered_intervals:
+            open_rects_new[(ix, jx)] = y
+        for (lx, rx), by in open_rects.items():
+            for ix, jx in kept_intervals:
+                if (ix is None or ix < rx) and (jx is None or lx < jx):
+                    clx = lx if ix is None else max(lx, ix)
+                    crx = rx if jx is None else min(rx, jx)
+                    open_rects_new[(clx, crx)] = min(
+                        open_rects_new.get((clx, crx), by), by
+                    )
+        open_rects = open_rects_new
+
+    return sorted(set(closed_rects))
+
+
+def synthetic_rects(rect_count: int, seed: int = 0):
+    rng = random.Random(seed)
+    rects = []
+    # vertical stripes split into overlapping segments
+    stripes = max(1, rect_count // 200)
+    for i in range(rect_count - rect_count // 10):
+        stripe = i % stripes
+        segment = i // stripes
+        x = stripe * 5000 + rng.randrange(0, 3) * 10
+        y = segment * 400
+        rects.append((x, y, x + 1600, y + 500))
+    # some horizontal straps crossing several stripes
+    for i in range(rect_count // 10):
+        x = rng.randrange(0, stripes) * 5000
+        y = rng.randrange(0, 200 * 400)
+        rects.append((x, y, x + rng.randrange(1, 4) * 5000, y + 300))
+    return rects
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rects", type=int, default=10000)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    rects = synthetic_rects(args.rects)
+    print(f"{len(rects)} rectangles")
+
+    start = time.perf_counter()
+    canonical = canonicalize_rectangles(rects)
+    new_time = time.perf_counter() - start
+    print(f"interval lists: {new_time:.3f} s, {len(canonical)} maximal rectangles")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        baseline = sweep_rebuild_canonicalize_rectangles(rects)
+        baseline_time = time.perf_counter() - start
+        print(
+            f"previous:       {baseline_time:.3f} s, {len(baseline)} maximal rectangles"
+        )
+        assert baseline == canonical
+        print(f"speedup: {baseline_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
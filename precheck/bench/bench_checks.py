@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# Benchmark for the Python-side checks of precheck.py, on synthetic projects.
+#
+# usage: python bench/bench_checks.py [--tech sky130A] [--tiles 1x1,8x2]
+#            [--polygons 1000,100000] [--depths 1,4] [--segments 1,16]
+#            [--output bench.json] [--compare previous.json]
+#
+# For every tile size in tech/<tech>/tile_sizes.yaml (or those given), generates
+# a GDS and a LEF matching the tile's template DEF: the template's signal pins,
+# VGND / VDPWR stripes split into overlapping segments, and random metal shapes
+# in a hierarchy of 2x2 arrays, `depth` levels deep, `polygons` shapes in total.
+#
+# Each check runs in a forked process, on a fresh LayoutContext, and its wall
+# time and peak memory growth (VmHWM) are recorded. With --output the figures
+# are saved as JSON, along with the git commit; --compare prints the ratios to
+# an earlier run and exits with status 1 if any check got slower than the
+# --threshold ratio.
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import klayout.db as pya  # noqa: E402
+from klayout_tools import load_tech_layers  # noqa: E402
+from layout_context import LayoutContext  # noqa: E402
+from pin_check import canonicalize_rectangles, pin_check  # noqa: E402
+from result_cache import PRECHECK_DIR  # noqa: E402
+from tech_data import (  # noqa: E402
+    boundary_layer,
+    lef_port_layers,
+    power_pins_layer,
+    power_pins_min_width,
+)
+from template_def import load_template_def  # noqa: E402
+
+import precheck  # noqa: E402
+
+TECH_DIR = os.path.join(PRECHECK_DIR, "..", "tech")
+
+# fill and stripes stay this far from the die edges (nm), clear of the pins
+MARGIN = 5000
+STRIPE_PITCH = 40000
+
+Rect = Tuple[int, int, int, int]  # lx, by, rx, ty (nm)
+
+
+class SyntheticProject:
+    def __init__(self, case: str, name: str, gds: str, lef: str):
+        self.case = case
+        self.name = name
+        self.gds = gds
+        self.lef = lef
+        self.template_def: Optional[str] = None
+        self.power_rects: Dict[str, List[Rect]] = {}
+
+
+def tile_sizes(tech: str) -> Dict[str, Tuple[int, int]]:
+    """Die width and height (nm) of each tile size."""
+    with open(os.path.join(TECH_DIR, tech, "tile_sizes.yaml")) as f:
+        sizes = yaml.safe_load(f)
+    dies = {}
+    for tiles, area in sizes.items():
+        _, _, width, height = (round(float(value) * 1000) for value in area.split())
+        dies[tiles] = (width, height)
+    return dies
+
+
+def template_def_path(tech: str, tiles: str) -> Optional[str]:
+    # the digital templates, as chosen by precheck.project_checks
+    suffix = "pg" if tech == "sky130A" else "pgvdd"
+    path = os.path.join(TECH_DIR, tech, "def", f"tt_block_{tiles}_{suffix}.def")
+    return path if os.path.exists(path) else None
+
+
+def write_lef(project: SyntheticProject, die: Tuple[int, int], pins: Dict[str, Any]):
+    def um(value: int) -> str:
+        return f"{value / 1000:.3f}"
+
+    lines = [
+        "VERSION 5.7 ;",
+        'BUSBITCHARS "[]" ;',
+        f"MACRO {project.name}",
+        "  CLASS BLOCK ;",
+        f"  FOREIGN {project.name} ;",
+        "  ORIGIN 0.000 0.000 ;",
+        f"  SIZE {um(die[0])} BY {um(die[1])} ;",
+    ]
+    for pin, (use, layer, rects) in pins.items():
+        lines += [f"  PIN {pin}", "    DIRECTION INOUT ;", f"    USE {use} ;"]
+        lines += ["    PORT", f"      LAYER {layer} ;"]
+        for rect in rects:
+            lines.append(f"        RECT {' '.join(map(um, rect))} ;")
+        lines += ["    END", f"  END {pin}"]
+    lines += [f"END {project.name}", "END LIBRARY", ""]
+    with open(project.lef, "w") as f:
+        f.write("\n".join(lines))
+
+
+def generate_project(
+    out_dir: str,
+    tech: str,
+    tiles: str,
+    die: Tuple[int, int],
+    polygons: int,
+    depth: int,
+    segments: int,
+    seed: int = 0,
+) -> SyntheticProject:
+    case = f"{tiles}/p{polygons}/d{depth}/s{segments}"
+    name = f"tt_um_bench_{tiles}_p{polygons}_d{depth}_s{segments}"
+    project = SyntheticProject(
+        case,
+        name,
+        os.path.join(out_dir, f"{name}.gds"),
+        os.path.join(out_dir, f"{name}.lef"),
+    )
+    rng = random.Random(seed)
+    width, height = die
+    layers = load_tech_layers(tech, only_valid=False)
+    layout = pya.Layout()
+    layout.dbu = 0.001
+
+    def layer(name: str) -> int:
+        return layout.layer(*layers.number(name))
+
+    top = layout.create_cell(name)
+    top.shapes(layer(boundary_layer[tech])).insert(pya.Box(0, 0, width, height))
+
+    # random shapes on the two lowest metals, in 2x2 arrays of 2x2 arrays of ...
+    fill_layers = [
+        layer(pin_layer.replace(".pin", ".drawing"))
+        for pin_layer in lef_port_layers[tech][:2]
+    ]
+    cell_width = (width - 2 * MARGIN) // 2 ** (depth - 1)
+    cell_height = (height - 2 * MARGIN) // 2 ** (depth - 1)
+    cell = layout.create_cell("bench_leaf")
+    for i in range(max(1, polygons // 4 ** (depth - 1))):
+        w, h = rng.randrange(140, 1000, 5), rng.randrange(140, 1000, 5)
+        x = rng.randrange(0, max(5, cell_width - w), 5)
+        y = rng.randrange(0, max(5, cell_height - h), 5)
+        cell.shapes(fill_layers[i % 2]).insert(pya.Box(x, y, x + w, y + h))
+    for level in range(1, depth):
+        parent = layout.create_cell(f"bench_level{level}")
+        for i, j in itertools.product(range(2), range(2)):
+            trans = pya.Trans(i * cell_width, j * cell_height)
+            parent.insert(pya.CellInstArray(cell.cell_index(), trans))
+        cell, cell_width, cell_height = parent, cell_width * 2, cell_height * 2
+    top.insert(pya.CellInstArray(cell.cell_index(), pya.Trans(MARGIN, MARGIN)))
+
+    lef_pins: Dict[str, Any] = {}
+    project.template_def = template_def_path(tech, tiles)
+    if project.template_def is not None:
+        template = load_template_def(project.template_def)
+        for pin, (pin_layer, *rect) in template["pins"].items():
+            top.shapes(layer(f"{pin_layer}.pin")).insert(pya.Box(*rect))
+            lef_pins[pin] = ("SIGNAL", pin_layer, [tuple(rect)])
+
+    # power stripes, each drawn as `segments` overlapping pieces
+    stripe_layer = power_pins_layer[tech]
+    stripe_width = power_pins_min_width[tech] + 400
+    length = (height - 2 * MARGIN) // segments
+    for pin, use, offset in (("VGND", "GROUND", 0), ("VDPWR", "POWER", 1)):
+        rects = []
+        first = 2 * MARGIN + offset * STRIPE_PITCH // 2
+        for x in range(first, width - 2 * MARGIN - stripe_width, STRIPE_PITCH):
+            for j in range(segments):
+                by = MARGIN + j * length
+                ty = min(height - MARGIN, by + length + 500)
+                rects.append((x, by, x + stripe_width, ty))
+        for rect in rects:
+            top.shapes(layer(f"{stripe_layer}.pin")).insert(pya.Box(*rect))
+        project.power_rects[pin] = rects
+        lef_pins[pin] = (use, stripe_layer, rects)
+
+    layout.write(project.gds)
+    write_lef(project, die, lef_pins)
+    return project
+
+
+def project_benchmarks(
+    project: SyntheticProject, tech: str
+) -> Dict[str, Callable[[], None]]:
+    def canonicalize():
+        for rects in project.power_rects.values():
+            canonicalize_rectangles(rects)
+
+    # a new LayoutContext per check: each one pays for the parsing it needs
+    benchmarks = {"canonicalize_rectangles": canonicalize}
+    if project.template_def is not None:
+        template_def = project.template_def
+        benchmarks["pin_check"] = lambda: pin_check(
+            LayoutContext(project.gds),
+            project.lef,
+            template_def,
+            project.name,
+            False,
+            tech,
+        )
+    benchmarks["boundary_check"] = lambda: precheck.boundary_check(
+        LayoutContext(project.gds), tech
+    )
+    benchmarks["layer_check"] = lambda: precheck.layer_check(
+        LayoutContext(project.gds), tech
+    )
+    if tech in ("sky130A", "ihp-sg13g2"):
+        benchmarks["analog_pin_check"] = lambda: precheck.analog_pin_check(
+            LayoutContext(project.gds), tech, True, False, 0, {}
+        )
+    return benchmarks
+
+
+def status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(benchmark: Callable[[], None]) -> Dict[str, Any]:
+    """Run `benchmark` in a forked process: wall time, peak RSS growth, error."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            try:
+                # reset the peak RSS inherited from the parent
+                with open("/proc/self/clear_refs", "w") as f:
+                    f.write("5")
+            except OSError:
+                pass
+            rss = status_kb("VmRSS")
+            error = None
+            start = time.perf_counter()
+            try:
+                benchmark()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - start
+            result = {
+                "time": elapsed,
+                "peak_rss_kb": max(0, status_kb("VmHWM") - rss),
+                "error": error,
+            }
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(result, f)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        return {"time": 0.0, "peak_rss_kb": 0, "error": "benchmark process died"}
+    return json.loads(data)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=PRECHECK_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.stdout.strip()
+
+
+def compare(results: List[Dict[str, Any]], previous_file: str, threshold: float):
+    with open(previous_file) as f:
+        previous = json.load(f)
+    before = {(r["case"], r["check"]): r for r in previous["results"]}
+    print(f"\ncompared to {previous.get('commit')} ({previous_file}):")
+    regressions = 0
+    for result in results:
+        old = before.get((result["case"], result["check"]))
+        if old is None:
+            continue
+        ratio = result["time"] / max(old["time"], 1e-6)
+        # small absolute changes are noise
+        slower = ratio > threshold and result["time"] - old["time"] > 0.05
+        regressions += slower
+        print(
+            f"{result['case']:<28} {result['check']:<24} {ratio:6.2f}x time, "
+            f"{result['peak_rss_kb'] - old['peak_rss_kb']:+9d} kB peak"
+            + ("  REGRESSION" if slower else "")
+        )
+    return regressions
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tech", default="sky130A", choices=["sky130A", "ihp-sg13g2"])
+    parser.add_argument("--tiles", help="comma-separated tile sizes (default: all)")
+    parser.add_argument("--polygons", type=int_list, default=[1000, 100000])
+    parser.add_argument("--depths", type=int_list, default=[1, 4])
+    parser.add_argument("--segments", type=int_list, default=[1, 16])
+    parser.add_argument("--repeat", type=int, default=1, help="keep the best of N runs")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    dies = tile_sizes(args.tech)
+    tiles_list = args.tiles.split(",") if args.tiles else list(dies)
+    # the layer tables are loaded once, outside of the measurements
+    load_tech_layers(args.tech)
+    load_tech_layers(args.tech, only_valid=False)
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for tiles, polygons, depth, segments in itertools.product(
+            tiles_list, args.polygons, args.depths, args.segments
+        ):
+            project = generate_project(
+                out_dir, args.tech, tiles, dies[tiles], polygons, depth, segments
+            )
+            for check, benchmark in project_benchmarks(project, args.tech).items():
+                runs = [measure(benchmark) for _ in range(max(1, args.repeat))]
+                result = {
+                    "case": project.case,
+                    "check": check,
+                    "time": min(run["time"] for run in runs),
+                    "peak_rss_kb": min(run["peak_rss_kb"] for run in runs),
+                    "error": runs[0]["error"],
+                }
+                results.append(result)
+                print(
+                    f"{project.case:<28} {check:<24} {result['time']:8.3f} s "
+                    f"{result['peak_rss_kb'] / 1024:8.1f} MB"
+                    + (f"  FAILED: {result['error']}" if result["error"] else "")
+                )
+            os.unlink(project.gds)
+            os.unlink(project.lef)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"commit": git_commit(), "tech": args.tech, "results": results},
+                f,
+                indent=2,
+            )
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
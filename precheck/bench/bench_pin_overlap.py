@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Benchmark for the overlapping pin check in pin_check.py.
+#
+# usage: python bench/bench_pin_overlap.py [--rects N]
+#
+# Builds a synthetic LEF port list in the shape of a large analog tile: a grid of
+# signal pins plus compound VGND / VDPWR / VAPWR ports made of many rectangles,
+# and times find_overlapping_ports() against the previous all-pairs comparison.
+
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pin_check import find_overlapping_ports  # noqa: E402
+
+
+def all_pairs_overlapping_ports(ports):
+    # the previous O(P^2 * R^2) implementation, kept as a baseline
+    overlaps = []
+    for (pin1, rects1), (pin2, rects2) in combinations(sorted(ports.items()), 2):
+        for layer1, lx1, by1, rx1, ty1 in rects1:
+            for layer2, lx2, by2, rx2, ty2 in rects2:
+                if layer1 != layer2:
+                    continue
+                if rx1 < lx2 or rx2 < lx1:
+                    continue
+                if ty1 < by2 or ty2 < by1:
+                    continue
+                overlaps.append((pin1, pin2))
+    return overlaps
+
+
+def synthetic_ports(rect_count: int, seed: int = 0):
+    rng = random.Random(seed)
+    ports = {}
+    # signal pins along the bottom and top edges, one rectangle each
+    signal_pins = rect_count // 4
+    for i in range(signal_pins):
+        x = 500 + i * 1000
+        y = 0 if i % 2 == 0 else 225000
+        ports[f"sig[{i}]"] = [("met4", x, y, x + 300, y + 1000)]
+    # compound power ports: vertical stripes split into short segments
+    power_rects = rect_count - signal_pins
+    for i in range(power_rects):
+        pin = ("VGND", "VDPWR", "VAPWR")[i % 3]
+        stripe = i // 3 % 64
+        segment = i // (3 * 64)
+        x = 2000 + stripe * 12000 + ("VGND", "VDPWR", "VAPWR").index(pin) * 3000
+        y = 2000 + segment * 500
+        ports.setdefault(pin, []).append(("met4", x, y, x + 1200, y + 600))
+    # a few accidental overlaps
+    for i in range(10):
+        x = rng.randrange(0, signal_pins) * 1000 + 500
+        ports[f"bad[{i}]"] = [("met4", x + 100, 0, x + 200, 500)]
+    return ports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rects", type=int, default=4000)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    ports = synthetic_ports(args.rects)
+    total = sum(len(rects) for rects in ports.values())
+    print(f"{len(ports)} pins, {total} rectangles")
+
+    start = time.perf_counter()
+    overlaps = find_overlapping_ports(ports)
+    sweep_time = time.perf_counter() - start
+    print(f"sweep line: {sweep_time:.3f} s, {len(overlaps)} overlaps")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        baseline = all_pairs_overlapping_ports(ports)
+        baseline_time = time.perf_counter() - start
+        print(f"all pairs:  {baseline_time:.3f} s, {len(baseline)} overlaps")
+        assert baseline == overlaps
+        print(f"speedup: {baseline_time / sweep_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
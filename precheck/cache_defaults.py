@@ -0,0 +1,8 @@
+import os
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "cache")
+
+
+def default_cache_dir() -> str:
+    """$PRECHECK_CACHE_DIR, or the cache directory next to the precheck sources."""
+    return os.getenv("PRECHECK_CACHE_DIR") or DEFAULT_CACHE_DIR
@@ -0,0 +1,62 @@
+import contextlib
+import subprocess
+import threading
+from typing import Optional, Set
+
+_current = threading.local()
+
+
+class CheckCancelled(Exception):
+    """Raised in a check whose external tool was stopped by a cancelled scope."""
+
+
+class CancelScope:
+    """Lets a failing check stop the other checks of the same project.
+
+    Once cancelled, checks that haven't started yet are skipped, and the
+    processes started through `check_metrics.run_subprocess` by running checks
+    are terminated. Checks running Python code finish normally.
+    """
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self._processes: Set[subprocess.Popen] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            for proc in self._processes:
+                proc.terminate()
+
+    def add_process(self, proc: subprocess.Popen):
+        with self._lock:
+            self._processes.add(proc)
+            if self.reason is not None:
+                proc.terminate()
+
+    def remove_process(self, proc: subprocess.Popen):
+        # call before reaping the process, so its pid can't be reused meanwhile
+        with self._lock:
+            self._processes.discard(proc)
+
+
+def current_cancel_scope() -> Optional[CancelScope]:
+    """Cancel scope of the check running in this thread, if any."""
+    return getattr(_current, "scope", None)
+
+
+@contextlib.contextmanager
+def running_in(scope: Optional[CancelScope]):
+    """Make `scope` the cancel scope of the code running in this thread."""
+    _current.scope = scope
+    try:
+        yield
+    finally:
+        _current.scope = None
@@ -0,0 +1,94 @@
+import contextlib
+import threading
+import time
+from typing import Optional
+
+from check_cancel import CancelScope
+
+_current = threading.local()
+
+# how often the watchdog looks at the processes of a check, in seconds
+POLL_INTERVAL = 0.2
+
+
+class ResourceExceeded(Exception):
+    """Raised in a check whose external tool was stopped for exceeding its limits."""
+
+
+def rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class ResourceLimits(CancelScope):
+    """Wall-clock and memory limits for the processes started by one check.
+
+    A watchdog thread polls the processes started through
+    `check_metrics.run_subprocess`, and terminates them (by cancelling this
+    scope) once the check runs for more than `timeout` seconds, or once their
+    resident memory adds up to more than `max_memory_mb`. The check then fails
+    with `ResourceExceeded`.
+
+    Memory is measured as resident set size instead of being capped with
+    RLIMIT_AS: klayout and the WebAssembly runtime of yowasp-yosys reserve far
+    more address space than they use, and a failed allocation can't be told
+    apart from any other crash. Checks running Python code can't be stopped;
+    they only fail if they start a process after the timeout.
+    """
+
+    def __init__(
+        self, timeout: Optional[float] = None, max_memory_mb: Optional[int] = None
+    ):
+        super().__init__()
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.timeout is None and self.max_memory_mb is None:
+            return
+        self._deadline = time.monotonic() + (self.timeout or 0)
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    def _watch(self):
+        while not self._stopped.wait(POLL_INTERVAL):
+            if self.timeout is not None and time.monotonic() > self._deadline:
+                self.cancel(f"Timed out after {self.timeout:g} s")
+            elif self.max_memory_mb is not None:
+                with self._lock:
+                    pids = [proc.pid for proc in self._processes]
+                memory_kb = sum(rss_kb(pid) for pid in pids)
+                if memory_kb > self.max_memory_mb * 1024:
+                    self.cancel(f"Used more than {self.max_memory_mb} MB of memory")
+            if self.cancelled:
+                return
+
+
+def current_limits() -> Optional[ResourceLimits]:
+    """Resource limits of the check running in this thread, if any."""
+    return getattr(_current, "limits", None)
+
+
+@contextlib.contextmanager
+def limited_by(limits: ResourceLimits):
+    """Apply `limits` to the processes started in this thread, watching them meanwhile."""
+    _current.limits = limits
+    limits.start()
+    try:
+        yield
+    finally:
+        limits.stop()
+        _current.limits = None
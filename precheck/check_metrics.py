@@ -0,0 +1,234 @@
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from check_cancel import CancelScope, CheckCancelled, current_cancel_scope
+from check_limits import ResourceExceeded, current_limits
+
+if TYPE_CHECKING:
+    from check_scheduler import CheckResult
+
+# per-thread CPU time where the platform has it, otherwise the whole process
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+_current = threading.local()
+
+
+def read_chars(io_file: str = "/proc/thread-self/io") -> Optional[int]:
+    """Bytes read through read() and friends (`rchar`), page cache hits included."""
+    try:
+        with open(io_file) as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class CheckMetrics:
+    """Resources used by one check: its own thread, plus the processes it ran.
+
+    Checks run concurrently in threads of one process, so process-wide counters
+    (RUSAGE_SELF, RUSAGE_CHILDREN, /proc/self/io) can't tell them apart. The
+    check's own CPU time and reads are taken from its thread, and child processes
+    started with `run_subprocess` are accounted to the check that started them.
+    """
+
+    def __init__(self):
+        self.start_time = 0.0  # seconds since the epoch
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.read_bytes: Optional[int] = None
+        self.child_user_time = 0.0
+        self.child_system_time = 0.0
+        self.child_max_rss_kb = 0
+        self.child_read_bytes: Optional[int] = None
+        self.process_max_rss_kb = 0  # high-water mark of the whole precheck process
+        self.thread_id = 0
+
+    def start(self):
+        self.thread_id = threading.get_native_id()
+        self._usage = resource.getrusage(RUSAGE_THREAD)
+        self._read = read_chars()
+        self._perf_counter = time.perf_counter()
+        self.start_time = time.time()
+        _current.metrics = self
+
+    def stop(self):
+        _current.metrics = None
+        self.wall_time = time.perf_counter() - self._perf_counter
+        usage = resource.getrusage(RUSAGE_THREAD)
+        self.user_time = usage.ru_utime - self._usage.ru_utime
+        self.system_time = usage.ru_stime - self._usage.ru_stime
+        read = read_chars()
+        if read is not None and self._read is not None:
+            self.read_bytes = read - self._read
+        self.process_max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def add_child(self, usage: resource.struct_rusage, read_bytes: Optional[int]):
+        self.child_user_time += usage.ru_utime
+        self.child_system_time += usage.ru_stime
+        self.child_max_rss_kb = max(self.child_max_rss_kb, usage.ru_maxrss)
+        if read_bytes is not None:
+            self.child_read_bytes = (self.child_read_bytes or 0) + read_bytes
+
+    @property
+    def max_rss_kb(self) -> int:
+        """Peak resident set size of the precheck process or any child of the check."""
+        return max(self.process_max_rss_kb, self.child_max_rss_kb)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "start_time": self.start_time,
+            "wall_time": round(self.wall_time, 6),
+            "user_time": round(self.user_time, 6),
+            "system_time": round(self.system_time, 6),
+            "read_bytes": self.read_bytes,
+            "child_user_time": round(self.child_user_time, 6),
+            "child_system_time": round(self.child_system_time, 6),
+            "child_max_rss_kb": self.child_max_rss_kb,
+            "child_read_bytes": self.child_read_bytes,
+            "max_rss_kb": self.max_rss_kb,
+            "thread_id": self.thread_id,
+        }
+
+
+def current_metrics() -> Optional[CheckMetrics]:
+    """Metrics of the check running in this thread, if any."""
+    return getattr(_current, "metrics", None)
+
+
+def run_subprocess(args: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """Like `subprocess.run`, recording the child's resource usage for the running check.
+
+    The child is reaped with `wait4`, which returns the usage of exactly that
+    process, so concurrent checks don't see each other's children. Output is not
+    captured: pass `stdout` / `stderr` file objects to redirect it.
+
+    If the check's cancel scope is cancelled, the child is terminated and
+    `CheckCancelled` raised; if it exceeds the check's resource limits, it's
+    terminated and `ResourceExceeded` raised.
+    """
+    return run_subprocesses([args], **kwargs)[0]
+
+
+def run_subprocesses(
+    commands: List[List[str]], **kwargs
+) -> List[subprocess.CompletedProcess]:
+    """Run several commands at the same time, like `run_subprocess` runs one."""
+    scope = current_cancel_scope()
+    limits = current_limits()
+    scopes = [s for s in (scope, limits) if s is not None]
+    metrics = current_metrics()
+    with contextlib.ExitStack() as stack:
+        procs: List[subprocess.Popen] = []
+        try:
+            for args in commands:
+                procs.append(stack.enter_context(subprocess.Popen(args, **kwargs)))
+                for s in scopes:
+                    s.add_process(procs[-1])
+            for proc in procs:
+                usage, read_bytes = reap(proc, scopes)
+                if metrics is not None:
+                    metrics.add_child(usage, read_bytes)
+        except BaseException:
+            for proc in procs:
+                for s in scopes:
+                    s.remove_process(proc)
+                if proc.returncode is None:
+                    proc.kill()
+            raise
+
+    if limits is not None and limits.cancelled:
+        raise ResourceExceeded(limits.reason)
+    if scope is not None and scope.cancelled:
+        raise CheckCancelled(scope.reason)
+    return [subprocess.CompletedProcess(proc.args, proc.returncode) for proc in procs]
+
+
+def reap(
+    proc: subprocess.Popen, scopes: List[CancelScope]
+) -> Tuple[resource.struct_rusage, Optional[int]]:
+    """Wait for the process, and return its resource usage and bytes read."""
+    # wait for the exit without reaping, so the reads the kernel adds to
+    # /proc/self/io on reaping can be told apart from other threads' reads
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    for scope in scopes:
+        scope.remove_process(proc)
+    read_before = read_chars("/proc/self/io")
+    _, status, usage = os.wait4(proc.pid, 0)
+    read_after = read_chars("/proc/self/io")
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    read_bytes = None
+    if read_before is not None and read_after is not None:
+        read_bytes = read_after - read_before
+    return usage, read_bytes
+
+
+def write_metrics(results: List["CheckResult"], path: str):
+    """Write the metrics of the check results as JSON."""
+    checks = []
+    for result in results:
+        entry: Dict[str, Any] = {
+            "name": result.name,
+            "passed": result.passed,
+            "cached": result.cached,
+            "skipped": result.skipped is not None,
+            "resource_exceeded": result.resource_exceeded,
+            "elapsed_time": round(result.elapsed_time, 6),
+        }
+        if result.metrics is not None:
+            entry.update(result.metrics.as_dict())
+        checks.append(entry)
+    with open(path, "w") as f:
+        json.dump({"checks": checks}, f, indent=2)
+
+
+def write_trace(projects: Dict[str, List["CheckResult"]], path: str):
+    """Write a Chrome trace (chrome://tracing, ui.perfetto.dev) of check results.
+
+    `projects` maps project names to their results; each project is shown as a
+    process, with a track per worker thread.
+    """
+    starts = [
+        result.metrics.start_time
+        for results in projects.values()
+        for result in results
+        if result.metrics is not None
+    ]
+    origin = min(starts, default=0.0)
+    events: List[Dict[str, Any]] = []
+    for pid, (project, results) in enumerate(projects.items(), start=1):
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": project},
+            }
+        )
+        for result in results:
+            if result.metrics is None:
+                continue  # cached or skipped
+            metrics = result.metrics
+            events.append(
+                {
+                    "name": result.name,
+                    "cat": "check" if result.passed else "check,failed",
+                    "ph": "X",
+                    "ts": round((metrics.start_time - origin) * 1e6),
+                    "dur": round(metrics.wall_time * 1e6),
+                    "pid": pid,
+                    "tid": metrics.thread_id,
+                    "args": {"passed": result.passed, **metrics.as_dict()},
+                }
+            )
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,285 @@
+import contextlib
+import logging
+import threading
+import traceback
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, NotRequired, Optional, TypedDict
+
+from check_cancel import CancelScope, CheckCancelled, running_in
+from check_limits import ResourceExceeded, ResourceLimits, limited_by
+from check_metrics import CheckMetrics
+
+if TYPE_CHECKING:
+    from klayout_drc_batch import DrcDeck
+    from result_cache import ResultCache
+
+
+class Check(TypedDict):
+    name: str
+    check: Callable[[], None]
+    techs: NotRequired[List[str]]
+    cpus: NotRequired[int]  # number of cores the check keeps busy, defaults to 1
+    inputs: NotRequired[List[str]]  # files the result depends on, enables caching
+    params: NotRequired[Dict[str, Any]]  # other arguments the result depends on
+    reports: NotRequired[List[str]]  # report files written by the check
+    klayout_deck: NotRequired["DrcDeck"]  # for running the KLayout DRC decks together
+    cost: NotRequired[float]  # rough run time in seconds, for the start order
+    blocking: NotRequired[bool]  # with fail-fast, a failure cancels the other checks
+    timeout: NotRequired[float]  # seconds its processes may run, overrides the default
+    max_memory_mb: NotRequired[
+        int
+    ]  # memory its processes may use, overrides the default
+
+
+DEFAULT_COST = 1.0
+
+_current = threading.local()
+
+
+def check_cost(check: Check) -> float:
+    return check.get("cost", DEFAULT_COST)
+
+
+def start_order_key(check: Check) -> tuple[bool, float]:
+    """Blocking checks first, cheapest first, so that broken projects fail early;
+    then the others longest first, so the long DRCs aren't left to the end."""
+    if check.get("blocking"):
+        return (False, check_cost(check))
+    return (True, -check_cost(check))
+
+
+class CheckResult:
+    def __init__(
+        self,
+        name: str,
+        elapsed_time: float,
+        error: Optional[Exception] = None,
+        error_traceback: Optional[str] = None,
+        cached: bool = False,
+        metrics: Optional[CheckMetrics] = None,
+        skipped: Optional[str] = None,
+    ):
+        self.name = name
+        self.elapsed_time = elapsed_time
+        self.error = error
+        self.error_traceback = error_traceback
+        self.cached = cached
+        self.metrics = metrics  # None for cached results and checks that never started
+        self.skipped = skipped  # why the check was skipped or cancelled
+
+    @property
+    def passed(self):
+        return self.error is None and self.skipped is None
+
+    @property
+    def resource_exceeded(self) -> bool:
+        """Whether the check was stopped for exceeding its time or memory limit."""
+        return isinstance(self.error, ResourceExceeded)
+
+    def __repr__(self):
+        return f"CheckResult(name={self.name}, elapsed_time={self.elapsed_time}, error={self.error!r})"
+
+
+class CpuSlots:
+    """Counting semaphore that hands out CPU slots to checks.
+
+    A check asking for more slots than exist gets all of them, so it runs alone;
+    one asking for none starts right away.
+    Slots are handed out first come, first served: a check waiting for many slots
+    isn't overtaken by later checks that need fewer, so it can't starve.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self._free = total
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+    def acquire(self, count: int) -> int:
+        count = min(count, self.total)
+        if count <= 0:
+            return 0
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._cond.wait_for(lambda: self._serving == ticket and self._free >= count)
+            self._free -= count
+            self._serving += 1
+            self._cond.notify_all()
+        return count
+
+    def release(self, count: int):
+        with self._cond:
+            self._free += count
+            self._cond.notify_all()
+
+
+@contextlib.contextmanager
+def cpu_slots_for(count: int):
+    """Hold `count` CPU slots of the scheduler running this check, within the block.
+
+    For checks that ask for no slots of their own, but may start work that keeps
+    cores busy (like the process of a KLayout DRC batch). Checks holding slots
+    already, or running outside a scheduler, go ahead with what they have.
+    """
+    slots = getattr(_current, "slots", None)
+    if slots is None or getattr(_current, "granted", 0) > 0:
+        yield
+        return
+    granted = slots.acquire(count)
+    try:
+        yield
+    finally:
+        slots.release(granted)
+
+
+def run_check(
+    check: Check,
+    cache: Optional["ResultCache"] = None,
+    scope: Optional[CancelScope] = None,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[int] = None,
+) -> CheckResult:
+    """Run a check, or get its result from the cache.
+
+    With a cancel scope, the check is skipped if the scope is already cancelled,
+    and if it's a blocking check and fails, it cancels the scope.
+
+    `timeout` and `max_memory_mb` limit the processes started by checks that
+    don't set their own limits. Results of checks stopped by their limits aren't
+    cached, the limits may be different next time.
+    """
+    if scope is not None and scope.cancelled:
+        return CheckResult(check["name"], 0, skipped=scope.reason)
+
+    result = cache.lookup(check) if cache is not None else None
+    if result is None:
+        limits = ResourceLimits(
+            check.get("timeout", timeout), check.get("max_memory_mb", max_memory_mb)
+        )
+        result = execute_check(check, scope, limits)
+        if (
+            cache is not None
+            and result.skipped is None
+            and not result.resource_exceeded
+        ):
+            cache.store(check, result)
+
+    if scope is not None and check.get("blocking") and result.error is not None:
+        scope.cancel(f"{check['name']} failed")
+    return result
+
+
+def execute_check(
+    check: Check,
+    scope: Optional[CancelScope] = None,
+    limits: Optional[ResourceLimits] = None,
+) -> CheckResult:
+    metrics = CheckMetrics()
+    metrics.start()
+    error, error_traceback, skipped = None, None, None
+    try:
+        with running_in(scope), limited_by(limits or ResourceLimits()):
+            check["check"]()
+    except CheckCancelled as e:
+        skipped = str(e)
+    except Exception as e:
+        error, error_traceback = e, traceback.format_exc()
+    finally:
+        metrics.stop()
+    return CheckResult(
+        check["name"],
+        metrics.wall_time,
+        error,
+        error_traceback,
+        metrics=metrics,
+        skipped=skipped,
+    )
+
+
+class CheckScheduler:
+    """Worker pool running checks, possibly for many projects at once.
+
+    At most `jobs` CPU slots are in use at any time; a check asks for its `cpus`
+    weight in slots (capped at `jobs`) and waits until they are free.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        cache: Optional["ResultCache"] = None,
+        timeout: Optional[float] = None,
+        max_memory_mb: Optional[int] = None,
+    ):
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self._slots = CpuSlots(self.jobs)
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+
+    def _run_scheduled(self, check: Check, scope: Optional[CancelScope]) -> CheckResult:
+        if scope is not None and scope.cancelled:
+            # don't wait for CPU slots just to be skipped
+            return run_check(check, self.cache, scope)
+        granted = self._slots.acquire(check.get("cpus", 1))
+        _current.slots, _current.granted = self._slots, granted
+        try:
+            if self.jobs > 1:
+                logging.info(
+                    f"Starting {check['name']} ({granted}/{self.jobs} CPU slots)"
+                )
+            return run_check(check, self.cache, scope, self.timeout, self.max_memory_mb)
+        finally:
+            _current.slots, _current.granted = None, 0
+            self._slots.release(granted)
+
+    def submit(
+        self, check: Check, scope: Optional[CancelScope] = None
+    ) -> "Future[CheckResult]":
+        """Queue a check; checks start in submission order as CPU slots free up."""
+        return self._executor.submit(self._run_scheduled, check, scope)
+
+    def submit_all(
+        self, checks: List[Check], scope: Optional[CancelScope] = None
+    ) -> "List[Future[CheckResult]]":
+        """Queue checks in start order; the futures are in the order of `checks`."""
+        # sorted() is stable: checks of the same cost start in the given order
+        order = sorted(range(len(checks)), key=lambda i: start_order_key(checks[i]))
+        futures = {i: self.submit(checks[i], scope) for i in order}
+        return [futures[i] for i in range(len(checks))]
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def run_checks(
+    checks: List[Check],
+    jobs: int = 1,
+    cache: Optional["ResultCache"] = None,
+    fail_fast: bool = False,
+    timeout: Optional[float] = None,
+    max_memory_mb: Optional[int] = None,
+) -> List[CheckResult]:
+    """Run independent checks concurrently, using at most `jobs` CPU slots at a time.
+
+    Blocking checks are started first, cheapest first, then the others longest
+    first. With `fail_fast`, the first failing blocking
+    check cancels the others, which are then reported as skipped. The processes
+    of each check are stopped after `timeout` seconds or beyond `max_memory_mb`,
+    unless the check sets its own limits.
+
+    Results are returned in the order of `checks`, regardless of completion order.
+    """
+    scope = CancelScope() if fail_fast else None
+    with CheckScheduler(jobs, cache, timeout, max_memory_mb) as scheduler:
+        futures = scheduler.submit_all(checks, scope)
+        return [future.result() for future in futures]
@@ -0,0 +1,111 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List
+
+# examples kept per rule; reports of broken designs can hold millions of items
+DEFAULT_MAX_EXAMPLES = 3
+
+# a category path in an item, e.g. `'m1.1'.sub`: names are quoted if needed
+CATEGORY_PATH_RE = re.compile(r"'((?:[^'\\]|\\.)*)'|([^.]+)")
+
+
+def parse_category_path(path: str) -> str:
+    names = []
+    for quoted, plain in CATEGORY_PATH_RE.findall(path.strip()):
+        names.append(re.sub(r"\\(.)", r"\1", quoted) if quoted else plain)
+    return ".".join(names)
+
+
+class DrcRule:
+    """Violations of one rule (report category)."""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self.count = 0
+        self.examples: List[str] = []
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "count": self.count,
+            "examples": self.examples,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DrcRule":
+        rule = cls(data["name"], data.get("description", ""))
+        rule.count = data["count"]
+        rule.examples = data.get("examples", [])
+        return rule
+
+    def __repr__(self):
+        return f"DrcRule(name={self.name}, count={self.count})"
+
+
+class DrcReportSummary:
+    def __init__(self):
+        self.rules: Dict[str, DrcRule] = {}
+
+    @property
+    def total(self) -> int:
+        return sum(rule.count for rule in self.rules.values())
+
+    def violated_rules(self) -> List[DrcRule]:
+        """Rules with violations, most violated first."""
+        rules = [rule for rule in self.rules.values() if rule.count > 0]
+        return sorted(rules, key=lambda rule: -rule.count)
+
+
+def read_drc_report(
+    path: str, max_examples: int = DEFAULT_MAX_EXAMPLES
+) -> DrcReportSummary:
+    """Count the violations per rule in a KLayout report database (.lyrdb / .xml).
+
+    The file is streamed: items are dropped as soon as they are counted, and only
+    the first `max_examples` values of each rule are kept.
+    """
+    summary = DrcReportSummary()
+    stack: List[ET.Element] = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            continue
+
+        if elem.tag == "item" and parent.tag == "items":
+            name = parse_category_path(elem.findtext("category", ""))
+            rule = summary.rules.get(name)
+            if rule is None:
+                rule = summary.rules[name] = DrcRule(name)
+            rule.count += 1
+            if len(rule.examples) < max_examples:
+                value = elem.findtext("values/value")
+                if value:
+                    rule.examples.append(value)
+            parent.remove(elem)
+        elif elem.tag == "category" and parent.tag == "categories":
+            # a rule definition, maybe nested: its path is made of the enclosing names
+            names = [e.findtext("name", "") for e in stack if e.tag == "category"]
+            name = ".".join(names + [elem.findtext("name", "")])
+            rule = summary.rules.get(name)
+            if rule is None:
+                rule = summary.rules[name] = DrcRule(name)
+            rule.description = elem.findtext("description", "")
+    return summary
+
+
+def drc_rules_markdown(rules: List[DrcRule]) -> str:
+    """Table of the violated rules, with a few example locations."""
+    markdown = "| Rule | Violations | Examples |\n|------|-----------:|----------|\n"
+    for rule in rules:
+        description = (rule.description or rule.name).replace("|", "\\|")
+        examples = "<br>".join(
+            f"`{example}`".replace("|", "\\|") for example in rule.examples
+        )
+        markdown += f"| {description} | {rule.count} | {examples} |\n"
+    return markdown
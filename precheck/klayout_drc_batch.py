@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, TypedDict
+
+from check_cancel import CheckCancelled, current_cancel_scope
+from check_metrics import run_subprocess
+from check_scheduler import cpu_slots_for
+
+DRIVER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "klayout_drc_batch.rb"
+)
+
+# seconds between looks at the cancel scope, while waiting for the batch
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class DrcDeck(TypedDict):
+    check: str
+    script: str
+    vars: Dict[str, str]  # passed to the deck as globals, like `klayout -rd`
+    report: str  # report database written by the deck
+
+
+class KlayoutDrcBatch:
+    """Runs the DRC decks for one layout in a single KLayout process.
+
+    The process is started by the first check asking for a result, and runs every
+    deck added so far, sharing one loaded copy of the layout (and its resource
+    usage is recorded for that check). The decks run one after another, each with
+    its own `thr`, so that check takes as many CPU slots as the deck with the most
+    threads, for as long as the process runs. The other checks wait for it, until
+    their cancel scope is cancelled, and then just pick up their status. Checks
+    running decks in a batch should thus ask for no CPU slots of their own.
+
+    If the process is stopped, e.g. by the resource limits of the check that
+    started it, the other checks fail with the same error rather than starting
+    it again.
+    """
+
+    def __init__(self, gds: str, reports_path: str):
+        self.gds = gds
+        self.reports_path = reports_path
+        self.decks: List[DrcDeck] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._done = threading.Event()
+        self._statuses: Dict[str, int] = {}
+        self._error: Optional[Exception] = None
+
+    @property
+    def threads(self) -> int:
+        return max((int(deck["vars"].get("thr", 1)) for deck in self.decks), default=1)
+
+    def add(self, deck: DrcDeck):
+        self.decks.append(deck)
+
+    def _run(self) -> Dict[str, int]:
+        config_file = os.path.join(self.reports_path, "drc_batch.json")
+        status_file = os.path.join(self.reports_path, "drc_batch_status.json")
+        if os.path.exists(status_file):
+            os.unlink(status_file)
+        with open(config_file, "w") as f:
+            json.dump(
+                {"input": self.gds, "status": status_file, "decks": self.decks},
+                f,
+                indent=2,
+            )
+
+        checks = ", ".join(deck["check"] for deck in self.decks)
+        logging.info(f"Running klayout DRC decks {checks} on {self.gds}")
+        klayout = run_subprocess(
+            ["klayout", "-b", "-r", DRIVER_SCRIPT, "-rd", f"config={config_file}"]
+        )
+        try:
+            with open(status_file) as f:
+                statuses = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.error(f"klayout DRC batch failed (exit code {klayout.returncode})")
+            statuses = {}
+        return statuses
+
+    def run(self, deck: DrcDeck) -> int:
+        """Exit status of the deck, as a separate `klayout -b -r` would have returned."""
+        with self._lock:
+            starting = not self._started
+            self._started = True
+        if starting:
+            try:
+                with cpu_slots_for(self.threads):
+                    self._statuses = self._run()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._done.set()
+        else:
+            scope = current_cancel_scope()
+            while not self._done.wait(CANCEL_POLL_INTERVAL):
+                if scope is not None and scope.cancelled:
+                    raise CheckCancelled(scope.reason)
+        if self._error is not None:
+            raise self._error
+        return self._statuses.get(deck["check"], 1)
@@ -0,0 +1,81 @@
+# Runs several DRC decks in one KLayout process, reading the layout only once.
+#
+# usage: klayout -b -r klayout_drc_batch.rb -rd config=decks.json
+#
+# decks.json holds the input layout, the file to write the per-deck status to,
+# and a list of decks:
+#   {"input": "x.gds", "status": "status.json",
+#    "decks": [{"check": "feol", "script": "sky130A_mr.drc", "vars": {"feol": "true", ...}}]}
+#
+# Each deck runs in its own DRC engine, with its vars set as globals just like
+# `klayout -rd name=value` would (so e.g. `thr` still applies per deck). Globals
+# set for or by a deck are cleared before the next one. `source($input, ...)`
+# gets the already loaded layout instead of reading the file again. A deck
+# calling `exit` only ends that deck; its status is recorded like the exit
+# status of a separate klayout process.
+
+require "json"
+
+config = JSON.parse(File.read($config))
+input = File.expand_path(config["input"])
+
+shared_layout = RBA::Layout::new
+shared_layout.read(input)
+
+class SharedSourceDRCEngine < DRC::DRCEngine
+  def initialize(shared_path, shared_layout)
+    super()
+    @shared_path = shared_path
+    @shared_layout = shared_layout
+  end
+
+  def source(arg = nil, arg2 = nil)
+    if arg.is_a?(String) && File.expand_path(arg) == @shared_path
+      info("Using the already loaded #{arg}")
+      arg = @shared_layout
+    end
+    super(arg, arg2)
+  end
+end
+
+statuses = {}
+config["decks"].each do |deck|
+  check = deck["check"]
+  script = deck["script"]
+  globals_before = global_variables
+
+  deck["vars"].each do |name, value|
+    name =~ /\A[A-Za-z_]\w*\z/ || raise("Invalid variable name #{name}")
+    eval("$#{name} = value")
+  end
+
+  status = 0
+  engine = SharedSourceDRCEngine::new(input, shared_layout)
+  begin
+    engine._start("DRC: #{script}")
+    engine.instance_eval(File.read(script), script)
+  rescue SystemExit => ex
+    status = ex.status
+  rescue Exception => ex
+    engine.error("In #{script}: #{ex}")
+    status = 1
+  ensure
+    begin
+      engine._finish
+    rescue Exception => ex
+      engine.error("In #{script}: #{ex}")
+      status = 1
+    end
+  end
+  puts "DRC deck #{check} finished with status #{status}"
+  statuses[check] = status
+
+  (global_variables - globals_before).each do |name|
+    eval("#{name} = nil")
+  end
+  deck["vars"].each_key do |name|
+    eval("$#{name} = nil")
+  end
+end
+
+File.write(config["status"], JSON.generate(statuses))
@@ -1,5 +1,15 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
 import xml.etree.ElementTree as ET
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from tech_data import lyp_filename
+
+LAYER_TABLE_FORMAT = 1
 
 
 class LayerInfo:
@@ -82,3 +92,116 @@ def parse_lyp_layers(lyp_file: str, only_valid: bool = True):
         )
 
     return layers_dict
+
+
+class LayerTable(Dict[str, LayerInfo]):
+    """Layers of a .lyp file by name, with a reverse lookup by GDS layer / datatype."""
+
+    def __init__(self, layers: Dict[str, LayerInfo]):
+        super().__init__(layers)
+        self.by_number: Dict[Tuple[int, int], str] = {}
+        for name, info in layers.items():
+            # a few layers have several names, keep the first
+            self.by_number.setdefault((info.layer, info.data_type), name)
+
+    def number(self, name: str) -> Tuple[int, int]:
+        info = self[name]
+        return info.layer, info.data_type
+
+    def name(self, layer: int, data_type: int) -> Optional[str]:
+        return self.by_number.get((layer, data_type))
+
+
+_memory_cache: Dict[Tuple[str, bool], Tuple[Tuple[int, int], LayerTable]] = {}
+_memory_cache_lock = threading.Lock()
+
+
+def read_cached_layers(
+    cache_file: str, stamp: Tuple[int, int]
+) -> Optional[Dict[str, LayerInfo]]:
+    try:
+        with open(cache_file) as f:
+            entry = json.load(f)
+        if entry["format"] != LAYER_TABLE_FORMAT or entry["stamp"] != list(stamp):
+            return None
+        return {
+            key: LayerInfo(name, source, layer, data_type)
+            for key, name, source, layer, data_type in entry["layers"]
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cached_layers(
+    cache_file: str,
+    path: str,
+    only_valid: bool,
+    stamp: Tuple[int, int],
+    layers: Dict[str, LayerInfo],
+):
+    rows: List[list] = [
+        [key, info.name, info.source, info.layer, info.data_type]
+        for key, info in layers.items()
+    ]
+    entry = {
+        "format": LAYER_TABLE_FORMAT,
+        "path": path,
+        "only_valid": only_valid,
+        "stamp": list(stamp),
+        "layers": rows,
+    }
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not cache layer table {path}: {e}")
+
+
+def load_lyp_layers(
+    lyp_file: str, only_valid: bool = True, cache_dir: Optional[str] = None
+) -> LayerTable:
+    """`parse_lyp_layers`, reusing an earlier parse while the file is unchanged.
+
+    Tables are kept in memory and, with a `cache_dir`, as JSON in its lyp_layers
+    subdirectory, keyed by the file's path, its modification time and size, and
+    `only_valid`. Treat them as read-only.
+    """
+    path = os.path.realpath(lyp_file)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _memory_cache_lock:
+        cached = _memory_cache.get((path, only_valid))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    cache_file = None
+    layers = None
+    if cache_dir is not None:
+        cache_key = hashlib.sha256(f"{path}:{only_valid}".encode()).hexdigest()[:32]
+        cache_file = os.path.join(cache_dir, "lyp_layers", cache_key + ".json")
+        layers = read_cached_layers(cache_file, stamp)
+    if layers is None:
+        layers = parse_lyp_layers(path, only_valid)
+        if cache_file is not None:
+            write_cached_layers(cache_file, path, only_valid, stamp, layers)
+
+    table = LayerTable(layers)
+    with _memory_cache_lock:
+        _memory_cache[(path, only_valid)] = (stamp, table)
+    return table
+
+
+def pdk_lyp_file(tech: str) -> str:
+    """The .lyp file of a tech, in the PDK selected by $PDK_ROOT and $PDK."""
+    pdk_root = os.getenv("PDK_ROOT")
+    pdk_name = os.getenv("PDK") or "sky130A"
+    return f"{pdk_root}/{pdk_name}/libs.tech/klayout/tech/{lyp_filename[tech]}"
+
+
+def load_tech_layers(
+    tech: str, only_valid: bool = True, cache_dir: Optional[str] = None
+) -> LayerTable:
+    return load_lyp_layers(pdk_lyp_file(tech), only_valid, cache_dir)
@@ -0,0 +1,141 @@
+import logging
+import os
+import tempfile
+import threading
+from typing import List, Optional, Set, Tuple, Union
+
+import gdstk
+import klayout.db as pya
+
+
+class LayoutContext:
+    """Shared, lazily parsed views of a single layout file (GDS or OASIS).
+
+    Each library (gdstk and klayout) parses the file at most once, no matter how
+    many checks ask for it. The parsed objects are shared between checks, which
+    may run concurrently, so checks must treat them as read-only (e.g. work on a
+    `copy()` of a cell rather than filtering or flattening it in place).
+
+    OASIS files are read natively by both libraries. A GDS copy is only written
+    when a tool that can't read OASIS (e.g. magic) asks for `gds_path`, and is
+    removed again by `close()`.
+    """
+
+    def __init__(self, path: str):
+        if not path.endswith((".gds", ".oas")):
+            raise ValueError(f"Unsupported layout file extension: {path}")
+        self.path = path
+        self.is_oasis = path.endswith(".oas")
+        self._gdstk_lock = threading.Lock()
+        self._klayout_lock = threading.Lock()
+        self._gds_lock = threading.Lock()
+        self._hierarchy_lock = threading.Lock()
+        self._hierarchy: Optional[pya.Layout] = None
+        self._gdstk_library: Optional[gdstk.Library] = None
+        self._klayout_layout: Optional[pya.Layout] = None
+        self._gds_temp: Optional[str] = None
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"LayoutContext(path={self.path})"
+
+    @property
+    def gdstk_library(self) -> gdstk.Library:
+        with self._gdstk_lock:
+            if self._gdstk_library is None:
+                logging.info(f"Loading {self.path} with gdstk")
+                if self.is_oasis:
+                    self._gdstk_library = gdstk.read_oas(self.path)
+                else:
+                    self._gdstk_library = gdstk.read_gds(self.path)
+            return self._gdstk_library
+
+    @property
+    def klayout_layout(self) -> pya.Layout:
+        with self._klayout_lock:
+            if self._klayout_layout is None:
+                logging.info(f"Loading {self.path} with klayout")
+                layout = pya.Layout()
+                layout.read(self.path)
+                self._klayout_layout = layout
+            return self._klayout_layout
+
+    @property
+    def hierarchy(self) -> pya.Layout:
+        """The cells and instances of the layout.
+
+        The full klayout layout if it's loaded already. Otherwise, the layout is
+        read without any shapes, which is much cheaper: the reader skips the
+        geometry, so memory use depends on the number of cells and instances only.
+        """
+        # a plain read of the attribute, so as not to wait for a load in progress
+        if self._klayout_layout is not None:
+            return self._klayout_layout
+        with self._hierarchy_lock:
+            if self._hierarchy is None:
+                options = pya.LoadLayoutOptions()
+                options.set_layer_map(pya.LayerMap(), False)  # read no layers
+                layout = pya.Layout()
+                layout.read(self.path, options)
+                self._hierarchy = layout
+            return self._hierarchy
+
+    @property
+    def cell_names(self) -> List[str]:
+        return [cell.name for cell in self.hierarchy.each_cell()]
+
+    @property
+    def layers(self) -> Set[Tuple[int, int]]:
+        """(layer, datatype) pairs holding shapes, texts included (by texttype).
+
+        Read from the layer table of the klayout layout, which the klayout checks
+        load anyway, instead of collecting the layers of every gdstk polygon.
+        """
+        layout = self.klayout_layout
+        layers = set()
+        for layer_index in layout.layer_indexes():
+            if any(
+                not cell.shapes(layer_index).is_empty() for cell in layout.each_cell()
+            ):
+                info = layout.get_info(layer_index)
+                layers.add((info.layer, info.datatype))
+        return layers
+
+    @property
+    def gds_path(self) -> str:
+        """Path of the layout in GDS format, converting (once) if needed."""
+        if not self.is_oasis:
+            return self.path
+        with self._gds_lock:
+            if self._gds_temp is None:
+                fd, gds_temp = tempfile.mkstemp(suffix=".gds")
+                os.close(fd)
+                logging.info(f"Converting {self.path} to {gds_temp}")
+                self.klayout_layout.write(gds_temp)
+                self._gds_temp = gds_temp
+            return self._gds_temp
+
+    def close(self):
+        """Remove any temporary GDS copy, and drop the parsed layouts.
+
+        The context can still be used afterwards, but parses the file again.
+        """
+        with self._gds_lock:
+            if self._gds_temp is not None:
+                os.unlink(self._gds_temp)
+                self._gds_temp = None
+        with self._gdstk_lock:
+            self._gdstk_library = None
+        with self._klayout_lock:
+            self._klayout_layout = None
+        with self._hierarchy_lock:
+            self._hierarchy = None
+
+
+def layout_context(layout: Union[str, LayoutContext]) -> LayoutContext:
+    """Wrap a layout file name in a (private) LayoutContext, or pass through a shared one."""
+    if isinstance(layout, LayoutContext):
+        return layout
+    return LayoutContext(layout)
@@ -0,0 +1,213 @@
+import re
+import threading
+from collections.abc import Iterator
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from precheck_failure import PrecheckFailure
+
+# lef syntax: https://coriolis.lip6.fr/doc/lefdef/lefdefref/LEFSyntax.html
+
+TOKEN_RE = re.compile(r'"[^"]*"|[^\s"#]+|#')
+
+
+def parse_fp3(value: str):
+    # parse fixed-point numbers with 3 digits after the decimal point
+    # e.g. '20.470' to 20470
+    ip, fp = value.split(".")
+    mul = ip + fp[:3].rjust(3, "0")
+    return int(mul)
+
+
+class LefPort:
+    def __init__(self):
+        # rectangles as (layer, lx, by, rx, ty), coordinates in nm
+        self.rects: List[Tuple[str, int, int, int, int]] = []
+        # keywords of any other statements (POLYGON, VIA, ...) found in the port
+        self.other_statements: List[str] = []
+
+    def __repr__(self):
+        return f"LefPort(rects={self.rects}, other_statements={self.other_statements})"
+
+
+class LefPin:
+    def __init__(self, name: str):
+        self.name = name
+        self.direction: Optional[str] = None
+        self.use: Optional[str] = None
+        self.ports: List[LefPort] = []
+
+    @property
+    def rects(self) -> List[Tuple[str, int, int, int, int]]:
+        return [rect for port in self.ports for rect in port.rects]
+
+    def __repr__(self):
+        return f"LefPin(name={self.name}, direction={self.direction}, use={self.use}, ports={self.ports})"
+
+
+class LefMacro:
+    def __init__(self, name: str):
+        self.name = name
+        self.origin: Optional[Tuple[int, int]] = None  # nm
+        self.size: Optional[Tuple[int, int]] = None  # nm
+        self.pins: List[LefPin] = []
+
+    def __repr__(self):
+        return f"LefMacro(name={self.name}, origin={self.origin}, size={self.size}, pins={[pin.name for pin in self.pins]})"
+
+
+class Lef:
+    """Macros, pins and pin geometry of a LEF file.
+
+    Obstructions and library-level definitions (layers, sites, vias) are skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.macros: Dict[str, LefMacro] = {}
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"Lef(path={self.path}, macros={list(self.macros)})"
+
+
+def lef_tokens(f: TextIO) -> Iterator[str]:
+    """Split a LEF file into tokens, one line at a time, dropping comments."""
+    for line in f:
+        for token in TOKEN_RE.findall(line):
+            if token == "#":
+                break
+            yield token
+
+
+class LefParser:
+    def __init__(self, tokens: Iterator[str]):
+        self.tokens = tokens
+        # a statement keyword that was read but not consumed, e.g. the MACRO
+        # starting a new macro while the previous one was not ended
+        self.pushed_back: Optional[str] = None
+
+    def next(self) -> Optional[str]:
+        if self.pushed_back is not None:
+            token, self.pushed_back = self.pushed_back, None
+            return token
+        return next(self.tokens, None)
+
+    def statement(self) -> List[str]:
+        # the remaining tokens of a statement, up to and excluding ";"
+        tokens = []
+        while (token := self.next()) is not None and token != ";":
+            tokens.append(token)
+        return tokens
+
+    def parse(self, lef: Lef):
+        while (token := self.next()) is not None:
+            if token == "MACRO":
+                macro = self.parse_macro(self.next() or "")
+                lef.macros[macro.name] = macro
+            elif token == "PROPERTYDEFINITIONS":
+                # may contain "MACRO <property> <type> ;" definitions
+                while (token := self.next()) is not None and token != "END":
+                    self.statement()
+                self.next()
+            elif token == "END":
+                if self.next() == "LIBRARY":
+                    return
+            else:
+                # library-level statement, or the contents of a block we don't need
+                self.statement()
+
+    def parse_macro(self, name: str) -> LefMacro:
+        macro = LefMacro(name)
+        while (token := self.next()) is not None:
+            if token == "ORIGIN":
+                x, y, *_ = self.statement()
+                macro.origin = (parse_fp3(x), parse_fp3(y))
+            elif token == "SIZE":
+                width, _, height, *_ = self.statement()
+                macro.size = (parse_fp3(width), parse_fp3(height))
+            elif token == "PIN":
+                macro.pins.append(self.parse_pin(self.next() or ""))
+            elif token == "OBS":
+                while (token := self.next()) is not None and token != "END":
+                    self.statement()
+            elif token == "PORT":
+                raise PrecheckFailure("Unexpected token in LEF: PORT outside of PIN")
+            elif token == "MACRO":
+                # previous macro not ended
+                self.pushed_back = token
+                break
+            elif token == "END":
+                if self.next() == name:
+                    break
+            else:
+                self.statement()
+        return macro
+
+    def parse_pin(self, name: str) -> LefPin:
+        pin = LefPin(name)
+        while (token := self.next()) is not None:
+            if token == "DIRECTION":
+                pin.direction = " ".join(self.statement())
+            elif token == "USE":
+                pin.use = " ".join(self.statement())
+            elif token == "PORT":
+                pin.ports.append(self.parse_port())
+            elif token == "PIN":
+                new_pin = self.next()
+                raise PrecheckFailure(
+                    f"Unexpected token in LEF: pin {new_pin} starts without ending previous pin {name}"
+                )
+            elif token == "END":
+                if self.next() == name:
+                    break
+            else:
+                self.statement()
+        return pin
+
+    def parse_port(self) -> LefPort:
+        port = LefPort()
+        layer = None
+        while (token := self.next()) is not None and token != "END":
+            args = self.statement()
+            if token == "LAYER" and args:
+                layer = args[0]
+            elif token == "RECT" and layer is not None:
+                if args[0] == "MASK":
+                    args = args[2:]
+                lx, by, rx, ty = map(parse_fp3, args)
+                port.rects.append((layer, lx, by, rx, ty))
+            else:
+                port.other_statements.append(token)
+        return port
+
+
+def parse_lef(path: str) -> Lef:
+    """Read the macros of a LEF file in a single streaming pass."""
+    lef = Lef(path)
+    with open(path) as f:
+        LefParser(lef_tokens(f)).parse(lef)
+    return lef
+
+
+def lef_model(lef: str | Lef) -> Lef:
+    """Parse a LEF file name, or pass through an already parsed LEF."""
+    if isinstance(lef, Lef):
+        return lef
+    return parse_lef(lef)
+
+
+class LazyLef:
+    """Parses a LEF file on first use, once, for checks that may run concurrently."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._lef: Optional[Lef] = None
+
+    def get(self) -> Lef:
+        with self._lock:
+            if self._lef is None:
+                self._lef = parse_lef(self.path)
+            return self._lef
@@ -19,6 +19,8 @@ set DESIGN_NAME [lindex $argv 7]
 set PDK_PATH [lindex $argv 8]
 set DRC_REPORT [lindex $argv 9]
 set DRC_MAG [lindex $argv 10]
+# optional: only check the area "llx lly urx ury" (microns) instead of the whole cell
+set DRC_AREA [lrange $argv 11 14]
 
 gds maskhints yes
 gds read $GDS_UT_PATH
@@ -32,6 +34,14 @@ flush stdout
 load $cell_name
 select top cell
 expand
+if {[llength $DRC_AREA] == 4} {
+	set area {}
+	foreach v $DRC_AREA {
+		lappend area [expr {round($v / $oscale)}]
+	}
+	box values {*}$area
+	puts stdout "\[INFO\]: Checking area $DRC_AREA\n"
+}
 drc euclidean on
 drc style drc(full)
 drc check
@@ -0,0 +1,176 @@
+import math
+from typing import Dict, List, Optional, TextIO, Tuple
+
+# More than the largest rule distance of the magic DRC decks, in microns: a
+# violation centered in a tile lies within the area checked for it.
+MAGIC_DRC_HALO = 20.0
+
+Box = Tuple[float, float, float, float]  # llx, lly, urx, ury (microns)
+
+SEPARATOR = "----------------------------------------"
+
+
+class DrcTile:
+    def __init__(self, core: Box, area: Box):
+        # violations centered in `core` are reported by this tile (the cores of the
+        # tiles on the die edges extend to infinity, so none are lost)
+        self.core = core
+        # the area magic checks: the tile on the die, grown by the halo
+        self.area = area
+
+    def owns(self, box: Box) -> bool:
+        x = (box[0] + box[2]) / 2
+        y = (box[1] + box[3]) / 2
+        llx, lly, urx, ury = self.core
+        return llx <= x < urx and lly <= y < ury
+
+    def __repr__(self):
+        return f"DrcTile(core={self.core}, area={self.area})"
+
+
+def tile_grid(width: float, height: float, count: int) -> Tuple[int, int]:
+    """Columns and rows for splitting a die into `count` tiles, closest to square."""
+    best: Optional[Tuple[float, int, int]] = None
+    for columns in range(1, count + 1):
+        if count % columns:
+            continue
+        rows = count // columns
+        aspect = abs(math.log((width / columns) / (height / rows)))
+        if best is None or aspect < best[0]:
+            best = (aspect, columns, rows)
+    assert best is not None
+    return best[1], best[2]
+
+
+def drc_tiles(die: Box, count: int, halo: float = MAGIC_DRC_HALO) -> List[DrcTile]:
+    llx, lly, urx, ury = die
+    columns, rows = tile_grid(max(urx - llx, 1e-3), max(ury - lly, 1e-3), count)
+    xs = [llx + (urx - llx) * i / columns for i in range(columns + 1)]
+    ys = [lly + (ury - lly) * j / rows for j in range(rows + 1)]
+    tiles = []
+    for j in range(rows):
+        for i in range(columns):
+            core = (
+                xs[i] if i > 0 else -math.inf,
+                ys[j] if j > 0 else -math.inf,
+                xs[i + 1] if i < columns - 1 else math.inf,
+                ys[j + 1] if j < rows - 1 else math.inf,
+            )
+            area = (xs[i] - halo, ys[j] - halo, xs[i + 1] + halo, ys[j + 1] + halo)
+            tiles.append(DrcTile(core, area))
+    return tiles
+
+
+class MagicDrcReport:
+    """Violations listed in a report written by magic_drc.tcl, by error type."""
+
+    def __init__(self, cell: str):
+        self.cell = cell
+        self.violations: Dict[str, List[Box]] = {}
+
+    @property
+    def count(self) -> int:
+        return sum(len(boxes) for boxes in self.violations.values())
+
+    def add(self, error: str, box: Box):
+        self.violations.setdefault(error, []).append(box)
+
+    def write(self, f: TextIO):
+        f.write(f"{self.cell}\n{SEPARATOR}\n")
+        for error, boxes in self.violations.items():
+            f.write(f"{error}\n{SEPARATOR}\n")
+            for box in boxes:
+                f.write(" %.3f %.3f %.3f %.3f\n" % box)
+            f.write(f"{SEPARATOR}\n")
+        f.write(f"[INFO]: COUNT: {self.count}\n")
+        f.write("[INFO]: Should be divided by 3 or 4\n\n")
+
+
+def parse_magic_drc_report(f: TextIO) -> MagicDrcReport:
+    lines = [line.rstrip("\n") for line in f]
+    report = MagicDrcReport(lines[0] if lines else "")
+    error = None
+    for line in lines[2:]:
+        if line.startswith("[INFO]"):
+            break
+        elif line == SEPARATOR:
+            continue
+        elif line.startswith(" "):
+            if error is None:
+                raise ValueError(f"Violation without an error type: {line}")
+            llx, lly, urx, ury = map(float, line.split())
+            report.add(error, (llx, lly, urx, ury))
+        else:
+            error = line
+    return report
+
+
+def merge_tile_reports(
+    tiles: List[DrcTile], reports: List[MagicDrcReport]
+) -> MagicDrcReport:
+    """Merge per-tile reports, keeping each violation once, from the tile it's centered in.
+
+    Violations found by several tiles (in their halos) are dropped by all but the
+    tile owning them, and exact duplicates within a tile are dropped too.
+    """
+    merged = MagicDrcReport(reports[0].cell if reports else "")
+    seen = set()
+    for tile, report in zip(tiles, reports):
+        for error, boxes in report.violations.items():
+            for box in boxes:
+                if tile.owns(box) and (error, box) not in seen:
+                    seen.add((error, box))
+                    merged.add(error, box)
+    return merged
+
+
+# the paint layers magic marks DRC violations with in a saved .mag
+MAG_ERROR_LAYERS = ("error_p", "error_s", "error_ps")
+
+
+def _mag_sections(text: str) -> List[Tuple[Optional[str], List[str]]]:
+    # the lines before the first section go in a section without a name
+    sections: List[Tuple[Optional[str], List[str]]] = [(None, [])]
+    for line in text.splitlines():
+        if line.startswith("<< ") and line.endswith(" >>"):
+            sections.append((line[3:-3], []))
+        else:
+            sections[-1][1].append(line)
+    return sections
+
+
+def merge_tile_mags(mags: List[str]) -> str:
+    """Merge the .mag views saved by the tiles into one, holding all their DRC markers.
+
+    Every tile saves the whole layout, but only paints the violations found in
+    the area it checked. The first view is kept, with the error paint of all the
+    views in place of its own. Markers found by several tiles (in their halos)
+    are kept once.
+    """
+    views = [_mag_sections(mag) for mag in mags]
+    markers: Dict[str, List[str]] = {}
+    for view in views:
+        for name, lines in view:
+            if name in MAG_ERROR_LAYERS:
+                layer_markers = markers.setdefault(name, [])
+                layer_markers.extend(
+                    line for line in lines if line not in layer_markers
+                )
+
+    base = views[0]
+    present = [name for name, _ in base if name in MAG_ERROR_LAYERS]
+    # error layers the first view lacks go with the other paint: after its last
+    # error layer, or its checkpaint, or else the header
+    anchors = present[-1:] or [name for name, _ in base if name == "checkpaint"]
+    anchor = anchors[0] if anchors else None
+    output = []
+    for name, lines in base:
+        if name is not None:
+            output.append(f"<< {name} >>")
+        output.extend(markers[name] if name in MAG_ERROR_LAYERS else lines)
+        if name == anchor:
+            for layer in MAG_ERROR_LAYERS:
+                if layer in markers and layer not in present:
+                    output.append(f"<< {layer} >>")
+                    output.extend(markers[layer])
+    return "\n".join(output) + "\n"
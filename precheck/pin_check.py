@@ -1,13 +1,17 @@
 import logging
-import re
+import math
+from bisect import bisect_left, bisect_right, insort
 from collections.abc import Iterable
-from functools import partial
-from itertools import combinations
+from heapq import heappop, heappush
 from numbers import Real
 
 import gdstk
+from klayout_tools import load_tech_layers
+from layout_context import LayoutContext, layout_context
+from lef_parser import Lef, LefMacro, lef_model
 from precheck_failure import PrecheckFailure
-from tech_data import power_pins_layer, power_pins_min_width, valid_lef_port_layers
+from tech_data import lef_port_layers, power_pins_layer, power_pins_min_width
+from template_def import load_template_def
 
 
 def canonicalize_rectangles(
@@ -15,101 +19,269 @@ def canonicalize_rectangles(
 ) -> Iterable[Iterable[Real]]:
     # lists all maximal rectangles covered by the union of input rectangles
 
+    # x coordinates are compressed to indices, segment i being (xs[i], xs[i + 1])
+    rects = list(rects)
+    xs = sorted(set(x for lx, _, rx, _ in rects for x in (lx, rx)))
+    x_index = {x: i for i, x in enumerate(xs)}
     sweep_events = {}
     for lx, by, rx, ty in rects:
-        sweep_events[by] = sweep_events.get(by, {})
-        sweep_events[by][lx] = sweep_events[by].get(lx, 0) + 1
-        sweep_events[by][rx] = sweep_events[by].get(rx, 0) - 1
-        sweep_events[ty] = sweep_events.get(ty, {})
-        sweep_events[ty][lx] = sweep_events[ty].get(lx, 0) - 1
-        sweep_events[ty][rx] = sweep_events[ty].get(rx, 0) + 1
-
+        a, b = x_index[lx], x_index[rx]
+        sweep_events.setdefault(by, []).append((a, b, 1))
+        sweep_events.setdefault(ty, []).append((a, b, -1))
+
+    # sweep a horizontal line from bottom to top. The cross section is kept as
+    # per-segment coverage counts, plus the maximal covered intervals (as
+    # segment index ranges) in a sorted list. Open rectangles are keyed by
+    # their x range, with the keys also kept sorted so that the ones touching
+    # a given x range can be found by bisection.
+    coverage = [0] * len(xs)
+    covered_intervals = []
     closed_rects = []
     open_rects = {}
-    cross_section_events = {}
+    open_keys = []
+
+    def find_interval(s):
+        # the covered interval containing segment s
+        return covered_intervals[bisect_right(covered_intervals, (s, len(xs))) - 1]
+
     for y, sweep_line_events in sorted(sweep_events.items()):
-        old_multiplicity = 0
-        new_multiplicity = 0
-        is_covered, covered_intervals, covered_start = False, [], None
-        is_removed, removed_intervals, removed_start = False, [], None
-        for x in sorted(set(cross_section_events).union(sweep_line_events)):
-            old_delta = cross_section_events.get(x, 0)
-            new_delta = sweep_line_events.get(x, 0) + old_delta
-            old_multiplicity += old_delta
-            new_multiplicity += new_delta
-            assert old_multiplicity >= 0
-            assert new_multiplicity >= 0
-            was_covered, was_removed = is_covered, is_removed
-            is_covered = new_multiplicity > 0
-            is_removed = old_multiplicity > 0 and new_multiplicity == 0
-            if was_covered and not is_covered:
-                assert covered_start is not None
-                covered_intervals.append((covered_start, x))
-                covered_start = None
-            if was_removed and not is_removed:
-                assert removed_start is not None
-                removed_intervals.append((removed_start, x))
-                removed_start = None
-            if is_covered and not was_covered:
-                assert covered_start is None
-                covered_start = x
-            if is_removed and not was_removed:
-                assert removed_start is None
-                removed_start = x
-
-        for x, m in sorted(sweep_line_events.items()):
-            cross_section_events[x] = cross_section_events.get(x, 0) + m
-            if cross_section_events[x] == 0:
-                del cross_section_events[x]
-
-        for (lx, rx), by in open_rects.items():
-            closed = False
-            for ix, jx in removed_intervals:
-                if ix < rx and lx < jx:
-                    closed = True
-            if closed:
-                closed_rects.append((lx, by, rx, y))
-
-        kept_intervals = [
-            (b, c)
-            for ((a, b), (c, d)) in zip(
-                [(None, None)] + removed_intervals, removed_intervals + [(None, None)]
-            )
-        ]
-        open_rects_new = {}
-        for ix, jx in covered_intervals:
-            open_rects_new[(ix, jx)] = y
-        for (lx, rx), by in open_rects.items():
-            for ix, jx in kept_intervals:
-                if (ix is None or ix < rx) and (jx is None or lx < jx):
-                    clx = lx if ix is None else max(lx, ix)
-                    crx = rx if jx is None else min(rx, jx)
-                    open_rects_new[(clx, crx)] = min(
-                        open_rects_new.get((clx, crx), by), by
-                    )
-        open_rects = open_rects_new
+        old_coverage = {}
+        for a, b, m in sweep_line_events:
+            for s in range(a, b):
+                old_coverage.setdefault(s, coverage[s])
+                coverage[s] += m
+                assert coverage[s] >= 0
+
+        # maximal runs of segments that lost or gained all coverage on this line
+        removed_runs, added_runs = [], []
+        for s in sorted(old_coverage):
+            old, new = old_coverage[s] > 0, coverage[s] > 0
+            if old == new:
+                continue
+            runs = removed_runs if old else added_runs
+            if runs and runs[-1][1] == s:
+                runs[-1][1] = s + 1
+            else:
+                runs.append([s, s + 1])
+
+        # close the open rectangles crossing a removed run; they all lie within
+        # the (old) covered interval containing the run
+        closing = set()
+        for ix, jx in removed_runs:
+            start, _ = find_interval(ix)
+            first = bisect_left(open_keys, (start,))
+            last = bisect_left(open_keys, (jx,))
+            for lx, rx in open_keys[first:last]:
+                if ix < rx:
+                    closing.add((lx, rx))
+        for key in sorted(closing):
+            del open_keys[bisect_left(open_keys, key)]
+        removed_ends = [jx for _, jx in removed_runs]
+        pieces = []
+        for lx, rx in sorted(closing):
+            by = open_rects.pop((lx, rx))
+            closed_rects.append((xs[lx], by, xs[rx], y))
+            # the parts outside the removed runs stay open
+            for ix, jx in removed_runs[bisect_right(removed_ends, lx) :]:
+                if ix >= rx:
+                    break
+                if lx < ix:
+                    pieces.append(((lx, ix), by))
+                lx = jx
+            if lx < rx:
+                pieces.append(((lx, rx), by))
+        for key, by in pieces:
+            if key in open_rects:
+                open_rects[key] = min(open_rects[key], by)
+            else:
+                open_rects[key] = by
+                insort(open_keys, key)
+
+        for ix, jx in removed_runs:
+            index = bisect_right(covered_intervals, (ix, len(xs))) - 1
+            start, end = covered_intervals[index]
+            covered_intervals[index : index + 1] = [
+                (a, b) for a, b in ((start, ix), (jx, end)) if a < b
+            ]
+        for ix, jx in added_runs:
+            # merge with the covered intervals it touches
+            first = last = bisect_left(covered_intervals, (ix,))
+            if first > 0 and covered_intervals[first - 1][1] == ix:
+                first -= 1
+                ix = covered_intervals[first][0]
+            if last < len(covered_intervals) and covered_intervals[last][0] == jx:
+                jx = covered_intervals[last][1]
+                last += 1
+            covered_intervals[first:last] = [(ix, jx)]
+
+        # a newly covered run opens a rectangle spanning its covered interval
+        for ix, _ in added_runs:
+            key = find_interval(ix)
+            if key not in open_rects:
+                open_rects[key] = y
+                insort(open_keys, key)
 
     return sorted(set(closed_rects))
 
 
-def parse_fp3(value: str):
-    # parse fixed-point numbers with 3 digits after the decimal point
-    # e.g. '20.470' to 20470
-    ip, fp = value.split(".")
-    mul = ip + fp[:3].rjust(3, "0")
-    return int(mul)
-
+class _ActiveRanges:
+    """The y-ranges of the rectangles crossing the sweep line, by rectangle index.
+
+    Finds the ranges overlapping a query range in O(log n + k): those containing
+    its bottom edge from a segment tree over the y coordinates (each range is kept
+    in the O(log n) nodes making up its span, so the ranges containing a point lie
+    on the path to its leaf), and those starting above it by bisecting a sorted
+    list of bottom edges.
+    """
+
+    def __init__(self, ys: list[int]):
+        self.ys = ys  # sorted, distinct
+        self.size = 1 << max(len(ys) - 1, 0).bit_length()
+        self.nodes: list[set[int]] = [set() for _ in range(2 * self.size)]
+        self.bottoms: list[tuple[int, int]] = []  # (bottom leaf, index)
+
+    def _leaves(self, by: int, ty: int) -> tuple[int, int]:
+        return bisect_left(self.ys, by), bisect_left(self.ys, ty)
+
+    def _span(self, by: int, ty: int) -> Iterable[set[int]]:
+        lo, hi = self._leaves(by, ty)
+        lo, hi = lo + self.size, hi + self.size + 1
+        while lo < hi:
+            if lo & 1:
+                yield self.nodes[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                yield self.nodes[hi]
+            lo >>= 1
+            hi >>= 1
+
+    def add(self, index: int, by: int, ty: int):
+        for node in self._span(by, ty):
+            node.add(index)
+        insort(self.bottoms, (self._leaves(by, ty)[0], index))
+
+    def remove(self, index: int, by: int, ty: int):
+        for node in self._span(by, ty):
+            node.discard(index)
+        bottom = (self._leaves(by, ty)[0], index)
+        del self.bottoms[bisect_left(self.bottoms, bottom)]
+
+    def overlapping(self, by: int, ty: int) -> Iterable[int]:
+        lo, hi = self._leaves(by, ty)
+        node = lo + self.size
+        while node:
+            yield from self.nodes[node]
+            node >>= 1
+        start = bisect_right(self.bottoms, (lo, math.inf))
+        end = bisect_right(self.bottoms, (hi, math.inf))
+        for _, index in self.bottoms[start:end]:
+            yield index
+
+
+def find_overlapping_ports(
+    ports: dict[str, list[tuple[str, int, int, int, int]]],
+) -> list[tuple[str, str]]:
+    # lists a (pin1, pin2) entry for every pair of rectangles of different pins
+    # on the same layer that overlap or abut, ordered by pin names, then by the
+    # rectangles' positions in the port lists
+
+    rects_by_layer = {}
+    for pin, rects in ports.items():
+        for index, (layer, lx, by, rx, ty) in enumerate(rects):
+            rects_by_layer.setdefault(layer, []).append((lx, by, rx, ty, pin, index))
+
+    # sweep a vertical line from left to right over each layer, keeping the
+    # rectangles that still touch the line in a heap ordered by their right
+    # edge, and their y-ranges in a structure that finds the overlapping ones
+    overlaps = []
+    for rects in rects_by_layer.values():
+        rects.sort()
+        ys = sorted({y for _, by, _, ty, _, _ in rects for y in (by, ty)})
+        active = _ActiveRanges(ys)
+        ending: list[tuple[int, int]] = []
+        for i, (lx, by, rx, ty, pin, index) in enumerate(rects):
+            while ending and ending[0][0] < lx:
+                _, j = heappop(ending)
+                active.remove(j, rects[j][1], rects[j][3])
+            for j in active.overlapping(by, ty):
+                _, _, _, _, other_pin, other_index = rects[j]
+                if other_pin != pin:
+                    overlaps.append(
+                        min(
+                            (pin, other_pin, index, other_index),
+                            (other_pin, pin, other_index, index),
+                        )
+                    )
+            active.add(i, by, ty)
+            heappush(ending, (rx, i))
+
+    return [(pin1, pin2) for pin1, pin2, _, _ in sorted(overlaps)]
+
+
+class PolygonIndex:
+    """Grid bucket index over the bounding boxes of a list of gdstk polygons.
+
+    The grid pitch follows the median polygon size, so a typical polygon lands in
+    a handful of buckets. Polygons spanning too many buckets (e.g. a power ring)
+    are kept in a separate list that every query returns. Likewise, a query box
+    spanning too many buckets (e.g. a long stripe among tiny shapes) is answered
+    by scanning all bounding boxes instead.
+    """
+
+    MAX_BUCKETS_PER_POLYGON = 64
+    MAX_BUCKETS_PER_QUERY = 4096
+
+    def __init__(self, polygons: list[gdstk.Polygon]):
+        self.polygons = polygons
+        self.buckets: dict[tuple[int, int], list[int]] = {}
+        self.large: list[int] = []
+        self.boxes = boxes = [poly.bounding_box() for poly in polygons]
+        sizes = sorted(max(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in boxes)
+        self.pitch = max(sizes[len(sizes) // 2], 1e-3) if sizes else 1.0
+        for index, ((x0, y0), (x1, y1)) in enumerate(boxes):
+            i0, j0, i1, j1 = self._cells(x0, y0, x1, y1)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > self.MAX_BUCKETS_PER_POLYGON:
+                self.large.append(index)
+                continue
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.buckets.setdefault((i, j), []).append(index)
+
+    def _cells(self, x0: float, y0: float, x1: float, y1: float):
+        return (
+            math.floor(x0 / self.pitch),
+            math.floor(y0 / self.pitch),
+            math.floor(x1 / self.pitch),
+            math.floor(y1 / self.pitch),
+        )
 
-def parse_dbu_to_nm(value: str, dbu_per_micron: int):
-    # parse a value in database units into nanometers
-    assert dbu_per_micron != 0
-    val_dbu = int(value)
-    assert (val_dbu * 1000) % dbu_per_micron == 0
-    return (val_dbu * 1000) // dbu_per_micron
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> list[gdstk.Polygon]:
+        """Polygons whose bounding box may overlap the given box, in list order."""
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        i0, j0, i1, j1 = self._cells(x0, y0, x1, y1)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > self.MAX_BUCKETS_PER_QUERY:
+            return [
+                poly
+                for poly, ((px0, py0), (px1, py1)) in zip(self.polygons, self.boxes)
+                if px0 <= x1 and x0 <= px1 and py0 <= y1 and y0 <= py1
+            ]
+        candidates = set(self.large)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                candidates.update(self.buckets.get((i, j), ()))
+        return [self.polygons[index] for index in sorted(candidates)]
 
 
 def pin_check(
-    gds: str, lef: str, template_def: str, toplevel: str, uses_3v3: bool, tech: str
+    gds: str | LayoutContext,
+    lef: str | Lef,
+    template_def: str,
+    toplevel: str,
+    uses_3v3: bool,
+    tech: str,
+    cache_dir: str | None = None,
 ):
     logging.info("Running pin check...")
     logging.info(f"* gds: {gds}")
@@ -118,160 +290,47 @@ def pin_check(
     logging.info(f"* toplevel: {toplevel}")
     logging.info(f"* uses_3v3: {uses_3v3}")
 
-    # parse pins from template def
-    # def syntax: https://coriolis.lip6.fr/doc/lefdef/lefdefref/DEFSyntax.html
-
-    units_re = re.compile(r"UNITS DISTANCE MICRONS (\S+) ;")
-    diearea_re = re.compile(r"DIEAREA \( (\S+) (\S+) \) \( (\S+) (\S+) \) ;")
-    pins_re = re.compile(r"PINS (\d+) ;")
-    pin_re = re.compile(r" *- (\S+) \+ NET (\S+) \+ DIRECTION (\S+) \+ USE (\S+)")
-    layer_re = re.compile(r" *\+ LAYER (\S+) \( (\S+) (\S+) \) \( (\S+) (\S+) \)")
-    placed_re = re.compile(r" *\+ PLACED \( (\S+) (\S+) \) (\S+) ;")
-
-    def_pins = {}
-    dbu_per_micron = 0
-    die_width = 0
-    die_height = 0
-
-    with open(template_def) as f:
-        for line in f:
-            if line.startswith("UNITS "):
-                match = units_re.match(line)
-                (dbu_per_micron,) = map(int, match.groups())
-                parse_nm = partial(parse_dbu_to_nm, dbu_per_micron=dbu_per_micron)
-            elif line.startswith("DIEAREA "):
-                match = diearea_re.match(line)
-                lx, by, rx, ty = map(parse_nm, match.groups())
-                if (lx, by) != (0, 0):
-                    raise PrecheckFailure(
-                        "Wrong die origin in template DEF, expecting (0, 0)"
-                    )
-                die_width = rx
-                die_height = ty
-            elif line.startswith("PINS "):
-                match = pins_re.match(line)
-                pin_count = int(match.group(1))
-                break
-
-        for i in range(pin_count):
-            line = next(f)
-            match = pin_re.match(line)
-            pin_name, net_name, direction, use = match.groups()
-            if pin_name != net_name:
-                raise PrecheckFailure(
-                    f"Inconsistent pin name and net name in template DEF: {pin_name} vs {net_name}"
-                )
-
-            line = next(f)
-            if not line.strip().startswith("+ PORT"):
-                raise PrecheckFailure(
-                    "Unexpected token in template DEF: PINS not followed by PORT"
-                )
+    template = load_template_def(template_def, cache_dir)
+    def_pins = template["pins"]
+    die_width = template["die_width"]
+    die_height = template["die_height"]
 
-            line = next(f)
-            match = layer_re.match(line)
-            layer, lx, by, rx, ty = match.groups()
-            lx, by, rx, ty = map(parse_nm, (lx, by, rx, ty))
-
-            line = next(f)
-            match = placed_re.match(line)
-            ox, oy, direction = match.groups()
-            ox, oy = map(parse_nm, (ox, oy))
-
-            if pin_name in def_pins:
-                raise PrecheckFailure("Duplicate pin in template DEF")
-
-            def_pins[pin_name] = (layer, ox + lx, oy + by, ox + rx, oy + ty)
-
-        line = next(f)
-        if not line.startswith("END PINS"):
-            raise PrecheckFailure(
-                f"Unexpected token in template DEF: PINS {pin_count} section does not end after {pin_count} pins"
-            )
-
-    # parse pins from user lef
-    # lef syntax: https://coriolis.lip6.fr/doc/lefdef/lefdefref/LEFSyntax.html
-
-    origin_re = re.compile(r"ORIGIN (\S+) (\S+) ;")
-    size_re = re.compile(r"SIZE (\S+) BY (\S+) ;")
-    layer_re = re.compile(r"LAYER (\S+) ;")
-    rect_re = re.compile(r"RECT (\S+) (\S+) (\S+) (\S+) ;")
+    # pins from user lef
 
     power_pins = ["VGND", "VDPWR"]
     if uses_3v3:
         power_pins.append("VAPWR")
     compat_pins = {"VPWR": "VDPWR"}
 
-    macro_active = False
     pins_expected = set(def_pins).union(power_pins).union(compat_pins)
-    pins_seen = set()
-    current_pin = None
-    pin_rects = 0
     lef_errors = 0
     lef_ports = {}
 
-    with open(lef) as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith("MACRO "):
-                if line == "MACRO " + toplevel:
-                    macro_active = True
-                else:
-                    macro_active = False
-            elif macro_active:
-                if line.startswith("ORIGIN "):
-                    match = origin_re.match(line)
-                    lx, by = map(parse_fp3, match.groups())
-                    if lx != 0 or by != 0:
-                        raise PrecheckFailure(
-                            "Wrong die origin in LEF, expecting (0, 0)"
-                        )
-                elif line.startswith("SIZE "):
-                    match = size_re.match(line)
-                    rx, ty = map(parse_fp3, match.groups())
-                    if (rx, ty) != (die_width, die_height):
-                        raise PrecheckFailure(
-                            f"Inconsistent die area between LEF and template DEF: ({rx}, {ty}) != ({die_width}, {die_height})"
-                        )
-                elif line.startswith("PIN "):
-                    if current_pin is not None:
-                        new_pin = line.removeprefix("PIN ")
-                        raise PrecheckFailure(
-                            f"Unexpected token in LEF: pin {new_pin} starts without ending previous pin {current_pin}"
-                        )
-                    current_pin = line.removeprefix("PIN ")
-                    pins_seen.add(current_pin)
-                    if current_pin not in pins_expected:
-                        logging.error(f"Unexpected pin {current_pin} in {lef}")
-                        lef_errors += 1
-                    pin_rects = 0
-                elif line == "PORT":
-                    if current_pin is None:
-                        raise PrecheckFailure(
-                            "Unexpected token in LEF: PORT outside of PIN"
-                        )
-                    line = next(f).strip()
-                    while line.startswith("LAYER "):
-                        match = layer_re.match(line)
-                        layer = match.group(1)
-                        line = next(f).strip()
-                        while line.startswith("RECT "):
-                            match = rect_re.match(line)
-                            lx, by, rx, ty = map(parse_fp3, match.groups())
-                            pin_rects += 1
-                            if current_pin not in lef_ports:
-                                lef_ports[current_pin] = []
-                            lef_ports[current_pin].append((layer, lx, by, rx, ty))
-                            line = next(f).strip()
-                    if line != "END":
-                        raise PrecheckFailure(
-                            "Unexpected token in LEF: LAYER within PORT should be followed by RECT or LAYER lines until END of port"
-                        )
-                elif current_pin is not None and line.startswith("END " + current_pin):
-                    if pin_rects < 1:
-                        logging.error(f"No ports for pin {current_pin} in {lef}")
-                        lef_errors += 1
-                    current_pin = None
+    lef = lef_model(lef)
+    macro = lef.macros.get(toplevel)
+    if macro is None:
+        macro = LefMacro(toplevel)
+    if macro.origin is not None and macro.origin != (0, 0):
+        raise PrecheckFailure("Wrong die origin in LEF, expecting (0, 0)")
+    if macro.size is not None and macro.size != (die_width, die_height):
+        rx, ty = macro.size
+        raise PrecheckFailure(
+            f"Inconsistent die area between LEF and template DEF: ({rx}, {ty}) != ({die_width}, {die_height})"
+        )
+    for pin in macro.pins:
+        if pin.name not in pins_expected:
+            logging.error(f"Unexpected pin {pin.name} in {lef}")
+            lef_errors += 1
+        if any(port.other_statements for port in pin.ports):
+            raise PrecheckFailure(
+                "Unexpected token in LEF: LAYER within PORT should be followed by RECT or LAYER lines until END of port"
+            )
+        pin_rects = pin.rects
+        if len(pin_rects) < 1:
+            logging.error(f"No ports for pin {pin.name} in {lef}")
+            lef_errors += 1
+        else:
+            lef_ports.setdefault(pin.name, []).extend(pin_rects)
 
     lef_ports_orig = lef_ports
     lef_ports = {}
@@ -355,24 +414,16 @@ def pin_check(
 
     # check for overlapping pins
 
-    for (pin1, rects1), (pin2, rects2) in combinations(sorted(lef_ports.items()), 2):
-        for layer1, lx1, by1, rx1, ty1 in rects1:
-            for layer2, lx2, by2, rx2, ty2 in rects2:
-                if layer1 != layer2:
-                    continue
-                if rx1 < lx2 or rx2 < lx1:
-                    continue
-                if ty1 < by2 or ty2 < by1:
-                    continue
-                logging.error(
-                    f"Overlapping pins in {lef}: {pin1} and {pin2}."
-                    "All exported pins have to be separate, and must not overlap or abut."
-                )
-                lef_errors += 1
+    for pin1, pin2 in find_overlapping_ports(lef_ports):
+        logging.error(
+            f"Overlapping pins in {lef}: {pin1} and {pin2}."
+            "All exported pins have to be separate, and must not overlap or abut."
+        )
+        lef_errors += 1
 
     # check gds for the ports being present
 
-    lib = gdstk.read_gds(gds)
+    lib = layout_context(gds).gdstk_library
     top = [cell for cell in lib.top_level() if cell.name == toplevel]
     if not top:
         raise PrecheckFailure("Wrong cell at GDS top-level")
@@ -381,7 +432,8 @@ def pin_check(
     gds_errors = 0
 
     if tech != "gf180mcuD":
-        gds_layers = valid_lef_port_layers[tech]
+        layers = load_tech_layers(tech, only_valid=False, cache_dir=cache_dir)
+        gds_layers = {name: layers.number(name) for name in lef_port_layers[tech]}
         gds_layer_lookup = {j: i for i, j in gds_layers.items()}
         polygon_list = {layer: [] for layer in gds_layers}
         for poly in top.polygons:
@@ -389,9 +441,11 @@ def pin_check(
             layer_name = gds_layer_lookup.get(poly_layer, None)
             if layer_name is not None:
                 polygon_list[layer_name].append(poly)
-        merged_layers = {}
+        merged_index = {}
         for layer in gds_layers:
-            merged_layers[layer] = gdstk.boolean(polygon_list[layer], [], "or")
+            merged_index[layer] = PolygonIndex(
+                gdstk.boolean(polygon_list[layer], [], "or")
+            )
 
         for current_pin, lef_rects in sorted(lef_ports_orig.items()):
             for layer, lx, by, rx, ty in lef_rects:
@@ -401,14 +455,12 @@ def pin_check(
                     )
 
                 pin_ok = False
-                for poly in merged_layers[layer + ".pin"]:
-                    if poly.contain_all(
-                        ((lx + 1) / 1000, (by + 1) / 1000),
-                        ((rx - 1) / 1000, (by + 1) / 1000),
-                        ((lx + 1) / 1000, (ty - 1) / 1000),
-                        ((rx - 1) / 1000, (ty - 1) / 1000),
-                    ):
+                x0, y0 = (lx + 1) / 1000, (by + 1) / 1000
+                x1, y1 = (rx - 1) / 1000, (ty - 1) / 1000
+                for poly in merged_index[layer + ".pin"].query(x0, y0, x1, y1):
+                    if poly.contain_all((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
                         pin_ok = True
+                        break
 
                 if not pin_ok:
                     logging.error(
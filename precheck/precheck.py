@@ -1,33 +1,46 @@
 #!/usr/bin/env python3
 import argparse
+import functools
 import logging
 import os
 import re
-import subprocess
-import tempfile
-import time
-import traceback
+import shutil
 import xml.etree.ElementTree as ET
 
-import gdstk
 import klayout.db as pya
-import klayout.rdb as rdb
 import yaml
-from klayout_tools import parse_lyp_layers
+from cache_defaults import default_cache_dir
+from check_metrics import run_subprocess, run_subprocesses, write_metrics, write_trace
+from check_scheduler import Check, CheckResult, run_checks
+from drc_report import drc_rules_markdown, read_drc_report
+from klayout_drc_batch import DrcDeck, KlayoutDrcBatch
+from klayout_tools import LayerTable, load_tech_layers
+from layout_context import LayoutContext, layout_context
+from lef_parser import LazyLef, Lef, lef_model
+from magic_drc_tiles import (
+    Box,
+    MagicDrcReport,
+    drc_tiles,
+    merge_tile_mags,
+    merge_tile_reports,
+    parse_magic_drc_report,
+)
 from pin_check import pin_check
-from precheck_failure import PrecheckFailure
+from precheck_failure import DrcFailure, PrecheckFailure, ToolFailure
+from result_cache import ResultCache, code_version, pdk_version, tool_versions
 from tech_data import (
     analog_pin_rects,
     boundary_layer,
     forbidden_layers,
-    lyp_filename,
     tech_names,
     valid_layers,
 )
+from verilog_syntax import VerilogSyntaxBatch, check_verilog_files
 
 PDK_ROOT = os.getenv("PDK_ROOT")
 PDK_NAME = os.getenv("PDK") or "sky130A"
-LYP_DIR = f"{PDK_ROOT}/{PDK_NAME}/libs.tech/klayout/tech"
+MAGICRC_FILE = f"{PDK_ROOT}/{PDK_NAME}/libs.tech/magic/{PDK_NAME}.magicrc"
+SG13G2_DRC_FILE = f"{PDK_ROOT}/{PDK_NAME}/libs.tech/klayout/tech/drc/ihp-sg13g2.drc"
 REPORTS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "reports")
 
 if not PDK_ROOT:
@@ -35,95 +48,263 @@ if not PDK_ROOT:
     exit(1)
 
 
-def has_sky130_devices(gds: str):
-    for cell_name in gdstk.read_rawcells(gds):
+def has_sky130_devices(gds: str | LayoutContext):
+    for cell_name in layout_context(gds).cell_names:
         if cell_name.startswith("sky130_fd_"):
             return True
     return False
 
 
-def load_layers(tech: str, only_valid: bool = True):
-    lyp_file = f"{LYP_DIR}/{lyp_filename[tech]}"
-    layers = parse_lyp_layers(lyp_file, only_valid)
-    return layers
-
-
-def magic_drc(gds: str, toplevel: str):
-    logging.info(f"Running magic DRC on {gds} (module={toplevel})")
-
-    magic = subprocess.run(
-        [
-            "magic",
-            "-noconsole",
-            "-dnull",
-            "-rcfile",
-            f"{PDK_ROOT}/{PDK_NAME}/libs.tech/magic/{PDK_NAME}.magicrc",
-            "magic_drc.tcl",
-            gds,
-            toplevel,
-            PDK_ROOT,
-            f"{REPORTS_PATH}/magic_drc.txt",
-            f"{REPORTS_PATH}/magic_drc.mag",
-        ],
-    )
+def load_layers(
+    tech: str, only_valid: bool = True, cache_dir: str | None = None
+) -> LayerTable:
+    # memoized: the layer table is the same for every project, treat it as read-only
+    return load_tech_layers(tech, only_valid, cache_dir)
+
+
+def magic_drc_command(
+    gds_path: str, toplevel: str, report: str, mag: str, area: Box | None = None
+) -> list[str]:
+    command = [
+        "magic",
+        "-noconsole",
+        "-dnull",
+        "-rcfile",
+        MAGICRC_FILE,
+        "magic_drc.tcl",
+        gds_path,
+        toplevel,
+        PDK_ROOT,
+        report,
+        mag,
+    ]
+    if area is not None:
+        command.extend(f"{v:.3f}" for v in area)
+    return command
+
+
+def magic_drc_violations(report: str) -> int:
+    """Number of violations in a magic DRC report, 0 if it's missing or unreadable."""
+    try:
+        with open(report) as f:
+            return parse_magic_drc_report(f).count
+    except (OSError, ValueError):
+        return 0
 
-    if magic.returncode != 0:
-        if not has_sky130_devices(gds):
+
+def magic_drc(
+    gds: str | LayoutContext,
+    toplevel: str,
+    reports_path: str = REPORTS_PATH,
+    tiles: int = 1,
+):
+    """Run magic DRC on the whole top cell, or split into `tiles` checked in parallel."""
+    context = layout_context(gds)
+    logging.info(f"Running magic DRC on {context} (module={toplevel})")
+    report = f"{reports_path}/magic_drc.txt"
+    mag = f"{reports_path}/magic_drc.mag"
+
+    try:
+        if tiles > 1:
+            passed = magic_drc_tiled(context, toplevel, report, mag, tiles)
+        else:
+            # the report of an earlier run must not pass for this one's
+            if os.path.exists(report):
+                os.unlink(report)
+            # magic can't read OASIS
+            command = magic_drc_command(context.gds_path, toplevel, report, mag)
+            passed = run_subprocess(command).returncode == 0
+    finally:
+        if context is not gds:
+            context.close()
+
+    if not passed:
+        if not has_sky130_devices(context):
             logging.warning("No sky130 devices present - was the design flattened?")
+        # magic also exits with an error when it finds violations
+        if magic_drc_violations(report) == 0:
+            raise ToolFailure("Magic DRC failed")
         raise PrecheckFailure("Magic DRC failed")
 
 
+def magic_drc_tiled(
+    context: LayoutContext, toplevel: str, report: str, mag: str, count: int
+) -> bool:
+    """Run one magic process per tile, and merge their reports into `report`.
+
+    Every process reads the whole layout, but only checks its tile (grown by a
+    halo, so violations across tile edges are found). The views the tiles save
+    when they find violations are merged into `mag`, marking those of all tiles.
+    Returns whether all tiles ran and the merged report has no violations.
+    """
+    cell = context.klayout_layout.cell(toplevel)
+    if cell is None:
+        logging.error(f"Cell {toplevel} not found in {context}")
+        return False
+    box = cell.dbbox()
+    tiles = drc_tiles((box.left, box.bottom, box.right, box.top), count)
+    logging.info(f"Checking {len(tiles)} tiles of {toplevel} with magic")
+
+    tiles_dir = os.path.join(os.path.dirname(report), "magic_drc_tiles")
+    tile_dirs = [os.path.join(tiles_dir, str(i)) for i in range(len(tiles))]
+    for tile_dir in tile_dirs:
+        os.makedirs(tile_dir, exist_ok=True)
+    tile_reports = [os.path.join(d, os.path.basename(report)) for d in tile_dirs]
+    # the .mag is saved under the name of the cell, so keep the file name
+    tile_mags = [os.path.join(d, os.path.basename(mag)) for d in tile_dirs]
+    commands = [
+        magic_drc_command(context.gds_path, toplevel, tile_report, tile_mag, t.area)
+        for t, tile_report, tile_mag in zip(tiles, tile_reports, tile_mags)
+    ]
+
+    try:
+        magic_runs = run_subprocesses(commands)
+        reports = []
+        tiles_ok = True
+        for i, magic in enumerate(magic_runs):
+            try:
+                with open(tile_reports[i]) as f:
+                    tile_report = parse_magic_drc_report(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Magic DRC failed on tile {i}: {e}")
+                tile_report = MagicDrcReport(toplevel)
+                tiles_ok = False
+            # magic exits with an error when it finds violations, which may be
+            # in the halo only and belong to another tile
+            if magic.returncode != 0 and tile_report.count == 0:
+                logging.error(f"Magic DRC failed on tile {i}")
+                tiles_ok = False
+            reports.append(tile_report)
+
+        merged = merge_tile_reports(tiles, reports)
+        with open(report, "w") as f:
+            merged.write(f)
+        # only tiles with violations save their view
+        saved_mags = [tile_mag for tile_mag in tile_mags if os.path.exists(tile_mag)]
+        if merged.count > 0 and saved_mags:
+            views = []
+            for tile_mag in saved_mags:
+                with open(tile_mag) as f:
+                    views.append(f.read())
+            with open(mag, "w") as f:
+                f.write(merge_tile_mags(views))
+    finally:
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+
+    return tiles_ok and merged.count == 0
+
+
 def klayout_custom_drc(
-    check: str, script_path: str, script_vars: dict[str, str], report_vars: list[str]
+    check: str,
+    script_path: str,
+    script_vars: dict[str, str],
+    report_vars: list[str],
+    reports_path: str = REPORTS_PATH,
 ):
-    report_file = f"{REPORTS_PATH}/drc_{check}.xml"
-    klayout_args = ["klayout", "-b", "-r", script_path]
-    for k, v in script_vars.items():
-        klayout_args.extend(["-rd", f"{k}={v}"])
+    deck = klayout_custom_drc_deck(
+        check, script_path, script_vars, report_vars, reports_path
+    )
+    run_drc_deck(deck)
+
+
+def klayout_custom_drc_deck(
+    check: str,
+    script_path: str,
+    script_vars: dict[str, str],
+    report_vars: list[str],
+    reports_path: str = REPORTS_PATH,
+) -> DrcDeck:
+    report_file = drc_report_path(check, reports_path)
+    deck_vars = {k: str(v) for k, v in script_vars.items()}
     for k in report_vars:
-        klayout_args.extend(["-rd", f"{k}={report_file}"])
-    klayout = subprocess.run(klayout_args)
-    if klayout.returncode != 0:
-        raise PrecheckFailure(f"Klayout {check} failed")
+        deck_vars[k] = report_file
+    return {
+        "check": check,
+        "script": script_path,
+        "vars": deck_vars,
+        "report": report_file,
+    }
 
-    report = rdb.ReportDatabase("DRC")
-    report.load(report_file)
 
-    if report.num_items() > 0:
-        raise PrecheckFailure(
-            f"Klayout {check} failed with {report.num_items()} DRC violations"
+def run_drc_deck(deck: DrcDeck, batch: KlayoutDrcBatch | None = None):
+    """Run a DRC deck in its own klayout process, or as part of a batch."""
+    check = deck["check"]
+    if batch is None:
+        klayout_args = ["klayout", "-b", "-r", deck["script"]]
+        for k, v in deck["vars"].items():
+            klayout_args.extend(["-rd", f"{k}={v}"])
+        returncode = run_subprocess(klayout_args).returncode
+    else:
+        returncode = batch.run(deck)
+    if returncode != 0:
+        raise ToolFailure(f"Klayout {check} failed")
+
+    report = read_drc_report(deck["report"])
+    if report.total > 0:
+        raise DrcFailure(
+            f"Klayout {check} failed with {report.total} DRC violations",
+            report.total,
+            report.violated_rules(),
         )
 
 
-def klayout_drc(gds: str, check: str, script=f"{PDK_NAME}_mr.drc", extra_vars=[]):
-    logging.info(f"Running klayout {check} on {gds}")
+def drc_script_path(script: str):
     if "/" not in script:
-        script = f"tech-files/{script}"
+        return f"tech-files/{script}"
+    return script
+
+
+def drc_report_path(check: str, reports_path: str = REPORTS_PATH):
+    return f"{reports_path}/drc_{check}.xml"
+
+
+def klayout_drc_deck(
+    gds: str,
+    check: str,
+    script=f"{PDK_NAME}_mr.drc",
+    extra_vars=[],
+    reports_path: str = REPORTS_PATH,
+) -> DrcDeck:
+    script = drc_script_path(script)
     script_vars = {
         check: "true",
         "input": gds,
         "thr": "1",  # single-threaded operation in sky130A_mr.drc to work around klayout bug
     }
     script_vars.update(extra_vars)
-    klayout_custom_drc(check, script, script_vars, ["report", "report_file"])
+    return klayout_custom_drc_deck(
+        check, script, script_vars, ["report", "report_file"], reports_path
+    )
 
 
-def klayout_zero_area(gds: str):
-    return klayout_drc(gds, "zero_area", "zeroarea.rb.drc")
+def klayout_drc(
+    gds: str,
+    check: str,
+    script=f"{PDK_NAME}_mr.drc",
+    extra_vars=[],
+    reports_path: str = REPORTS_PATH,
+):
+    logging.info(f"Running klayout {check} on {gds}")
+    run_drc_deck(klayout_drc_deck(gds, check, script, extra_vars, reports_path))
 
 
-def klayout_sg13g2(gds: str):
-    return klayout_drc(
-        gds,
-        "sg13g2",
-        f"{PDK_ROOT}/{PDK_NAME}/libs.tech/klayout/tech/drc/ihp-sg13g2.drc",
-    )
+def klayout_zero_area(gds: str, reports_path: str = REPORTS_PATH):
+    return klayout_drc(gds, "zero_area", "zeroarea.rb.drc", reports_path=reports_path)
 
 
-def klayout_checks(gds: str, expected_name: str, tech: str):
-    layout = pya.Layout()
-    layout.read(gds)
-    layers = load_layers(tech)
+def klayout_sg13g2(gds: str, reports_path: str = REPORTS_PATH):
+    return klayout_drc(gds, "sg13g2", SG13G2_DRC_FILE, reports_path=reports_path)
+
+
+def klayout_checks(
+    gds: str | LayoutContext,
+    expected_name: str,
+    tech: str,
+    cache_dir: str | None = None,
+):
+    context = layout_context(gds)
+    layout = context.klayout_layout
+    layers = load_layers(tech, cache_dir=cache_dir)
 
     logging.info("Running top macro name check...")
     top_cell = layout.top_cell()
@@ -138,7 +319,7 @@ def klayout_checks(gds: str, expected_name: str, tech: str):
         logging.info(f"* Checking {layer_info.name}")
         layer_index = layout.find_layer(layer_info.layer, layer_info.data_type)
         if layer_index is not None:
-            raise PrecheckFailure(f"Forbidden layer {layer} found in {gds}")
+            raise PrecheckFailure(f"Forbidden layer {layer} found in {context}")
 
     logging.info("Running prBoundary check...")
     layer_name = boundary_layer[tech]
@@ -146,61 +327,85 @@ def klayout_checks(gds: str, expected_name: str, tech: str):
     layer_index = layout.find_layer(layer_info.layer, layer_info.data_type)
     if layer_index is None:
         calma_index = f"{layer_info.layer}/{layer_info.data_type}"
-        raise PrecheckFailure(f"{layer_name} ({calma_index}) layer not found in {gds}")
+        raise PrecheckFailure(
+            f"{layer_name} ({calma_index}) layer not found in {context}"
+        )
 
 
-def boundary_check(gds: str, tech: str):
+def boundary_check(gds: str | LayoutContext, tech: str, cache_dir: str | None = None):
     """Ensure that there are no shapes outside the project area."""
-    lib = gdstk.read_gds(gds)
-    tops = lib.top_level()
+    layout = layout_context(gds).klayout_layout
+    tops = layout.top_cells()
     if len(tops) != 1:
         raise PrecheckFailure("GDS top level not unique")
     top = tops[0]
-    boundary = top.copy("test_boundary")
 
-    layers = load_layers(tech)
-    layer_name = boundary_layer[tech]
-    layer_info = layers[layer_name]
-    boundary.filter([(layer_info.layer, layer_info.data_type)], False)
-    if top.bounding_box() != boundary.bounding_box():
-        raise PrecheckFailure("Shapes outside project area")
-
-
-def power_pin_check(verilog: str, lef: str, uses_3v3: bool):
+    boundary_info = load_layers(tech, cache_dir=cache_dir)[boundary_layer[tech]]
+    boundary_index = layout.find_layer(boundary_info.layer, boundary_info.data_type)
+    area = pya.Box() if boundary_index is None else top.bbox(boundary_index)
+    # klayout keeps the bounding boxes per cell and layer, no need to copy the cell
+    if top.bbox() == area:
+        return
+
+    layer_names = load_layers(tech, only_valid=False, cache_dir=cache_dir)
+    outside = []
+    for layer_index in layout.layer_indexes():
+        layer_box = top.bbox(layer_index)
+        if layer_box.empty() or layer_box.inside(area):
+            continue
+        cells = set()
+        for shape in top.shapes(layer_index).each():
+            if not shape.bbox().inside(area):
+                cells.add(top.name)
+                break
+        for inst in top.each_inst():
+            inst_box = inst.bbox(layer_index)
+            if not inst_box.empty() and not inst_box.inside(area):
+                cells.add(inst.cell.name)
+        info = layout.get_info(layer_index)
+        name = layer_names.name(info.layer, info.datatype)
+        number = f"{info.layer}/{info.datatype}"
+        layer = f"{name} ({number})" if name else number
+        outside.append(f"{layer} in {', '.join(sorted(cells))}")
+    raise PrecheckFailure(f"Shapes outside project area: {'; '.join(outside)}")
+
+
+def power_pin_check(verilog: str, lef: str | Lef, uses_3v3: bool):
     """Ensure that VPWR / VGND are present and have USE definitions,
     and that VAPWR is present if and only if 'uses_3v3' is set."""
     verilog_s = open(verilog).read().replace("VPWR", "VDPWR")
-    lef_s = open(lef).read().replace("VPWR", "VDPWR")
+    lef = lef_model(lef)
+    lef_pins = [
+        pin
+        for macro in lef.macros.values()
+        for pin in macro.pins
+        if pin.name in ("VPWR", "VDPWR", "VAPWR", "VGND")
+    ]
+    lef_pin_names = set(pin.name.replace("VPWR", "VDPWR") for pin in lef_pins)
 
     # naive but good enough way to ignore comments
     verilog_s = re.sub("//.*", "", verilog_s)
     verilog_s = re.sub("/\\*.*?\\*/", "", verilog_s, flags=(re.DOTALL | re.MULTILINE))
 
-    # this looks for a line beginning with "PIN", captures the name of the pin and the body up until its "END"
-    PIN_PATTERN = re.compile(
-        r"^\s*PIN (VPWR|VDPWR|VAPWR|VGND)\s*([\s\S]+?(?=^\s*END \1))",
-        flags=re.MULTILINE,
-    )
-
-    for ft, s in (("Verilog", verilog_s), ("LEF", lef_s)):
+    # substring search in the Verilog source, set membership for the LEF pins
+    for ft, s in (("Verilog", verilog_s), ("LEF", lef_pin_names)):
         for pwr, ex in (("VGND", True), ("VDPWR", True), ("VAPWR", uses_3v3)):
             if (pwr in s) and not ex:
                 raise PrecheckFailure(f"{ft} contains {pwr}")
             if not (pwr in s) and ex:
                 raise PrecheckFailure(f"{ft} doesn't contain {pwr}")
 
-    for match in PIN_PATTERN.finditer(lef_s):
-        pin, definition = match.groups()
-
+    for lef_pin in lef_pins:
+        pin = lef_pin.name.replace("VPWR", "VDPWR")
         match pin:
-            case "VPWR" | "VDPWR" | "VAPWR":
-                if "USE POWER" not in definition:
+            case "VDPWR" | "VAPWR":
+                if lef_pin.use != "POWER":
                     raise PrecheckFailure(
                         f"{pin} does not have a corresponding 'USE POWER ;'"
                     )
 
             case "VGND":
-                if "USE GROUND" not in definition:
+                if lef_pin.use != "GROUND":
                     raise PrecheckFailure(
                         f"{pin} does not have a corresponding 'USE GROUND ;'"
                     )
@@ -209,10 +414,9 @@ def power_pin_check(verilog: str, lef: str, uses_3v3: bool):
                 raise PrecheckFailure(f"unhandled {pin}")
 
 
-def layer_check(gds: str, tech: str):
+def layer_check(gds: str | LayoutContext, tech: str, cache_dir: str | None = None):
     """Check that there are no invalid layers in the GDS file."""
-    layer_definition = load_layers(tech, only_valid=False)
-    lib = gdstk.read_gds(gds)
+    layer_definition = load_layers(tech, only_valid=False, cache_dir=cache_dir)
     valid_layer_list = set(
         map(
             lambda layer_name: (
@@ -226,15 +430,14 @@ def layer_check(gds: str, tech: str):
             valid_layers[tech],
         )
     )
-    gds_layers = lib.layers_and_datatypes().union(lib.layers_and_texttypes())
-    excess = gds_layers - valid_layer_list
+    excess = layout_context(gds).layers - valid_layer_list
     if excess:
         raise PrecheckFailure(f"Invalid layers in GDS: {excess}")
 
 
-def cell_name_check(gds: str):
+def cell_name_check(gds: str | LayoutContext):
     """Check that there are no cell names with '#' or '/' in them."""
-    for cell_name in gdstk.read_rawcells(gds):
+    for cell_name in layout_context(gds).cell_names:
         if "#" in cell_name:
             raise PrecheckFailure(
                 f"Cell name {cell_name} contains invalid character '#'"
@@ -245,46 +448,59 @@ def cell_name_check(gds: str):
             )
 
 
-def urpm_nwell_check(gds: str, top_module: str):
+def urpm_nwell_vars(top_module: str):
+    return {"thr": os.cpu_count(), "top_cell": top_module}
+
+
+def urpm_nwell_check(gds: str, top_module: str, reports_path: str = REPORTS_PATH):
     """Run a DRC check for urpm to nwell spacing."""
-    extra_vars = {"thr": os.cpu_count(), "top_cell": top_module}
     klayout_drc(
-        gds=gds, check="nwell_urpm", script="nwell_urpm.drc", extra_vars=extra_vars
+        gds=gds,
+        check="nwell_urpm",
+        script="nwell_urpm.drc",
+        extra_vars=urpm_nwell_vars(top_module),
+        reports_path=reports_path,
     )
 
 
 def analog_pin_check(
-    gds: str, tech: str, is_analog: bool, uses_3v3: bool, analog_pins: int, pinout: dict
+    gds: str | LayoutContext,
+    tech: str,
+    is_analog: bool,
+    uses_3v3: bool,
+    analog_pins: int,
+    pinout: dict,
 ):
     """Check that every analog pin connects to a piece of metal
     if and only if the pin is used according to info.yaml."""
     if is_analog:
-        lib = gdstk.read_gds(gds)
-        top = lib.top_level()[0]
-        filtered = {}
+        layout = layout_context(gds).klayout_layout
+        top = layout.top_cells()[0]  # layout.top_cell() raises if there are more
+
+        def shapes_near(layer: tuple[int, int], window: pya.DBox) -> pya.Region:
+            # only the shapes touching the window, collected through the
+            # hierarchy without flattening the rest of the design
+            layer_index = layout.find_layer(*layer)
+            if layer_index is None:
+                return pya.Region()
+            return pya.Region(top.begin_shapes_rec_touching(layer_index, window))
 
         for pin, (rect, pin_layer, via_layers) in enumerate(
             analog_pin_rects(tech, uses_3v3)
         ):
-            for layer in [pin_layer] + via_layers:
-                if layer not in filtered:
-                    i = len(filtered)
-                    lf = top.copy(f"test_lf_{i}")
-                    lf.flatten()
-                    lf.filter([layer], False)
-                    filtered[layer] = lf
-
-            pin_rect = gdstk.rectangle(*rect)
-            pin_ring = gdstk.boolean(
-                gdstk.offset(pin_rect, 0.5), gdstk.offset(pin_rect, 0.1), "not"
+            (x1, y1), (x2, y2) = rect
+            pin_box = pya.DBox(x1, y1, x2, y2)
+            window = pin_box.enlarged(0.5, 0.5)
+            pin_rect = pya.Region(pin_box.to_itype(layout.dbu))
+            pin_ring = pya.Region(window.to_itype(layout.dbu)) - pya.Region(
+                pin_box.enlarged(0.1, 0.1).to_itype(layout.dbu)
             )
 
-            pin_layer_polygons = filtered[pin_layer].polygons
-            connected = bool(gdstk.boolean(pin_layer_polygons, pin_ring, "and"))
+            connected = not (shapes_near(pin_layer, window) & pin_ring).is_empty()
             for via_layer in via_layers:
-                via_layer_polygons = filtered[via_layer].polygons
-                connected = connected or bool(
-                    gdstk.boolean(via_layer_polygons, pin_rect, "and")
+                connected = (
+                    connected
+                    or not (shapes_near(via_layer, pin_box) & pin_rect).is_empty()
                 )
 
             expected_pc = pin < analog_pins
@@ -308,62 +524,57 @@ def analog_pin_check(
                 )
 
 
-def verilog_syntax_check(verilog: str):
-    """Load the Verilog file into Yosys to verify it can be read successfully."""
-
-    logging.info(f"Running Verilog syntax check on {verilog}")
-    verilog_dir = os.path.dirname(verilog)
-    yowasp_env = os.environ.copy()
-    yowasp_env["YOWASP_MOUNT"] = f"{verilog_dir}={verilog_dir}"
-
-    yosys = subprocess.run(
-        [
-            "yowasp-yosys",
-            "-p",
-            f'read_verilog -sv "{verilog}"',
-        ],
-        env=yowasp_env,
-    )
-
-    if yosys.returncode != 0:
-        raise PrecheckFailure("Verilog syntax check failed")
-
-
-def main():
-    default_tech = PDK_NAME
-    if default_tech not in tech_names:
-        default_tech = tech_names[0]
+def verilog_syntax_check(
+    verilog: str,
+    batch: VerilogSyntaxBatch | None = None,
+    cache_dir: str | None = None,
+):
+    """Load the Verilog file into Yosys to verify it can be read successfully.
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--gds", required=True)
-    parser.add_argument(
-        "--tech", required=False, default=default_tech, choices=tech_names
-    )
-    args = parser.parse_args()
-    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
-    logging.info(f"PDK_ROOT: {PDK_ROOT}")
-    logging.info(f"Tech: {args.tech}")
+    With a `cache_dir`, results are cached by the file's content and the yosys
+    version. With a batch, the files of all its projects are read in a single
+    yosys session (and cached in the batch's cache directory).
+    """
 
-    if args.gds.endswith(".gds"):
-        gds_stem = args.gds.removesuffix(".gds")
-        gds_temp = None
-        gds_file = args.gds
-    elif args.gds.endswith(".oas"):
-        gds_stem = args.gds.removesuffix(".oas")
-        gds_temp = tempfile.NamedTemporaryFile(suffix=".gds", delete=False)
-        gds_file = gds_temp.name
-        logging.info(f"Converting {args.gds} to {gds_file}")
-        layout = pya.Layout()
-        layout.read(args.gds)
-        layout.write(gds_file)
+    logging.info(f"Running Verilog syntax check on {verilog}")
+    if batch is not None:
+        passed = batch.run(verilog)
     else:
-        raise PrecheckFailure("Layout file extension is neither .gds nor .oas")
+        passed = check_verilog_files([verilog], cache_dir)[verilog]
+    if passed is None:
+        raise ToolFailure("Yosys failed to check the Verilog syntax")
+    if not passed:
+        raise PrecheckFailure("Verilog syntax check failed")
 
-    tech = args.tech
-    if tech not in tech_names:
-        raise PrecheckFailure(f"Invalid tech: {tech}")
 
-    yaml_dir = os.path.dirname(args.gds)
+def project_checks(
+    layout: LayoutContext,
+    tech: str,
+    reports_path: str = REPORTS_PATH,
+    klayout_batch: bool = False,
+    magic_tiles: int = 1,
+    verilog_batch: VerilogSyntaxBatch | None = None,
+    cache_dir: str | None = None,
+    cache: ResultCache | None = None,
+) -> list[Check]:
+    """Build the checks that apply to the project with the given layout and tech.
+
+    The project settings are read from the nearest info.yaml above the layout file;
+    LEF and Verilog files are expected next to it (or in ../lef for the LEF).
+
+    With `klayout_batch`, the KLayout DRC decks all run in one klayout process,
+    started by whichever of them runs first; decks with a result in `cache` are
+    left out of it. With `magic_tiles`, magic DRC is split
+    into that many tiles, checked in parallel. With `verilog_batch`, the Verilog
+    syntax check reads the netlist in the yosys session shared by the batch.
+    Checks that cache results or parses of their own (the Verilog syntax check,
+    the template DEF and the PDK layer tables) keep them in `cache_dir`, if given.
+
+    Costs are rough run times. The structural checks are blocking: they run first,
+    since if one fails, the submission is broken anyway, and with fail-fast the
+    DRCs are cancelled. The DRCs then start longest first.
+    """
+    yaml_dir = os.path.dirname(layout.path)
     while not os.path.exists(f"{yaml_dir}/info.yaml"):
         yaml_dir = os.path.dirname(yaml_dir)
         if yaml_dir in ("/", ""):
@@ -371,6 +582,7 @@ def main():
     yaml_file = f"{yaml_dir}/info.yaml"
     yaml_data = yaml.safe_load(open(yaml_file))
 
+    gds_stem = os.path.splitext(layout.path)[0]
     wokwi_id = yaml_data["project"].get("wokwi_id", 0)
     top_module = yaml_data["project"].get("top_module", f"tt_um_wokwi_{wokwi_id}")
     assert top_module == os.path.basename(gds_stem)
@@ -402,117 +614,410 @@ def main():
     if not os.path.exists(lef_file) and os.path.exists(lef_file_alt):
         lef_file = lef_file_alt
     verilog_file = gds_stem + ".v"
+    # parsed once, by whichever of the LEF checks runs first
+    lef = LazyLef(lef_file)
 
-    checks = [
+    magic_reports = [f"{reports_path}/magic_drc.txt", f"{reports_path}/magic_drc.mag"]
+
+    checks: list[Check] = [
         {
             "name": "Magic DRC",
-            "check": lambda: magic_drc(gds_file, top_module),
+            "cost": 1200,
+            "check": lambda: magic_drc(layout, top_module, reports_path, magic_tiles),
             "techs": ["sky130A", "gf180mcuD"],
+            "cpus": magic_tiles,
+            "inputs": [layout.path, "magic_drc.tcl", MAGICRC_FILE],
+            "params": {"top_module": top_module},
+            "reports": magic_reports,
         },
         {
             "name": "KLayout FEOL",
-            "check": lambda: klayout_drc(gds_file, "feol"),
+            "cost": 600,
+            "check": lambda: klayout_drc(
+                layout.path, "feol", reports_path=reports_path
+            ),
+            "klayout_deck": klayout_drc_deck(
+                layout.path, "feol", reports_path=reports_path
+            ),
             "techs": ["sky130A"],
+            "inputs": [layout.path, drc_script_path(f"{PDK_NAME}_mr.drc")],
+            "reports": [drc_report_path("feol", reports_path)],
         },
         {
             "name": "KLayout BEOL",
-            "check": lambda: klayout_drc(gds_file, "beol"),
+            "cost": 600,
+            "check": lambda: klayout_drc(
+                layout.path, "beol", reports_path=reports_path
+            ),
+            "klayout_deck": klayout_drc_deck(
+                layout.path, "beol", reports_path=reports_path
+            ),
             "techs": ["sky130A"],
+            "inputs": [layout.path, drc_script_path(f"{PDK_NAME}_mr.drc")],
+            "reports": [drc_report_path("beol", reports_path)],
         },
         {
             "name": "KLayout offgrid",
-            "check": lambda: klayout_drc(gds_file, "offgrid"),
+            "cost": 120,
+            "check": lambda: klayout_drc(
+                layout.path, "offgrid", reports_path=reports_path
+            ),
+            "klayout_deck": klayout_drc_deck(
+                layout.path, "offgrid", reports_path=reports_path
+            ),
             "techs": ["sky130A"],
+            "inputs": [layout.path, drc_script_path(f"{PDK_NAME}_mr.drc")],
+            "reports": [drc_report_path("offgrid", reports_path)],
         },
         {
             "name": "KLayout pin label overlapping drawing",
+            "cost": 60,
             "check": lambda: klayout_drc(
-                gds_file,
+                layout.path,
                 "pin_label_purposes_overlapping_drawing",
                 "pin_label_purposes_overlapping_drawing.rb.drc",
+                reports_path=reports_path,
             ),
+            "klayout_deck": klayout_drc_deck(
+                layout.path,
+                "pin_label_purposes_overlapping_drawing",
+                "pin_label_purposes_overlapping_drawing.rb.drc",
+                reports_path=reports_path,
+            ),
+            "inputs": [
+                layout.path,
+                drc_script_path("pin_label_purposes_overlapping_drawing.rb.drc"),
+            ],
+            "reports": [
+                drc_report_path(
+                    reports_path=reports_path,
+                    check="pin_label_purposes_overlapping_drawing",
+                )
+            ],
         },
         {
             "name": "KLayout SG13G2 DRC",
-            "check": lambda: klayout_sg13g2(gds_file),
+            "cost": 1200,
+            "check": lambda: klayout_sg13g2(layout.path, reports_path),
+            "klayout_deck": klayout_drc_deck(
+                layout.path, "sg13g2", SG13G2_DRC_FILE, reports_path=reports_path
+            ),
             "techs": ["ihp-sg13g2"],
+            "inputs": [layout.path, SG13G2_DRC_FILE],
+            "reports": [drc_report_path("sg13g2", reports_path)],
+        },
+        {
+            "name": "KLayout zero area",
+            "cost": 30,
+            "check": lambda: klayout_zero_area(layout.path, reports_path),
+            "klayout_deck": klayout_drc_deck(
+                layout.path, "zero_area", "zeroarea.rb.drc", reports_path=reports_path
+            ),
+            "inputs": [layout.path, drc_script_path("zeroarea.rb.drc")],
+            "reports": [drc_report_path("zero_area", reports_path)],
         },
-        {"name": "KLayout zero area", "check": lambda: klayout_zero_area(gds_file)},
         {
             "name": "KLayout Checks",
-            "check": lambda: klayout_checks(gds_file, top_module, tech),
+            "cost": 0.1,
+            "blocking": True,
+            "check": lambda: klayout_checks(layout, top_module, tech, cache_dir),
+            "inputs": [layout.path],
+            "params": {"top_module": top_module},
         },
         {
             "name": "Pin check",
+            "cost": 1,
+            "blocking": True,
             "check": lambda: pin_check(
-                gds_file, lef_file, template_def, top_module, uses_3v3, tech
+                layout, lef.get(), template_def, top_module, uses_3v3, tech, cache_dir
             ),
+            "inputs": [layout.path, lef_file, template_def],
+            "params": {"top_module": top_module, "uses_3v3": uses_3v3},
+        },
+        {
+            "name": "Boundary check",
+            "cost": 5,
+            "blocking": True,
+            "check": lambda: boundary_check(layout, tech, cache_dir),
+            "inputs": [layout.path],
         },
-        {"name": "Boundary check", "check": lambda: boundary_check(gds_file, tech)},
         {
             "name": "Power pin check",
-            "check": lambda: power_pin_check(verilog_file, lef_file, uses_3v3),
+            "cost": 0.1,
+            "blocking": True,
+            "check": lambda: power_pin_check(verilog_file, lef.get(), uses_3v3),
             "techs": ["sky130A", "gf180mcuD"],
+            "inputs": [verilog_file, lef_file],
+            "params": {"uses_3v3": uses_3v3},
+        },
+        {
+            "name": "Layer check",
+            "cost": 5,
+            "blocking": True,
+            "check": lambda: layer_check(layout, tech, cache_dir),
+            "inputs": [layout.path],
+        },
+        {
+            "name": "Cell name check",
+            "cost": 0.1,
+            "blocking": True,
+            "check": lambda: cell_name_check(layout),
+            "inputs": [layout.path],
         },
-        {"name": "Layer check", "check": lambda: layer_check(gds_file, tech)},
-        {"name": "Cell name check", "check": lambda: cell_name_check(gds_file)},
         {
             "name": "urpm/nwell check",
-            "check": lambda: urpm_nwell_check(gds_file, top_module),
+            "cost": 300,
+            "check": lambda: urpm_nwell_check(layout.path, top_module, reports_path),
+            "klayout_deck": klayout_drc_deck(
+                layout.path,
+                "nwell_urpm",
+                "nwell_urpm.drc",
+                urpm_nwell_vars(top_module),
+                reports_path,
+            ),
             "techs": ["sky130A"],
+            "cpus": os.cpu_count() or 1,
+            "inputs": [layout.path, drc_script_path("nwell_urpm.drc")],
+            "params": {"top_module": top_module},
+            "reports": [drc_report_path("nwell_urpm", reports_path)],
         },
         {
             "name": "Analog pin check",
+            "cost": 1,
+            "blocking": True,
             "check": lambda: analog_pin_check(
-                gds_file, tech, is_analog, uses_3v3, analog_pins, pinout
+                layout, tech, is_analog, uses_3v3, analog_pins, pinout
             ),
             "techs": ["sky130A", "ihp-sg13g2"],
+            "inputs": [layout.path],
+            "params": {
+                "is_analog": is_analog,
+                "uses_3v3": uses_3v3,
+                "analog_pins": analog_pins,
+                "pinout": pinout,
+            },
         },
         {
             "name": "Verilog syntax check",
-            "check": lambda: verilog_syntax_check(verilog_file),
+            "cost": 5,
+            "blocking": True,
+            "check": lambda: verilog_syntax_check(
+                verilog_file, verilog_batch, cache_dir
+            ),
+            "inputs": [verilog_file],
         },
     ]
 
-    testsuite = ET.Element("testsuite", name="Tiny Tapeout Prechecks")
-    error_count = 0
+    checks = [
+        check for check in checks if "techs" not in check or tech in check["techs"]
+    ]
+    if verilog_batch is not None:
+        verilog_batch.add(verilog_file)
+
+    if klayout_batch:
+        batch = KlayoutDrcBatch(layout.path, reports_path)
+        for check in checks:
+            if "klayout_deck" not in check:
+                continue
+            if cache is not None and cache.contains(check):
+                continue  # served from the cache, no need to run it in the batch
+            batch.add(check["klayout_deck"])
+            check["check"] = functools.partial(
+                run_drc_deck, check["klayout_deck"], batch
+            )
+            # the check starting the batch takes the slots its decks need
+            check["cpus"] = 0
+    return checks
+
+
+def create_result_cache(cache_dir: str, tech: str) -> ResultCache:
+    return ResultCache(
+        cache_dir,
+        {
+            "tech": tech,
+            "pdk": pdk_version(PDK_ROOT, PDK_NAME),
+            "tools": tool_versions(),
+            "code": code_version(),
+        },
+    )
+
+
+def results_testsuite(
+    results: list[CheckResult], name: str = "Tiny Tapeout Prechecks"
+) -> ET.Element:
+    testsuite = ET.Element("testsuite", name=name)
+    for result in results:
+        test_case = ET.SubElement(testsuite, "testcase", name=result.name)
+        test_case.set("time", str(round(result.elapsed_time, 2)))
+        if result.cached:
+            ET.SubElement(test_case, "properties").append(
+                ET.Element("property", name="cached", value="true")
+            )
+        if result.skipped is not None:
+            ET.SubElement(test_case, "skipped", message=result.skipped)
+        elif result.resource_exceeded:
+            # not a verdict on the design: the check ran out of time or memory
+            error = ET.SubElement(
+                test_case, "error", message=str(result.error), type="ResourceExceeded"
+            )
+            error.text = result.error_traceback
+        elif not result.passed:
+            error = ET.SubElement(test_case, "error", message=str(result.error))
+            error.text = result.error_traceback
+    return testsuite
+
+
+def results_markdown(results: list[CheckResult]) -> str:
     markdown_table = "# Tiny Tapeout Precheck Results\n\n"
     markdown_table += "| Check | Result |\n|-----------|--------|\n"
-    for check in checks:
-        name = check["name"]
-        if "techs" in check and tech not in check["techs"]:
-            continue
-        start_time = time.time()
-        test_case = ET.SubElement(testsuite, "testcase", name=name)
-        try:
-            check["check"]()
-            elapsed_time = time.time() - start_time
-            markdown_table += f"| {name} | ✅ |\n"
-            test_case.set("time", str(round(elapsed_time, 2)))
-        except Exception as e:
-            error_count += 1
-            elapsed_time = time.time() - start_time
-            markdown_table += f"| {name} | ❌ Fail: {str(e)} |\n"
-            test_case.set("time", str(round(elapsed_time, 2)))
-            error = ET.SubElement(test_case, "error", message=str(e))
-            error.text = traceback.format_exc()
+    for result in results:
+        cached_note = " (cached)" if result.cached else ""
+        if result.passed:
+            markdown_table += f"| {result.name} | ✅{cached_note} |\n"
+        elif result.skipped is not None:
+            markdown_table += f"| {result.name} | ⏭️ Skipped: {result.skipped} |\n"
+        elif result.resource_exceeded:
+            markdown_table += (
+                f"| {result.name} | ⏱️ Resource limit exceeded: {result.error} |\n"
+            )
+        else:
+            markdown_table += (
+                f"| {result.name} | ❌ Fail: {str(result.error)}{cached_note} |\n"
+            )
     markdown_table += "\n"
+    for result in results:
+        rules = getattr(result.error, "rules", None)
+        if rules:
+            markdown_table += f"## {result.name}\n\n"
+            markdown_table += drc_rules_markdown(rules) + "\n"
     markdown_table += "In case of failure, please reach out on [discord](https://tinytapeout.com/discord) for assistance."
+    return markdown_table
+
 
+def write_results(results: list[CheckResult], reports_path: str = REPORTS_PATH):
+    """Write results.xml (JUnit), results.md and metrics.json, and return the markdown table."""
     testsuites = ET.Element("testsuites")
-    testsuites.append(testsuite)
+    testsuites.append(results_testsuite(results))
     xunit_report = ET.ElementTree(testsuites)
     ET.indent(xunit_report, space="  ", level=0)
-    xunit_report.write(f"{REPORTS_PATH}/results.xml", encoding="unicode")
+    xunit_report.write(f"{reports_path}/results.xml", encoding="unicode")
+    write_metrics(results, f"{reports_path}/metrics.json")
 
-    with open(f"{REPORTS_PATH}/results.md", "w") as f:
+    markdown_table = results_markdown(results)
+    with open(f"{reports_path}/results.md", "w") as f:
         f.write(markdown_table)
+    return markdown_table
+
+
+def add_limit_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--check-timeout",
+        type=float,
+        metavar="SECONDS",
+        help="stop the external tools of a check running longer than this",
+    )
+    parser.add_argument(
+        "--check-max-memory",
+        type=int,
+        metavar="MB",
+        help="stop the external tools of a check using more memory than this",
+    )
+
+
+def main():
+    default_tech = PDK_NAME
+    if default_tech not in tech_names:
+        default_tech = tech_names[0]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gds", required=True)
+    parser.add_argument(
+        "--tech", required=False, default=default_tech, choices=tech_names
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of CPU slots to use for running checks in parallel (default: all cores)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run every check, ignoring and not updating the result cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory holding cached check results",
+    )
+    parser.add_argument(
+        "--klayout-batch",
+        action="store_true",
+        help="run all KLayout DRC decks in a single klayout process",
+    )
+    parser.add_argument(
+        "--magic-tiles",
+        type=int,
+        default=1,
+        help="split magic DRC into this many tiles, checked in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write a timeline of the checks in Chrome trace format (for ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop the remaining checks once a structural check (e.g. cell names, pins) fails",
+    )
+    add_limit_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    logging.info(f"PDK_ROOT: {PDK_ROOT}")
+    logging.info(f"Tech: {args.tech}")
+
+    if not args.gds.endswith((".gds", ".oas")):
+        raise PrecheckFailure("Layout file extension is neither .gds nor .oas")
+
+    tech = args.tech
+    if tech not in tech_names:
+        raise PrecheckFailure(f"Invalid tech: {tech}")
+
+    cache = None
+    if not args.no_cache:
+        cache = create_result_cache(args.cache_dir, tech)
+        logging.info(f"Using result cache in {args.cache_dir}")
+
+    # GDS or OASIS: parsed at most once per library, and shared by all Python-side checks
+    layout = LayoutContext(args.gds)
+    try:
+        checks = project_checks(
+            layout,
+            tech,
+            klayout_batch=args.klayout_batch,
+            magic_tiles=args.magic_tiles,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache=cache,
+        )
+        logging.info(f"Running {len(checks)} checks using {args.jobs} CPU slots")
+        results = run_checks(
+            checks,
+            args.jobs,
+            cache,
+            args.fail_fast,
+            args.check_timeout,
+            args.check_max_memory,
+        )
+    finally:
+        layout.close()
 
-    if gds_temp is not None:
-        gds_temp.close()
-        os.unlink(gds_temp.name)
+    markdown_table = write_results(results)
+    if args.trace:
+        write_trace({os.path.basename(args.gds): results}, args.trace)
 
-    if error_count > 0:
+    if any(not result.passed for result in results):
         logging.error(f"Precheck failed for {args.gds}! 😭")
         logging.error(f"See {REPORTS_PATH} for more details")
         logging.error(f"Markdown report:\n{markdown_table}")
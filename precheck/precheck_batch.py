@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import logging
+import os
+import traceback
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from cache_defaults import default_cache_dir
+from check_cancel import CancelScope
+from check_metrics import write_trace
+from check_scheduler import Check, CheckResult, CheckScheduler
+from layout_context import LayoutContext
+from precheck_failure import PrecheckFailure
+from tech_data import tech_names
+from verilog_syntax import VerilogSyntaxBatch
+
+from precheck import (
+    PDK_NAME,
+    PDK_ROOT,
+    REPORTS_PATH,
+    add_limit_arguments,
+    create_result_cache,
+    project_checks,
+    write_results,
+)
+
+
+def find_layouts(paths: list[str]) -> list[str]:
+    """Expand the command line into layout files.
+
+    Files are taken as they are. Directories are treated like a shuttle's projects/
+    directory: each subdirectory holds one project, with its layout as a .gds
+    (preferred) or .oas file.
+    """
+    layouts = []
+    for path in paths:
+        if not os.path.isdir(path):
+            layouts.append(path)
+            continue
+        for project_dir in sorted(glob.glob(os.path.join(path, "*", ""))):
+            for extension in ("gds", "oas"):
+                candidates = sorted(
+                    glob.glob(os.path.join(project_dir, f"*.{extension}"))
+                )
+                if candidates:
+                    layouts.extend(candidates)
+                    break
+    return layouts
+
+
+class BatchProject:
+    def __init__(self, layout_file: str, reports_dir: str):
+        self.layout_file = layout_file
+        self.name = os.path.splitext(os.path.basename(layout_file))[0]
+        self.reports_path = os.path.join(reports_dir, self.name)
+        self.status_file = os.path.join(self.reports_path, "status.json")
+        self.layout = None
+        self.checks: list[Check] = []
+        self.scope: CancelScope | None = None
+        self.futures: dict[int, Future[CheckResult]] = {}
+        self.remaining = 0
+
+    def load_status(self):
+        try:
+            with open(self.status_file) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def finish(self, results: list[CheckResult]):
+        """Write the per-project reports, then mark the project as done."""
+        write_results(results, self.reports_path)
+        status = {
+            "project": self.name,
+            "layout": self.layout_file,
+            "passed": all(result.passed for result in results),
+            "failed_checks": [
+                result.name for result in results if result.error is not None
+            ],
+            "skipped_checks": [
+                result.name for result in results if result.skipped is not None
+            ],
+            "resource_exceeded_checks": [
+                result.name for result in results if result.resource_exceeded
+            ],
+        }
+        # status.json is written last, so a project only counts as done once its reports are complete
+        with open(self.status_file + ".tmp", "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(self.status_file + ".tmp", self.status_file)
+        return status
+
+
+def write_summary(projects: list[BatchProject], statuses: dict, reports_dir: str):
+    markdown_table = "# Tiny Tapeout Precheck Summary\n\n"
+    markdown_table += (
+        "| Project | Result | Failed checks |\n|---------|--------|---------------|\n"
+    )
+    testsuites = ET.Element("testsuites")
+    for project in projects:
+        status = statuses[project.name]
+        if status["passed"]:
+            markdown_table += f"| {project.name} | ✅ | |\n"
+        else:
+            failed_checks = ", ".join(status["failed_checks"])
+            markdown_table += f"| {project.name} | ❌ | {failed_checks} |\n"
+        try:
+            project_results = ET.parse(
+                os.path.join(project.reports_path, "results.xml")
+            )
+        except (OSError, ET.ParseError):
+            continue
+        for testsuite in project_results.getroot().iter("testsuite"):
+            testsuite.set("name", project.name)
+            testsuites.append(testsuite)
+
+    passed = sum(1 for project in projects if statuses[project.name]["passed"])
+    markdown_table += f"\n{passed} of {len(projects)} projects passed.\n"
+
+    xunit_report = ET.ElementTree(testsuites)
+    ET.indent(xunit_report, space="  ", level=0)
+    xunit_report.write(os.path.join(reports_dir, "results.xml"), encoding="unicode")
+    with open(os.path.join(reports_dir, "summary.md"), "w") as f:
+        f.write(markdown_table)
+    return markdown_table
+
+
+def main():
+    default_tech = PDK_NAME
+    if default_tech not in tech_names:
+        default_tech = tech_names[0]
+
+    parser = argparse.ArgumentParser(
+        description="Run the prechecks for many projects through one shared worker pool"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="layout files (.gds / .oas), or directories with one project per subdirectory",
+    )
+    parser.add_argument(
+        "--tech", required=False, default=default_tech, choices=tech_names
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of CPU slots shared by all projects (default: all cores)",
+    )
+    parser.add_argument(
+        "--max-projects",
+        type=int,
+        help="number of projects set up and checked at a time (default: --jobs)",
+    )
+    parser.add_argument(
+        "--reports-dir",
+        default=os.path.join(REPORTS_PATH, "batch"),
+        help="directory for the per-project reports and the summary",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="re-run projects that already finished in a previous batch run",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run every check, ignoring and not updating the result cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory holding cached check results",
+    )
+    parser.add_argument(
+        "--klayout-batch",
+        action="store_true",
+        help="run each project's KLayout DRC decks in a single klayout process",
+    )
+    parser.add_argument(
+        "--magic-tiles",
+        type=int,
+        default=1,
+        help="split each project's magic DRC into this many tiles (default: 1)",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="stop a project's remaining checks once one of its structural checks fails",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="write a timeline of all projects' checks in Chrome trace format",
+    )
+    parser.add_argument(
+        "--yosys-batch",
+        action="store_true",
+        help="check the Verilog of all projects in a single yosys session",
+    )
+    add_limit_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    logging.info(f"PDK_ROOT: {PDK_ROOT}")
+    logging.info(f"Tech: {args.tech}")
+
+    projects = [
+        BatchProject(layout_file, args.reports_dir)
+        for layout_file in find_layouts(args.paths)
+    ]
+    names = [project.name for project in projects]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        parser.error(f"Duplicate project names: {', '.join(duplicates)}")
+
+    cache = None
+    if not args.no_cache:
+        cache = create_result_cache(args.cache_dir, args.tech)
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    verilog_batch = VerilogSyntaxBatch(cache_dir) if args.yosys_batch else None
+    statuses = {}
+    project_results: dict[str, list[CheckResult]] = {}
+    to_run = []
+    for project in projects:
+        status = None if args.force else project.load_status()
+        if status is not None:
+            logging.info(f"Skipping {project.name}, already done")
+            statuses[project.name] = status
+        else:
+            to_run.append(project)
+    waiting = iter(to_run)
+    max_projects = args.max_projects or args.jobs
+    pending: dict[Future[CheckResult], BatchProject] = {}
+
+    def finish(project: BatchProject, results: list[CheckResult]):
+        project_results[project.name] = results
+        statuses[project.name] = project.finish(results)
+        # drop the checks, which hold the parsed layout
+        project.checks = []
+        project.futures = {}
+        result = "passed" if statuses[project.name]["passed"] else "failed"
+        logging.info(
+            f"Precheck {result} for {project.name} ({len(statuses)}/{len(projects)})"
+        )
+
+    def start_projects(scheduler: CheckScheduler):
+        # only a window of projects is set up at a time, so that memory use
+        # doesn't grow with the number of projects
+        while len(set(pending.values())) < max_projects:
+            project = next(waiting, None)
+            if project is None:
+                return
+            os.makedirs(project.reports_path, exist_ok=True)
+            try:
+                project.layout = LayoutContext(project.layout_file)
+                project.checks = project_checks(
+                    project.layout,
+                    args.tech,
+                    project.reports_path,
+                    args.klayout_batch,
+                    args.magic_tiles,
+                    verilog_batch,
+                    cache_dir,
+                    cache,
+                )
+            except Exception as e:
+                logging.error(f"Could not set up prechecks for {project.name}: {e}")
+                setup_result = CheckResult(
+                    "Precheck setup", 0, e, traceback.format_exc()
+                )
+                finish(project, [setup_result])
+                continue
+            if not project.checks:
+                # nothing was checked, which mustn't pass for a clean project
+                error = PrecheckFailure(f"No prechecks apply to {args.tech} projects")
+                logging.error(f"Could not set up prechecks for {project.name}: {error}")
+                finish(project, [CheckResult("Precheck setup", 0, error)])
+                continue
+
+            logging.info(f"Starting {len(project.checks)} checks for {project.name}")
+            project.scope = CancelScope() if args.fail_fast else None
+            futures = scheduler.submit_all(project.checks, project.scope)
+            project.futures = dict(enumerate(futures))
+            project.remaining = len(futures)
+            for future in futures:
+                pending[future] = project
+
+    logging.info(
+        f"Checking {len(to_run)} projects, {max_projects} at a time, "
+        f"using {args.jobs} CPU slots"
+    )
+    with CheckScheduler(
+        args.jobs, cache, args.check_timeout, args.check_max_memory
+    ) as scheduler:
+        start_projects(scheduler)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                project = pending.pop(future)
+                project.remaining -= 1
+                if project.remaining > 0:
+                    continue
+                project.layout.close()
+                project.layout = None
+                finish(
+                    project,
+                    [project.futures[i].result() for i in range(len(project.checks))],
+                )
+            start_projects(scheduler)
+
+    markdown_table = write_summary(projects, statuses, args.reports_dir)
+    if args.trace:
+        write_trace(project_results, args.trace)
+    logging.info(f"Summary:\n{markdown_table}")
+    if not all(status["passed"] for status in statuses.values()):
+        logging.error(f"See {args.reports_dir} for more details")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
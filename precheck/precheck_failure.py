@@ -1,2 +1,23 @@
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from drc_report import DrcRule
+
+
 class PrecheckFailure(Exception):
     pass
+
+
+class ToolFailure(PrecheckFailure):
+    """A tool that crashed or gave no verdict, so the check may pass when run again."""
+
+
+class DrcFailure(PrecheckFailure):
+    """A DRC run that completed, but reported violations."""
+
+    def __init__(
+        self, message: str, violations: int, rules: Optional[List["DrcRule"]] = None
+    ):
+        super().__init__(message)
+        self.violations = violations
+        self.rules = rules  # violated rules, if the report was summarized
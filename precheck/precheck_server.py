@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import traceback
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+from cache_defaults import default_cache_dir
+from check_cancel import CancelScope
+from check_scheduler import CheckResult, CheckScheduler
+from layout_context import LayoutContext
+from result_cache import ResultCache
+from tech_data import tech_names
+from template_def import load_template_def
+
+from precheck import (
+    PDK_NAME,
+    PDK_ROOT,
+    REPORTS_PATH,
+    add_limit_arguments,
+    create_result_cache,
+    load_layers,
+    project_checks,
+    write_results,
+)
+
+PRECHECK_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# finished jobs kept for status requests
+MAX_FINISHED_JOBS = 1000
+
+
+class Job:
+    def __init__(self, job_id: str, gds: str, reports_path: str, fail_fast: bool):
+        self.id = job_id
+        self.gds = gds
+        self.reports_path = reports_path
+        self.fail_fast = fail_fast
+        self.state = "queued"  # then "running", "done"
+        self.results: list[CheckResult] = []
+        self.done = threading.Event()
+
+    def as_dict(self) -> Dict[str, Any]:
+        passed = None
+        if self.state == "done":
+            passed = all(result.passed for result in self.results)
+        return {
+            "id": self.id,
+            "gds": self.gds,
+            "state": self.state,
+            "passed": passed,
+            "reports_path": self.reports_path,
+            "results": [
+                {
+                    "name": result.name,
+                    "passed": result.passed,
+                    "cached": result.cached,
+                    "skipped": result.skipped,
+                    "resource_exceeded": result.resource_exceeded,
+                    "error": None if result.error is None else str(result.error),
+                    "time": round(result.elapsed_time, 3),
+                }
+                for result in self.results
+            ],
+        }
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PrecheckService:
+    """Runs precheck jobs from a bounded queue, through one shared worker pool.
+
+    The PDK layer tables and template DEFs stay loaded between jobs. At most
+    `max_running` projects are checked at a time, sharing `jobs` CPU slots; up to
+    `max_queued` more wait, and further jobs are refused.
+    """
+
+    def __init__(
+        self,
+        tech: str,
+        reports_dir: str,
+        jobs: int,
+        cache: Optional[ResultCache] = None,
+        max_running: int = 2,
+        max_queued: int = 16,
+        klayout_batch: bool = False,
+        magic_tiles: int = 1,
+        check_timeout: Optional[float] = None,
+        check_max_memory: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+    ):
+        self.tech = tech
+        self.reports_dir = reports_dir
+        self.klayout_batch = klayout_batch
+        self.magic_tiles = magic_tiles
+        self.cache_dir = cache_dir
+        self.scheduler = CheckScheduler(jobs, cache, check_timeout, check_max_memory)
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(max_queued)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._runners = [
+            threading.Thread(target=self._run_jobs, daemon=True)
+            for _ in range(max(1, max_running))
+        ]
+        for runner in self._runners:
+            runner.start()
+
+    def warm_up(self):
+        """Load the PDK layer tables and the tech's template DEFs."""
+        load_layers(self.tech, cache_dir=self.cache_dir)
+        load_layers(self.tech, only_valid=False, cache_dir=self.cache_dir)
+        def_root = os.path.join(PRECHECK_DIR, "..", "tech", self.tech, "def")
+        def_files = glob.glob(os.path.join(def_root, "**", "*.def"), recursive=True)
+        for def_file in def_files:
+            # the memory cache is keyed by the real path, so the checks' relative
+            # paths find these entries
+            load_template_def(def_file, self.cache_dir)
+        logging.info(
+            f"Loaded layers and {len(def_files)} template DEFs for {self.tech}"
+        )
+
+    def submit(self, gds: str, fail_fast: bool = False) -> Job:
+        job_id = f"{next(self._ids):06d}"
+        job = Job(job_id, gds, os.path.join(self.reports_dir, job_id), fail_fast)
+        with self._jobs_lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self._queue.maxsize} jobs already queued")
+            self._jobs[job_id] = job
+            finished = [j.id for j in self._jobs.values() if j.state == "done"]
+            for old_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[old_id]
+        logging.info(f"Queued job {job_id} for {gds}")
+        return job
+
+    def job(self, job_id: str) -> Optional[Job]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def _run_jobs(self):
+        while (job := self._queue.get()) is not None:
+            job.state = "running"
+            try:
+                job.results = self.run_job(job)
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {e}")
+                job.results = [
+                    CheckResult("Precheck setup", 0, e, traceback.format_exc())
+                ]
+            job.state = "done"
+            job.done.set()
+            result = "passed" if all(r.passed for r in job.results) else "failed"
+            logging.info(f"Precheck {result} for job {job.id} ({job.gds})")
+
+    def run_job(self, job: Job) -> list[CheckResult]:
+        os.makedirs(job.reports_path, exist_ok=True)
+        layout = LayoutContext(job.gds)
+        try:
+            try:
+                checks = project_checks(
+                    layout,
+                    self.tech,
+                    job.reports_path,
+                    self.klayout_batch,
+                    self.magic_tiles,
+                    cache_dir=self.cache_dir,
+                    cache=self.scheduler.cache,
+                )
+            except Exception as e:
+                results = [CheckResult("Precheck setup", 0, e, traceback.format_exc())]
+            else:
+                scope = CancelScope() if job.fail_fast else None
+                futures = self.scheduler.submit_all(checks, scope)
+                results = [future.result() for future in futures]
+        finally:
+            layout.close()
+        write_results(results, job.reports_path)
+        return results
+
+    def shutdown(self):
+        for _ in self._runners:
+            self._queue.put(None)
+        for runner in self._runners:
+            runner.join()
+        self.scheduler.shutdown()
+
+
+class PrecheckRequestHandler(BaseHTTPRequestHandler):
+    """JSON API:
+
+    POST /jobs {"gds": "/abs/path/tt_um_x.gds", "fail_fast": false, "wait": false}
+        queue a job (503 if the queue is full); with "wait", answer when it's done
+    GET /jobs/<id>
+        state of a job, and its results once done
+    GET /health
+    """
+
+    server: "ServiceServer"
+
+    def send_json(self, status: HTTPStatus, data: Dict[str, Any]):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(HTTPStatus.OK, {"status": "ok"})
+        elif self.path.startswith("/jobs/"):
+            job = self.server.service.job(self.path[len("/jobs/") :])
+            if job is None:
+                self.send_json(HTTPStatus.NOT_FOUND, {"error": "No such job"})
+            else:
+                self.send_json(HTTPStatus.OK, job.as_dict())
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            gds = request["gds"]
+        except (ValueError, KeyError, TypeError):
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": "Expected {'gds': path}"})
+            return
+        if not os.path.isabs(gds) or not gds.endswith((".gds", ".oas")):
+            self.send_json(
+                HTTPStatus.BAD_REQUEST,
+                {"error": "gds must be an absolute path to a .gds or .oas file"},
+            )
+            return
+
+        try:
+            job = self.server.service.submit(gds, bool(request.get("fail_fast")))
+        except QueueFull as e:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+            return
+        if request.get("wait"):
+            job.done.wait()
+            self.send_json(HTTPStatus.OK, job.as_dict())
+        else:
+            self.send_json(HTTPStatus.ACCEPTED, job.as_dict())
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address or "local")
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class ServiceServer(ThreadingHTTPServer):
+    service: PrecheckService
+
+
+class UnixServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    service: PrecheckService
+
+
+def main():
+    default_tech = PDK_NAME
+    if default_tech not in tech_names:
+        default_tech = tech_names[0]
+
+    parser = argparse.ArgumentParser(
+        description="Serve precheck jobs over HTTP, keeping the PDK data loaded"
+    )
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument("--socket", help="listen on this Unix socket")
+    listen.add_argument("--port", type=int, help="listen on this TCP port")
+    parser.add_argument("--host", default="127.0.0.1", help="address for --port")
+    parser.add_argument(
+        "--tech", required=False, default=default_tech, choices=tech_names
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of CPU slots shared by all jobs (default: all cores)",
+    )
+    parser.add_argument(
+        "--max-running",
+        type=int,
+        default=2,
+        help="number of projects checked at the same time (default: 2)",
+    )
+    parser.add_argument(
+        "--max-queued",
+        type=int,
+        default=16,
+        help="number of jobs waiting before new ones are refused (default: 16)",
+    )
+    parser.add_argument(
+        "--reports-dir",
+        default=os.path.join(REPORTS_PATH, "server"),
+        help="directory for the reports, one subdirectory per job",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always run every check, ignoring and not updating the result cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory holding cached check results",
+    )
+    parser.add_argument(
+        "--klayout-batch",
+        action="store_true",
+        help="run each project's KLayout DRC decks in a single klayout process",
+    )
+    parser.add_argument(
+        "--magic-tiles",
+        type=int,
+        default=1,
+        help="split each project's magic DRC into this many tiles (default: 1)",
+    )
+    add_limit_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    logging.info(f"PDK_ROOT: {PDK_ROOT}")
+    logging.info(f"Tech: {args.tech}")
+
+    # paths given on the command line are relative to the caller's directory
+    args.reports_dir = os.path.abspath(args.reports_dir)
+    args.cache_dir = os.path.abspath(args.cache_dir)
+    if args.socket:
+        args.socket = os.path.abspath(args.socket)
+    # the checks find their scripts and tech files relative to the precheck directory
+    os.chdir(PRECHECK_DIR)
+
+    cache = None
+    if not args.no_cache:
+        cache = create_result_cache(args.cache_dir, args.tech)
+
+    service = PrecheckService(
+        args.tech,
+        args.reports_dir,
+        args.jobs,
+        cache,
+        args.max_running,
+        args.max_queued,
+        args.klayout_batch,
+        args.magic_tiles,
+        args.check_timeout,
+        args.check_max_memory,
+        None if args.no_cache else args.cache_dir,
+    )
+    service.warm_up()
+
+    server: ServiceServer | UnixServiceServer
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixServiceServer(args.socket, PrecheckRequestHandler)
+        logging.info(f"Listening on {args.socket}")
+    else:
+        server = ServiceServer((args.host, args.port), PrecheckRequestHandler)
+        logging.info(f"Listening on http://{args.host}:{server.server_port}")
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
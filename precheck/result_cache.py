@@ -0,0 +1,190 @@
+import glob
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from check_scheduler import Check, CheckResult
+from drc_report import DrcRule
+from precheck_failure import DrcFailure, PrecheckFailure, ToolFailure
+
+PRECHECK_DIR = os.path.dirname(os.path.realpath(__file__))
+CACHE_FORMAT = 1
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def pdk_version(pdk_root: str, pdk_name: str) -> str:
+    """Identify the installed PDK.
+
+    ciel / volare install each PDK version into its own directory and symlink it
+    into PDK_ROOT, so the resolved path already contains the version hash.
+    """
+    if os.getenv("PDK_VERSION"):
+        return os.environ["PDK_VERSION"]
+    pdk_dir = os.path.realpath(os.path.join(pdk_root, pdk_name))
+    sources_file = os.path.join(pdk_dir, "SOURCES")
+    if os.path.exists(sources_file):
+        return f"{pdk_dir}:{hash_file(sources_file)}"
+    return pdk_dir
+
+
+def tool_versions() -> Dict[str, str]:
+    with open(os.path.join(PRECHECK_DIR, "tool-versions.json")) as f:
+        versions = json.load(f)
+    for package in ("gdstk", "klayout", "yowasp-yosys"):
+        try:
+            versions[f"python:{package}"] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return versions
+
+
+def code_version() -> str:
+    """Hash of the precheck sources, so that changes to the checks invalidate the cache."""
+    sha = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(PRECHECK_DIR, "*.py"))):
+        if os.path.basename(path).startswith("test_"):
+            continue
+        sha.update(os.path.basename(path).encode())
+        sha.update(hash_file(path).encode())
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of check results, keyed by the content of everything a check depends on.
+
+    A check opts in by listing its `inputs` (files, hashed by content) and `params`
+    (any other JSON-serializable arguments). Reports listed under `reports` are stored
+    along with the result and copied back on a cache hit.
+
+    Only verdicts are cached: passes, and PrecheckFailures other than ToolFailures.
+    Crashed tools and unexpected errors (e.g. missing files) are always retried.
+    """
+
+    def __init__(self, cache_dir: str, environment: Dict[str, Any]):
+        self.cache_dir = cache_dir
+        self.environment = environment
+        # by (path, modification time, size), so that a file rewritten in place
+        # (e.g. a new upload to the server) is hashed again
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def _hash_input(self, path: str) -> str:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if memo_key not in self._file_hashes:
+                self._file_hashes[memo_key] = hash_file(path)
+            return self._file_hashes[memo_key]
+
+    def key(self, check: Check) -> Optional[str]:
+        if "inputs" not in check:
+            return None
+        try:
+            inputs = [self._hash_input(path) for path in check["inputs"]]
+        except OSError:
+            return None
+        key_data = {
+            "format": CACHE_FORMAT,
+            "name": check["name"],
+            "inputs": inputs,
+            "params": check.get("params", {}),
+            "environment": self.environment,
+        }
+        key_json = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(key_json.encode()).hexdigest()
+
+    def contains(self, check: Check) -> bool:
+        """Whether a result of the check is cached, without restoring its reports."""
+        key = self.key(check)
+        if key is None:
+            return False
+        return os.path.exists(os.path.join(self.cache_dir, key[:2], key, "result.json"))
+
+    def lookup(self, check: Check) -> Optional[CheckResult]:
+        key = self.key(check)
+        if key is None:
+            return None
+        entry_dir = os.path.join(self.cache_dir, key[:2], key)
+        try:
+            with open(os.path.join(entry_dir, "result.json")) as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        for report in check.get("reports", []):
+            cached_report = os.path.join(entry_dir, os.path.basename(report))
+            if os.path.exists(cached_report):
+                shutil.copyfile(cached_report, report)
+
+        error: Optional[PrecheckFailure] = None
+        if not entry["passed"]:
+            if entry.get("violations") is not None:
+                rules = entry.get("rules")
+                if rules is not None:
+                    rules = [DrcRule.from_dict(rule) for rule in rules]
+                error = DrcFailure(entry["message"], entry["violations"], rules)
+            else:
+                error = PrecheckFailure(entry["message"])
+        logging.info(f"Using cached result for {check['name']} ({key[:12]})")
+        return CheckResult(
+            check["name"],
+            entry["elapsed_time"],
+            error,
+            entry.get("traceback"),
+            cached=True,
+        )
+
+    def store(self, check: Check, result: CheckResult):
+        if result.error is not None and (
+            not isinstance(result.error, PrecheckFailure)
+            or isinstance(result.error, ToolFailure)
+        ):
+            return
+        key = self.key(check)
+        if key is None:
+            return
+        rules = getattr(result.error, "rules", None)
+        if rules is not None:
+            rules = [rule.as_dict() for rule in rules]
+        entry = {
+            "name": check["name"],
+            "passed": result.passed,
+            "message": None if result.passed else str(result.error),
+            "violations": getattr(result.error, "violations", None),
+            "rules": rules,
+            "traceback": result.error_traceback,
+            "elapsed_time": result.elapsed_time,
+        }
+        parent_dir = os.path.join(self.cache_dir, key[:2])
+        os.makedirs(parent_dir, exist_ok=True)
+        # write into a scratch directory first, so that readers never see partial entries
+        temp_dir = tempfile.mkdtemp(dir=parent_dir)
+        try:
+            for report in check.get("reports", []):
+                if os.path.exists(report):
+                    shutil.copyfile(
+                        report, os.path.join(temp_dir, os.path.basename(report))
+                    )
+            with open(os.path.join(temp_dir, "result.json"), "w") as f:
+                json.dump(entry, f, indent=2)
+            entry_dir = os.path.join(parent_dir, key)
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            logging.warning(f"Could not store cached result for {check['name']}: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -136,22 +136,17 @@ lyp_filename = {
     "gf180mcuD": "gf180mcu.lyp",
 }
 
-# TODO: read layer numbers from lyp file
-valid_lef_port_layers = {
-    "sky130A": {
-        "met1.pin": (68, 16),
-        "met2.pin": (69, 16),
-        "met3.pin": (70, 16),
-        "met4.pin": (71, 16),
-    },
-    "ihp-sg13g2": {
-        "Metal1.pin": (8, 2),
-        "Metal2.pin": (10, 2),
-        "Metal3.pin": (30, 2),
-        "Metal4.pin": (50, 2),
-        "Metal5.pin": (67, 2),
-        "TopMetal1.pin": (126, 2),
-    },
+# layers of the LEF pins in the GDS, their numbers are looked up in the lyp file
+lef_port_layers = {
+    "sky130A": ["met1.pin", "met2.pin", "met3.pin", "met4.pin"],
+    "ihp-sg13g2": [
+        "Metal1.pin",
+        "Metal2.pin",
+        "Metal3.pin",
+        "Metal4.pin",
+        "Metal5.pin",
+        "TopMetal1.pin",
+    ],
 }
 forbidden_layers = {
     "sky130A": [
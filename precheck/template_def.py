@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from functools import partial
+from typing import Dict, Optional, Tuple, TypedDict
+
+from cache_defaults import default_cache_dir
+from precheck_failure import PrecheckFailure
+
+PRECHECK_DIR = os.path.dirname(os.path.realpath(__file__))
+
+TEMPLATE_DEF_FORMAT = 1
+
+
+class TemplateDef(TypedDict):
+    dbu_per_micron: int
+    die_width: int  # nm
+    die_height: int  # nm
+    pins: Dict[str, Tuple[str, int, int, int, int]]  # layer, lx, by, rx, ty in nm
+
+
+def parse_dbu_to_nm(value: str, dbu_per_micron: int):
+    # parse a value in database units into nanometers
+    assert dbu_per_micron != 0
+    val_dbu = int(value)
+    assert (val_dbu * 1000) % dbu_per_micron == 0
+    return (val_dbu * 1000) // dbu_per_micron
+
+
+def parse_template_def(template_def: str) -> TemplateDef:
+    # def syntax: https://coriolis.lip6.fr/doc/lefdef/lefdefref/DEFSyntax.html
+
+    units_re = re.compile(r"UNITS DISTANCE MICRONS (\S+) ;")
+    diearea_re = re.compile(r"DIEAREA \( (\S+) (\S+) \) \( (\S+) (\S+) \) ;")
+    pins_re = re.compile(r"PINS (\d+) ;")
+    pin_re = re.compile(r" *- (\S+) \+ NET (\S+) \+ DIRECTION (\S+) \+ USE (\S+)")
+    layer_re = re.compile(r" *\+ LAYER (\S+) \( (\S+) (\S+) \) \( (\S+) (\S+) \)")
+    placed_re = re.compile(r" *\+ PLACED \( (\S+) (\S+) \) (\S+) ;")
+
+    def_pins = {}
+    dbu_per_micron = 0
+    die_width = 0
+    die_height = 0
+
+    with open(template_def) as f:
+        for line in f:
+            if line.startswith("UNITS "):
+                match = units_re.match(line)
+                (dbu_per_micron,) = map(int, match.groups())
+                parse_nm = partial(parse_dbu_to_nm, dbu_per_micron=dbu_per_micron)
+            elif line.startswith("DIEAREA "):
+                match = diearea_re.match(line)
+                lx, by, rx, ty = map(parse_nm, match.groups())
+                if (lx, by) != (0, 0):
+                    raise PrecheckFailure(
+                        "Wrong die origin in template DEF, expecting (0, 0)"
+                    )
+                die_width = rx
+                die_height = ty
+            elif line.startswith("PINS "):
+                match = pins_re.match(line)
+                pin_count = int(match.group(1))
+                break
+
+        for i in range(pin_count):
+            line = next(f)
+            match = pin_re.match(line)
+            pin_name, net_name, direction, use = match.groups()
+            if pin_name != net_name:
+                raise PrecheckFailure(
+                    f"Inconsistent pin name and net name in template DEF: {pin_name} vs {net_name}"
+                )
+
+            line = next(f)
+            if not line.strip().startswith("+ PORT"):
+                raise PrecheckFailure(
+                    "Unexpected token in template DEF: PINS not followed by PORT"
+                )
+
+            line = next(f)
+            match = layer_re.match(line)
+            layer, lx, by, rx, ty = match.groups()
+            lx, by, rx, ty = map(parse_nm, (lx, by, rx, ty))
+
+            line = next(f)
+            match = placed_re.match(line)
+            ox, oy, direction = match.groups()
+            ox, oy = map(parse_nm, (ox, oy))
+
+            if pin_name in def_pins:
+                raise PrecheckFailure("Duplicate pin in template DEF")
+
+            def_pins[pin_name] = (layer, ox + lx, oy + by, ox + rx, oy + ty)
+
+        line = next(f)
+        if not line.startswith("END PINS"):
+            raise PrecheckFailure(
+                f"Unexpected token in template DEF: PINS {pin_count} section does not end after {pin_count} pins"
+            )
+
+    return {
+        "dbu_per_micron": dbu_per_micron,
+        "die_width": die_width,
+        "die_height": die_height,
+        "pins": def_pins,
+    }
+
+
+_memory_cache: Dict[str, Tuple[Tuple[int, int], TemplateDef]] = {}
+_memory_cache_lock = threading.Lock()
+
+
+def read_cached_template(
+    cache_file: str, stamp: Tuple[int, int]
+) -> Optional[TemplateDef]:
+    try:
+        with open(cache_file) as f:
+            entry = json.load(f)
+        if entry["format"] != TEMPLATE_DEF_FORMAT or entry["stamp"] != list(stamp):
+            return None
+        template = entry["template"]
+        template["pins"] = {pin: tuple(rect) for pin, rect in template["pins"].items()}
+        return template
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cached_template(
+    cache_file: str, path: str, stamp: Tuple[int, int], template: TemplateDef
+):
+    entry = {
+        "format": TEMPLATE_DEF_FORMAT,
+        "path": path,
+        "stamp": list(stamp),
+        "template": template,
+    }
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not cache template DEF {path}: {e}")
+
+
+def load_template_def(
+    template_def: str, cache_dir: Optional[str] = None
+) -> TemplateDef:
+    """Parse a template DEF, reusing an earlier parse while the file is unchanged.
+
+    Parsed templates are kept in memory and, with a `cache_dir`, as JSON in its
+    template_def subdirectory. Both are invalidated by the file's modification
+    time and size.
+    """
+    path = os.path.realpath(template_def)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _memory_cache_lock:
+        cached = _memory_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    cache_file = None
+    template = None
+    if cache_dir is not None:
+        cache_key = hashlib.sha256(path.encode()).hexdigest()[:32]
+        cache_file = os.path.join(cache_dir, "template_def", cache_key + ".json")
+        template = read_cached_template(cache_file, stamp)
+    if template is None:
+        template = parse_template_def(path)
+        if cache_file is not None:
+            write_cached_template(cache_file, path, stamp, template)
+
+    with _memory_cache_lock:
+        _memory_cache[path] = (stamp, template)
+    return template
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompile the template DEF files into the template DEF cache"
+    )
+    parser.add_argument("--cache-dir", default=default_cache_dir())
+    parser.add_argument(
+        "def_files",
+        nargs="*",
+        default=sorted(
+            glob.glob(
+                os.path.join(PRECHECK_DIR, "..", "tech", "*", "def", "**", "*.def"),
+                recursive=True,
+            )
+        ),
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    for def_file in args.def_files:
+        template = load_template_def(def_file, args.cache_dir)
+        logging.info(f"{def_file}: {len(template['pins'])} pins")
+
+
+if __name__ == "__main__":
+    main()
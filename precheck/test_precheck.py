@@ -1,10 +1,43 @@
+import io
+import json
+import logging
 import os
+import random
+import shutil
 import subprocess
+import sys
 import textwrap
+import threading
+import time
+import urllib.error
+import urllib.request
 
+import gdstk
 import klayout.db as pya
+import klayout.rdb as rdb
 import klayout_tools
+import precheck_batch
 import pytest
+import template_def
+from check_metrics import run_subprocess, write_metrics, write_trace
+from check_scheduler import Check, CheckResult, CpuSlots, run_checks
+from drc_report import read_drc_report
+from klayout_drc_batch import KlayoutDrcBatch
+from layout_context import LayoutContext
+from lef_parser import parse_lef
+from magic_drc_tiles import (
+    MAGIC_DRC_HALO,
+    drc_tiles,
+    merge_tile_mags,
+    merge_tile_reports,
+    parse_magic_drc_report,
+)
+from pin_check import PolygonIndex, canonicalize_rectangles, find_overlapping_ports
+from precheck_batch import find_layouts
+from precheck_server import PrecheckRequestHandler, PrecheckService, ServiceServer
+from result_cache import ResultCache
+from template_def import load_template_def, parse_template_def
+from verilog_syntax import VerilogSyntaxBatch, check_verilog_files
 
 import precheck
 
@@ -107,6 +140,23 @@ def gds_invalid_macro_name(tmp_path_factory: pytest.TempPathFactory):
     return str(gds_file)
 
 
+@pytest.fixture(scope="session")
+def gds_met1_errors_spread(tmp_path_factory: pytest.TempPathFactory):
+    """Creates a GDS with too small met1 rects all over the die, one in its center."""
+    gds_file = tmp_path_factory.mktemp("gds") / "TEST_met1_errors_spread.gds"
+    layout = pya.Layout()
+    top_cell = layout.create_cell("TEST_met1_errors_spread")
+    prboundary_info = gds_layers["prBoundary.boundary"]
+    prboundary = layout.layer(prboundary_info.layer, prboundary_info.data_type)
+    top_cell.shapes(prboundary).insert(pya.DBox(0, 0, 161, 111.52))
+    met1_info = gds_layers["met1.drawing"]
+    met1 = layout.layer(met1_info.layer, met1_info.data_type)
+    for x, y in [(10, 10), (150, 10), (10, 100), (150, 100), (80.5, 55.76), (40, 55)]:
+        top_cell.shapes(met1).insert(pya.DBox(x - 0.05, y - 0.05, x + 0.05, y + 0.05))
+    layout.write(str(gds_file))
+    return str(gds_file)
+
+
 @pytest.fixture(scope="session")
 def gds_shapes_outside_area(tmp_path_factory: pytest.TempPathFactory):
     """Creates a GDS with shapes outside the project area."""
@@ -571,6 +621,103 @@ def test_magic_drc_fail(gds_fail_met1_poly: str):
         precheck.magic_drc(gds_fail_met1_poly, "TEST_met1_error")
 
 
+def test_magic_drc_tiled(gds_met1_errors_spread: str, tmp_path):
+    def violations(reports_path: str, tiles: int):
+        with pytest.raises(precheck.PrecheckFailure):
+            precheck.magic_drc(
+                gds_met1_errors_spread,
+                "TEST_met1_errors_spread",
+                reports_path,
+                tiles,
+            )
+        with open(f"{reports_path}/magic_drc.txt") as f:
+            report = parse_magic_drc_report(f)
+        assert os.path.exists(f"{reports_path}/magic_drc.mag")
+        return {error: sorted(boxes) for error, boxes in report.violations.items()}
+
+    os.makedirs(tmp_path / "monolithic")
+    os.makedirs(tmp_path / "tiled")
+    monolithic = violations(str(tmp_path / "monolithic"), 1)
+    assert monolithic
+    assert violations(str(tmp_path / "tiled"), 4) == monolithic
+
+
+def test_merge_magic_drc_reports():
+    tiles = drc_tiles((0, 0, 100, 100), 4, halo=10)
+    assert [tile.area for tile in tiles] == [
+        (-10, -10, 60, 60),
+        (40, -10, 110, 60),
+        (-10, 40, 60, 110),
+        (40, 40, 110, 110),
+    ]
+    assert drc_tiles((0, 0, 400, 100), 4)[1].area[0] == 100 - MAGIC_DRC_HALO
+
+    report_text = textwrap.dedent(
+        """\
+        TOP
+        ----------------------------------------
+        Metal1 width < 0.14um (met1.1)
+        ----------------------------------------
+         49.000 49.000 52.000 52.000
+         10.000 10.000 10.100 10.100
+         10.000 10.000 10.100 10.100
+         -5.000 99.000 -4.000 120.000
+        ----------------------------------------
+        [INFO]: COUNT: 4
+        [INFO]: Should be divided by 3 or 4
+
+        """
+    )
+    # every tile sees the violations, as if the halo covered the whole die
+    reports = [parse_magic_drc_report(io.StringIO(report_text)) for _ in tiles]
+    merged = merge_tile_reports(tiles, reports)
+    assert merged.violations == {
+        "Metal1 width < 0.14um (met1.1)": [
+            (10.0, 10.0, 10.1, 10.1),  # tile 0
+            (-5.0, 99.0, -4.0, 120.0),  # tile 2, centered outside the die
+            (49.0, 49.0, 52.0, 52.0),  # tile 3
+        ]
+    }
+    output = io.StringIO()
+    merged.write(output)
+    assert "[INFO]: COUNT: 3\n" in output.getvalue()
+    output.seek(0)
+    assert parse_magic_drc_report(output).violations == merged.violations
+
+
+def test_merge_magic_drc_mags():
+    def mag(*sections):
+        lines = ["magic", "tech sky130A", "magscale 1 2"]
+        for section in sections:
+            lines.extend(section.split(";"))
+        return "\n".join(lines) + "\n"
+
+    layout = "<< checkpaint >>;rect -100 -100 300 300;<< metal1 >>;rect 0 0 200 200"
+    end = "<< labels >>;rlabel metal1 0 0 10 10 0 a;<< properties >>;<< end >>"
+    tile_0 = mag(layout, "<< error_s >>;rect 10 10 20 20;rect 90 90 110 110", end)
+    tile_1 = mag(
+        layout,
+        "<< error_p >>;rect 150 150 160 160",
+        "<< error_s >>;rect 90 90 110 110",
+        end,
+    )
+    assert merge_tile_mags([tile_0]) == tile_0
+    assert merge_tile_mags([tile_0, tile_1]) == mag(
+        layout,
+        "<< error_s >>;rect 10 10 20 20;rect 90 90 110 110",
+        "<< error_p >>;rect 150 150 160 160",
+        end,
+    )
+    # the error layers go with the paint, even when the first view has none
+    assert merge_tile_mags([mag(layout, end), tile_1]) == mag(
+        "<< checkpaint >>;rect -100 -100 300 300",
+        "<< error_p >>;rect 150 150 160 160",
+        "<< error_s >>;rect 90 90 110 110",
+        "<< metal1 >>;rect 0 0 200 200",
+        end,
+    )
+
+
 def test_klayout_feol_pass(gds_valid: str):
     precheck.klayout_drc(gds_valid, "feol")
 
@@ -628,10 +775,43 @@ def test_klayout_zero_area_drc_fail(gds_zero_area: str):
 
 
 def test_shapes_outside_area(gds_shapes_outside_area: str):
-    with pytest.raises(precheck.PrecheckFailure, match="Shapes outside project area"):
+    with pytest.raises(
+        precheck.PrecheckFailure,
+        match=r"Shapes outside project area: met1.drawing \(\d+/\d+\) in TEST_shapes",
+    ):
         precheck.boundary_check(gds_shapes_outside_area, "sky130A")
 
 
+def test_shapes_outside_area_in_subcell(tmp_path):
+    gds_file = str(tmp_path / "TEST_subcell_outside_area.gds")
+    layout = pya.Layout()
+    met1, met2, boundary = (
+        layout.layer(gds_layers[name].layer, gds_layers[name].data_type)
+        for name in ("met1.drawing", "met2.drawing", "prBoundary.boundary")
+    )
+    top_cell = layout.create_cell("TEST_subcell_outside_area")
+    top_cell.shapes(boundary).insert(pya.DBox(0, 0, 10, 10))
+    top_cell.shapes(met1).insert(pya.DBox(1, 1, 2, 2))
+    macro = layout.create_cell("macro")
+    macro.shapes(met1).insert(pya.DBox(0, 0, 1, 1))
+    macro.shapes(met2).insert(pya.DBox(0, 0, 1, 1))
+    top_cell.insert(
+        pya.DCellInstArray(macro.cell_index(), pya.DTrans(pya.DVector(1, 1)))
+    )
+    layout.write(gds_file)
+    precheck.boundary_check(gds_file, "sky130A")
+
+    top_cell.insert(
+        pya.DCellInstArray(macro.cell_index(), pya.DTrans(pya.DVector(9.5, 1)))
+    )
+    layout.write(gds_file)
+    with pytest.raises(
+        precheck.PrecheckFailure,
+        match=r"area: met1.drawing \(\d+/\d+\) in macro; met2.drawing \(\d+/\d+\) in macro$",
+    ):
+        precheck.boundary_check(gds_file, "sky130A")
+
+
 def test_wrong_power_pins_1(verilog_lef_wrong_power_pins: tuple[str, str]):
     verilog_file, lef_file = verilog_lef_wrong_power_pins
     with pytest.raises(precheck.PrecheckFailure, match="Verilog contains VAPWR"):
@@ -802,6 +982,15 @@ def test_analog_exact_pins(gds_lef_analog_pin_example: tuple[str, str]):
     )
 
 
+def test_analog_pins_several_top_cells(tmp_path):
+    lib = gdstk.Library()
+    lib.new_cell("TOP")
+    lib.new_cell("unused")
+    gds_file = str(tmp_path / "several_top_cells.gds")
+    lib.write_gds(gds_file)
+    precheck.analog_pin_check(gds_file, "sky130A", True, False, 0, {})
+
+
 def test_analog_less_pins(gds_lef_analog_pin_example: tuple[str, str]):
     gds_file, lef_file = gds_lef_analog_pin_example
     with pytest.raises(
@@ -859,3 +1048,939 @@ def test_verilog_syntax_error(verilog_syntax_error: str):
         match="Verilog syntax check failed",
     ):
         precheck.verilog_syntax_check(verilog_syntax_error)
+
+
+def test_run_checks_keeps_order():
+    def slow_check():
+        time.sleep(0.2)
+
+    def failing_check():
+        raise precheck.PrecheckFailure("failed on purpose")
+
+    checks = [
+        {"name": "slow", "check": slow_check},
+        {"name": "fail", "check": failing_check},
+        {"name": "fast", "check": lambda: None},
+    ]
+    results = run_checks(checks, jobs=3)
+    assert [result.name for result in results] == ["slow", "fail", "fast"]
+    assert [result.passed for result in results] == [True, False, True]
+    assert str(results[1].error) == "failed on purpose"
+    assert "failed on purpose" in results[1].error_traceback
+
+
+def test_run_checks_respects_cpu_slots():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def check(cpus: int):
+        with lock:
+            running.append(cpus)
+            peak.append(sum(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(cpus)
+
+    checks = [{"name": f"light {i}", "check": lambda: check(1)} for i in range(4)]
+    checks.append({"name": "heavy", "check": lambda: check(4), "cpus": 8})
+    results = run_checks(checks, jobs=4)
+    assert all(result.passed for result in results)
+    assert max(peak) <= 4
+
+
+def test_cpu_slots_first_come_first_served():
+    slots = CpuSlots(2)
+    slots.acquire(1)
+    order = []
+
+    def take(count: int, name: str):
+        slots.acquire(count)
+        order.append(name)
+        slots.release(count)
+
+    wide = threading.Thread(target=take, args=(2, "wide"))
+    wide.start()
+    time.sleep(0.1)
+    narrow = threading.Thread(target=take, args=(1, "narrow"))
+    narrow.start()
+    time.sleep(0.1)
+    # a slot is free, but the narrow check waits behind the wide one
+    assert order == []
+    slots.release(1)
+    wide.join()
+    narrow.join()
+    assert order == ["wide", "narrow"]
+
+
+def test_run_checks_start_order():
+    started = []
+    checks = [
+        {
+            "name": name,
+            "check": lambda name=name: started.append(name),
+            "cost": cost,
+            "blocking": blocking,
+        }
+        for name, cost, blocking in [
+            ("drc", 600, False),
+            ("pins", 1, True),
+            ("names", 0.1, True),
+            ("zero_area", 30, False),
+            ("magic", 1200, False),
+        ]
+    ]
+    results = run_checks(checks, jobs=1)
+    # blocking checks cheapest first, then the others longest first
+    assert started == ["names", "pins", "magic", "drc", "zero_area"]
+    assert [result.name for result in results] == [
+        "drc",
+        "pins",
+        "names",
+        "zero_area",
+        "magic",
+    ]
+
+
+def test_run_checks_fail_fast():
+    def structural_check():
+        time.sleep(0.3)  # let the DRC start
+        raise precheck.PrecheckFailure("wrong cell name")
+
+    checks = [
+        {
+            "name": "DRC",
+            "check": lambda: run_subprocess(["sleep", "30"]),
+            "cost": 600,
+        },
+        {"name": "Later DRC", "check": lambda: None, "cost": 120},
+        {
+            "name": "Cell name check",
+            "check": structural_check,
+            "cost": 0.1,
+            "blocking": True,
+        },
+    ]
+    start_time = time.time()
+    results = run_checks(checks, jobs=2, fail_fast=True)
+    assert time.time() - start_time < 10
+    drc, later, cell_names = results
+    assert str(cell_names.error) == "wrong cell name"
+    assert drc.skipped == "Cell name check failed" and drc.metrics is not None
+    assert later.skipped == "Cell name check failed" and later.metrics is None
+    assert not any(result.passed for result in results)
+
+    # without fail-fast, everything runs
+    checks[0]["check"] = lambda: None
+    results = run_checks(checks, jobs=2)
+    assert [result.passed for result in results] == [True, True, False]
+
+
+def test_run_checks_resource_limits():
+    # a child holding ~200 MB, then sleeping
+    hog = "b = bytearray(200 << 20); b[::4096] = b'x' * len(b[::4096]); time.sleep(30)"
+    checks = [
+        {"name": "Hanging DRC", "check": lambda: run_subprocess(["sleep", "30"])},
+        {
+            "name": "Hungry DRC",
+            "check": lambda: run_subprocess(
+                [sys.executable, "-c", f"import time; {hog}"]
+            ),
+            "timeout": 20,
+            "max_memory_mb": 100,
+        },
+        {"name": "Quick check", "check": lambda: run_subprocess(["true"])},
+    ]
+    start_time = time.time()
+    results = run_checks(checks, jobs=3, timeout=1)
+    assert time.time() - start_time < 10
+    hanging, hungry, quick = results
+    assert hanging.resource_exceeded and str(hanging.error) == "Timed out after 1 s"
+    assert hungry.resource_exceeded
+    assert str(hungry.error) == "Used more than 100 MB of memory"
+    assert quick.passed and not quick.resource_exceeded
+
+    testsuite = precheck.results_testsuite(results)
+    error = testsuite.find("testcase[@name='Hanging DRC']/error")
+    assert error is not None and error.get("type") == "ResourceExceeded"
+    assert testsuite.find("testcase[@name='Quick check']/error") is None
+    assert "⏱️ Resource limit exceeded: Timed out" in precheck.results_markdown(results)
+
+
+def test_check_metrics(tmp_path):
+    def spawning_check():
+        # a child allocating ~64 MB and burning some CPU
+        child = "b = bytearray(64 << 20); sum(range(3_000_000))"
+        run_subprocess([sys.executable, "-c", child])
+
+    def failing_check():
+        (tmp_path / "data").write_bytes(b"x" * 100_000)
+        (tmp_path / "data").read_bytes()
+        raise precheck.PrecheckFailure("failed on purpose")
+
+    checks = [
+        {"name": "spawning", "check": spawning_check},
+        {"name": "failing", "check": failing_check},
+    ]
+    results = run_checks(checks, jobs=2)
+    spawning, failing = (result.metrics for result in results)
+    assert spawning.child_max_rss_kb > 64 << 10
+    assert spawning.child_user_time + spawning.child_system_time > 0
+    assert failing.child_max_rss_kb == 0
+    assert failing.read_bytes is None or failing.read_bytes >= 100_000
+    assert failing.wall_time == results[1].elapsed_time
+
+    write_metrics(results, str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json") as f:
+        metrics = json.load(f)["checks"]
+    assert [m["name"] for m in metrics] == ["spawning", "failing"]
+    assert [m["passed"] for m in metrics] == [True, False]
+
+    write_trace({"project": results}, str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events if e["ph"] == "X"] == ["spawning", "failing"]
+
+
+def test_layout_context_shared(gds_valid: str, caplog):
+    caplog.set_level(logging.INFO)
+    layout = LayoutContext(gds_valid)
+    precheck.klayout_checks(layout, "TEST_valid", "sky130A")
+    klayout_layout = layout.klayout_layout
+    precheck.boundary_check(layout, "sky130A")
+    precheck.layer_check(layout, "sky130A")
+    precheck.cell_name_check(layout)
+    # all four checks used the one klayout layout, which is also the hierarchy
+    assert layout.klayout_layout is klayout_layout
+    assert layout.hierarchy is klayout_layout
+    loads = [r.message for r in caplog.records if r.message.startswith("Loading")]
+    assert loads == [f"Loading {gds_valid} with klayout"]
+    assert layout.cell_names == ["TEST_valid"]
+
+
+def test_result_cache(tmp_path):
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("first")
+    report_file = tmp_path / "report.xml"
+    runs = []
+
+    def failing_check():
+        runs.append(input_file.read_text())
+        report_file.write_text("<report/>")
+        raise precheck.DrcFailure("3 DRC violations", 3)
+
+    check = {
+        "name": "cached check",
+        "check": failing_check,
+        "inputs": [str(input_file)],
+        "reports": [str(report_file)],
+    }
+    cache = ResultCache(str(tmp_path / "cache"), {"tech": "sky130A"})
+    (first,) = run_checks([check], cache=cache)
+    assert not first.passed and not first.cached
+
+    report_file.unlink()
+    (second,) = run_checks(
+        [check], cache=ResultCache(cache.cache_dir, cache.environment)
+    )
+    assert second.cached
+    assert isinstance(second.error, precheck.DrcFailure)
+    assert second.error.violations == 3
+    assert str(second.error) == "3 DRC violations"
+    assert report_file.read_text() == "<report/>"
+    assert runs == ["first"]
+
+    input_file.write_text("second")
+    (third,) = run_checks(
+        [check], cache=ResultCache(cache.cache_dir, cache.environment)
+    )
+    assert not third.cached
+    assert runs == ["first", "second"]
+
+    # crashed tools give no verdict, they are run again
+    crashes = []
+
+    def crashing_check():
+        crashes.append(True)
+        raise precheck.ToolFailure("Klayout beol failed")
+
+    crash_check = {"name": "crashing check", "check": crashing_check, "inputs": []}
+    for _ in range(2):
+        (crashed,) = run_checks([crash_check], cache=cache)
+        assert not crashed.passed and not crashed.cached
+    assert len(crashes) == 2
+
+    # a long-lived cache notices a file rewritten in place
+    input_file.write_text("rewritten")
+    (fourth,) = run_checks([check], cache=cache)
+    assert not fourth.cached
+    assert runs == ["first", "second", "rewritten"]
+
+
+def test_layout_hierarchy(tmp_path):
+    lib = gdstk.Library()
+    top = lib.new_cell("TOP")
+    a = lib.new_cell("A")
+    a.add(gdstk.rectangle((0, 0), (1, 1), layer=1, datatype=0))
+    b = lib.new_cell("B")
+    b.add(gdstk.Reference(a))
+    top.add(gdstk.Reference(a), gdstk.Reference(b, columns=2, rows=2, spacing=(5, 5)))
+    orphan = lib.new_cell("sky130_fd_orphan")
+    orphan.add(gdstk.rectangle((0, 0), (1, 1), layer=7, datatype=1))
+    gds_file = str(tmp_path / "hierarchy.gds")
+    lib.write_gds(gds_file)
+
+    context = LayoutContext(gds_file)
+    assert sorted(context.cell_names) == ["A", "B", "TOP", "sky130_fd_orphan"]
+    assert context.hierarchy.layers() == 0  # no shapes were read
+    assert precheck.has_sky130_devices(context)
+    # once the full layout is loaded, it is used instead of a second read
+    context = LayoutContext(gds_file)
+    layout = context.klayout_layout
+    assert context.hierarchy is layout
+    assert sorted(context.cell_names) == ["A", "B", "TOP", "sky130_fd_orphan"]
+
+    lib.new_cell("bad#name")
+    lib.write_gds(gds_file)
+    with pytest.raises(precheck.PrecheckFailure, match="invalid character '#'"):
+        precheck.cell_name_check(gds_file)
+
+
+def test_layout_layers(tmp_path):
+    lib = gdstk.Library()
+    top = lib.new_cell("TOP")
+    cell = lib.new_cell("A")
+    cell.add(gdstk.rectangle((0, 0), (1, 1), layer=68, datatype=20))
+    cell.add(gdstk.FlexPath([(0, 0), (5, 0)], 0.5, layer=69, datatype=20))
+    cell.add(gdstk.Label("pin", (0, 0), layer=68, texttype=5))
+    top.add(gdstk.Reference(cell))
+    gds_file = str(tmp_path / "layers.gds")
+    lib.write_gds(gds_file)
+
+    expected = lib.layers_and_datatypes() | lib.layers_and_texttypes()
+    assert LayoutContext(gds_file).layers == expected
+
+    oas_file = str(tmp_path / "layers.oas")
+    LayoutContext(gds_file).klayout_layout.write(oas_file)
+    assert LayoutContext(oas_file).layers == expected
+
+
+def test_layout_context_oasis(gds_valid: str, tmp_path):
+    oas_file = str(tmp_path / "TEST_valid.oas")
+    layout = pya.Layout()
+    layout.read(gds_valid)
+    layout.write(oas_file)
+
+    context = LayoutContext(oas_file)
+    precheck.klayout_checks(context, "TEST_valid", "sky130A")
+    precheck.boundary_check(context, "sky130A")
+    precheck.layer_check(context, "sky130A")
+    assert context.cell_names == ["TEST_valid"]
+
+    gds_path = context.gds_path
+    assert gds_path.endswith(".gds") and os.path.exists(gds_path)
+    assert context.gds_path == gds_path
+    context.close()
+    assert not os.path.exists(gds_path)
+    assert context._klayout_layout is None  # the parsed layout is released too
+
+
+def test_find_layouts(tmp_path):
+    projects_dir = tmp_path / "projects"
+    for name, extensions in [("tt_um_a", ["gds", "oas"]), ("tt_um_b", ["oas"])]:
+        (projects_dir / name).mkdir(parents=True)
+        for extension in extensions:
+            (projects_dir / name / f"{name}.{extension}").touch()
+    (projects_dir / "empty").mkdir()
+    assert find_layouts([str(projects_dir), "extra.gds"]) == [
+        str(projects_dir / "tt_um_a" / "tt_um_a.gds"),
+        str(projects_dir / "tt_um_b" / "tt_um_b.oas"),
+        "extra.gds",
+    ]
+
+
+def test_batch_project_window(tmp_path, monkeypatch):
+    lock = threading.Lock()
+    set_up = []
+    open_projects = set()
+    most_open = []
+
+    def fake_project_checks(layout, tech, reports_path, *args):
+        with lock:
+            open_projects.add(layout.path)
+            most_open.append(len(open_projects))
+            set_up.append(layout.path)
+        if layout.path.endswith("tt_um_6.gds"):
+            open_projects.discard(layout.path)
+            return []  # no checks apply
+
+        def check():
+            time.sleep(0.01)
+            with lock:
+                open_projects.discard(layout.path)
+
+        return [{"name": "Fake check", "check": check}]
+
+    monkeypatch.setattr(precheck_batch, "project_checks", fake_project_checks)
+    layouts = [str(tmp_path / f"tt_um_{i}.gds") for i in range(7)]
+    reports_dir = tmp_path / "reports"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["precheck_batch.py", *layouts, "--reports-dir", str(reports_dir)]
+        + ["--no-cache", "-j", "4", "--max-projects", "2"],
+    )
+    with pytest.raises(SystemExit):
+        precheck_batch.main()
+    assert sorted(set_up) == sorted(layouts)
+    assert max(most_open) <= 2
+    # a project without checks isn't counted as passed
+    summary = (reports_dir / "summary.md").read_text()
+    assert "| tt_um_6 | ❌ | Precheck setup |" in summary
+    assert "6 of 7 projects passed" in summary
+
+
+def test_find_overlapping_ports():
+    rng = random.Random(1)
+    for _ in range(50):
+        ports = {}
+        for i in range(rng.randrange(2, 8)):
+            ports[f"pin{i}"] = []
+            for _ in range(rng.randrange(1, 5)):
+                lx, by = rng.randrange(0, 50), rng.randrange(0, 50)
+                rx, ty = lx + rng.randrange(0, 10), by + rng.randrange(0, 10)
+                layer = rng.choice(["met3", "met4"])
+                ports[f"pin{i}"].append((layer, lx, by, rx, ty))
+
+        expected = []
+        for pin1, rects1 in sorted(ports.items()):
+            for pin2, rects2 in sorted(ports.items()):
+                if pin1 >= pin2:
+                    continue
+                for layer1, lx1, by1, rx1, ty1 in rects1:
+                    for layer2, lx2, by2, rx2, ty2 in rects2:
+                        if layer1 == layer2 and lx1 <= rx2 and lx2 <= rx1:
+                            if by1 <= ty2 and by2 <= ty1:
+                                expected.append((pin1, pin2))
+        assert find_overlapping_ports(ports) == expected
+
+    # a tall column of pins, all crossing the sweep line at once
+    ports = {f"pin{i:05}": [("met4", 0, i * 10, 5, i * 10 + 4)] for i in range(20000)}
+    ports["pin20000"] = [("met4", 1, 94, 2, 101)]  # abuts pin00009
+    assert find_overlapping_ports(ports) == [
+        ("pin00009", "pin20000"),
+        ("pin00010", "pin20000"),
+    ]
+
+
+def test_canonicalize_rectangles():
+    rng = random.Random(1)
+    for _ in range(200):
+        rects = []
+        for _ in range(rng.randrange(1, 8)):
+            lx, by = rng.randrange(0, 20), rng.randrange(0, 20)
+            rects.append((lx, by, lx + rng.randrange(1, 8), by + rng.randrange(1, 8)))
+
+        # brute force: every rectangle on the grid of input coordinates that is
+        # covered by the union, and can't be grown by a grid step in any direction
+        xs = sorted(set(x for r in rects for x in (r[0], r[2])))
+        ys = sorted(set(y for r in rects for y in (r[1], r[3])))
+
+        def is_covered(i1, j1, i2, j2):
+            for i in range(i1, i2):
+                for j in range(j1, j2):
+                    cx, cy = (xs[i] + xs[i + 1]) / 2, (ys[j] + ys[j + 1]) / 2
+                    if not any(r[0] < cx < r[2] and r[1] < cy < r[3] for r in rects):
+                        return False
+            return True
+
+        expected = []
+        for i1 in range(len(xs)):
+            for i2 in range(i1 + 1, len(xs)):
+                for j1 in range(len(ys)):
+                    for j2 in range(j1 + 1, len(ys)):
+                        if not is_covered(i1, j1, i2, j2):
+                            continue
+                        if i1 > 0 and is_covered(i1 - 1, j1, i2, j2):
+                            continue
+                        if i2 < len(xs) - 1 and is_covered(i1, j1, i2 + 1, j2):
+                            continue
+                        if j1 > 0 and is_covered(i1, j1 - 1, i2, j2):
+                            continue
+                        if j2 < len(ys) - 1 and is_covered(i1, j1, i2, j2 + 1):
+                            continue
+                        expected.append((xs[i1], ys[j1], xs[i2], ys[j2]))
+        assert canonicalize_rectangles(rects) == sorted(expected)
+
+
+def test_polygon_index():
+    rng = random.Random(1)
+    polygons = []
+    for _ in range(300):
+        x, y = rng.uniform(0, 100), rng.uniform(0, 100)
+        polygons.append(
+            gdstk.rectangle((x, y), (x + rng.uniform(0, 5), y + rng.uniform(0, 5)))
+        )
+    polygons.append(gdstk.rectangle((-10, -10), (110, -5)))  # e.g. part of a ring
+    index = PolygonIndex(polygons)
+    for _ in range(100):
+        x, y = rng.uniform(-10, 110), rng.uniform(-10, 110)
+        x1, y1 = x + rng.uniform(0, 10), y + rng.uniform(0, 10)
+        candidates = index.query(x, y, x1, y1)
+        for poly in polygons:
+            (px0, py0), (px1, py1) = poly.bounding_box()
+            if px0 <= x1 and x <= px1 and py0 <= y1 and y <= py1:
+                assert any(poly is candidate for candidate in candidates)
+
+    # a query spanning millions of buckets falls back to a scan
+    tiny = [gdstk.rectangle((i, i), (i + 1e-3, i + 1e-3)) for i in range(100)]
+    index = PolygonIndex(tiny)
+    start = time.monotonic()
+    assert index.query(-1, 49.5, 1000, 59.5) == tiny[50:60]
+    assert time.monotonic() - start < 1
+
+
+def test_template_def_cache(tmp_path, monkeypatch):
+    def_file = tmp_path / "tt_block_1x1_pg.def"
+    def_file.write_text(open("../tech/sky130A/def/tt_block_1x1_pg.def").read())
+    cache_dir = tmp_path / "cache"
+
+    # without a cache directory, the parse is only kept in memory
+    monkeypatch.setenv("PRECHECK_CACHE_DIR", str(cache_dir))
+    template = load_template_def(str(def_file))
+    assert not cache_dir.exists()
+
+    template_def._memory_cache.clear()
+    template = load_template_def(str(def_file), str(cache_dir))
+    assert template == parse_template_def(str(def_file))
+    assert template["pins"]["clk"][0] == "met4"
+    assert len(list((cache_dir / "template_def").iterdir())) == 1
+
+    # editing the template invalidates the cached copy
+    def_file.write_text(
+        def_file.read_text().replace("- clk + NET clk", "- clk2 + NET clk2")
+    )
+    os.utime(def_file, ns=(0, 0))
+    template = load_template_def(str(def_file), str(cache_dir))
+    assert "clk" not in template["pins"] and "clk2" in template["pins"]
+
+
+def test_lyp_layer_table(tmp_path, monkeypatch):
+    lyp_file = tmp_path / "test.lyp"
+    lyp_file.write_text(open(LYP_FILE).read())
+    cache_dir = str(tmp_path / "cache")
+
+    table = klayout_tools.load_lyp_layers(str(lyp_file), cache_dir=cache_dir)
+    parsed = klayout_tools.parse_lyp_layers(str(lyp_file))
+    assert table.keys() == parsed.keys()
+    assert table.number("met1.pin") == (68, 16)
+    assert table.name(68, 16) == "met1.pin"
+    assert table.name(1000, 0) is None
+    assert klayout_tools.load_lyp_layers(str(lyp_file), cache_dir=cache_dir) is table
+
+    # a new process reads the table from the disk cache
+    klayout_tools._memory_cache.clear()
+    with monkeypatch.context() as m:
+        m.setattr(klayout_tools, "parse_lyp_layers", None)
+        cached = klayout_tools.load_lyp_layers(str(lyp_file), cache_dir=cache_dir)
+    assert {k: repr(v) for k, v in cached.items()} == {
+        k: repr(v) for k, v in parsed.items()
+    }
+
+    # editing the file invalidates both caches
+    lyp_file.write_text(lyp_file.read_text().replace("met1.pin", "met1.pin2"))
+    os.utime(lyp_file, ns=(0, 0))
+    table = klayout_tools.load_lyp_layers(str(lyp_file), cache_dir=cache_dir)
+    assert table.name(68, 16) == "met1.pin2"
+    assert len(os.listdir(os.path.join(cache_dir, "lyp_layers"))) == 1
+
+    # without a cache directory, the table is only kept in memory
+    other_lyp_file = tmp_path / "other.lyp"
+    other_lyp_file.write_text(lyp_file.read_text())
+    monkeypatch.setenv("PRECHECK_CACHE_DIR", cache_dir)
+    klayout_tools.load_lyp_layers(str(other_lyp_file))
+    assert len(os.listdir(os.path.join(cache_dir, "lyp_layers"))) == 1
+
+
+def test_parse_lef(tmp_path):
+    lef_file = tmp_path / "test.lef"
+    lef_data = """
+        VERSION 5.7 ;
+        BUSBITCHARS "[]" ;
+        PROPERTYDEFINITIONS
+          MACRO maskLayoutSubType STRING ;
+        END PROPERTYDEFINITIONS
+        MACRO TEST_lef  # a comment
+          CLASS BLOCK ;
+          ORIGIN 0.000 0.000 ;
+          SIZE 161.000 BY 111.520 ;
+          PIN ui_in[0]
+            DIRECTION INPUT ;
+            USE SIGNAL ;
+            PORT
+              LAYER met4 ;
+                RECT 151.000 110.520 151.300 111.520 ;
+                RECT MASK 1 151.000 109.000 151.300 110.520 ;
+            END
+          END ui_in[0]
+          PIN VGND
+            USE GROUND ;
+            PORT
+              LAYER met4 ;
+                RECT 21.580 2.480 23.180 109.040 ;
+              VIA 1.000 1.000 via3 ;
+            END
+          END VGND
+          OBS
+            LAYER met1 ;
+              RECT 0.000 0.000 161.000 111.520 ;
+          END
+        END TEST_lef
+        END LIBRARY
+    """
+    lef_file.write_text(textwrap.dedent(lef_data))
+    lef = parse_lef(str(lef_file))
+    assert list(lef.macros) == ["TEST_lef"]
+    macro = lef.macros["TEST_lef"]
+    assert macro.origin == (0, 0)
+    assert macro.size == (161000, 111520)
+    assert [pin.name for pin in macro.pins] == ["ui_in[0]", "VGND"]
+    ui_in, vgnd = macro.pins
+    assert (ui_in.direction, ui_in.use) == ("INPUT", "SIGNAL")
+    assert ui_in.rects == [
+        ("met4", 151000, 110520, 151300, 111520),
+        ("met4", 151000, 109000, 151300, 110520),
+    ]
+    assert vgnd.use == "GROUND"
+    assert vgnd.ports[0].other_statements == ["VIA"]
+
+
+def test_read_drc_report(tmp_path):
+    report = rdb.ReportDatabase("DRC")
+    cell = report.create_cell("TOP")
+    width = report.create_category("m1.1")
+    width.description = "m1.1 : min. m1 width : 0.14um"
+    nested = report.create_category(width, "sub")
+    report.create_category("offgrid")  # no violations
+    for i in range(1000):
+        item = report.create_item(cell.rdb_id(), width.rdb_id())
+        item.add_value(pya.DBox(i, 0, i + 0.1, 0.1))
+    item = report.create_item(cell.rdb_id(), nested.rdb_id())
+    item.add_value(pya.DEdgePair(pya.DEdge(0, 0, 0, 1), pya.DEdge(1, 0, 1, 1)))
+    report_file = str(tmp_path / "drc.xml")
+    report.save(report_file)
+
+    summary = read_drc_report(report_file, max_examples=2)
+    assert summary.total == report.num_items() == 1001
+    assert [(rule.name, rule.count) for rule in summary.violated_rules()] == [
+        ("m1.1", 1000),
+        ("m1.1.sub", 1),
+    ]
+    assert summary.rules["offgrid"].count == 0
+    width_rule = summary.rules["m1.1"]
+    assert width_rule.description == "m1.1 : min. m1 width : 0.14um"
+    assert width_rule.examples == ["box: (0,0;0.1,0.1)", "box: (1,0;1.1,0.1)"]
+
+    error = precheck.DrcFailure("1001 DRC violations", 1001, summary.violated_rules())
+    markdown = precheck.results_markdown([CheckResult("KLayout BEOL", 1, error)])
+    assert "## KLayout BEOL" in markdown
+    assert (
+        "| m1.1 : min. m1 width : 0.14um | 1000 | `box: (0,0;0.1,0.1)`<br>" in markdown
+    )
+
+
+def test_precheck_server(tmp_path):
+    service = PrecheckService("sky130A", str(tmp_path / "reports"), jobs=2)
+    server = ServiceServer(("127.0.0.1", 0), PrecheckRequestHandler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    def request(path: str, data: dict | None = None):
+        body = None if data is None else json.dumps(data).encode()
+        try:
+            with urllib.request.urlopen(url + path, body) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    try:
+        assert request("/health") == (200, {"status": "ok"})
+        assert request("/jobs", {"gds": "relative.gds"})[0] == 400
+
+        # no info.yaml next to the layout
+        gds_file = str(tmp_path / "tt_um_test.gds")
+        status, job = request("/jobs", {"gds": gds_file, "wait": True})
+        assert status == 200
+        assert job["state"] == "done" and job["passed"] is False
+        assert job["results"][0]["name"] == "Precheck setup"
+        assert job["results"][0]["error"] == "info.yaml not found"
+        assert os.path.exists(os.path.join(job["reports_path"], "results.md"))
+        assert request(f"/jobs/{job['id']}") == (200, job)
+        assert request("/jobs/nonexistent")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown()
+
+
+def test_klayout_drc_batch(tmp_path, monkeypatch):
+    # stands in for klayout: records each run and passes every deck but beol
+    fake_klayout = tmp_path / "bin" / "klayout"
+    fake_klayout.parent.mkdir()
+    fake_klayout.write_text(
+        textwrap.dedent(
+            f"""\
+            #!{sys.executable}
+            import json, sys
+            import klayout.rdb as rdb
+            config = json.load(open(sys.argv[-1].removeprefix("config=")))
+            with open("{tmp_path}/runs.txt", "a") as f:
+                f.write(" ".join(deck["check"] for deck in config["decks"]) + "\\n")
+            for deck in config["decks"]:
+                rdb.ReportDatabase("DRC").save(deck["vars"]["report"])
+            statuses = {{deck["check"]: int(deck["check"] == "beol") for deck in config["decks"]}}
+            json.dump(statuses, open(config["status"], "w"))
+            """
+        )
+    )
+    fake_klayout.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_klayout.parent}:{os.environ['PATH']}")
+
+    batch = KlayoutDrcBatch("test.gds", str(tmp_path))
+    decks = [
+        precheck.klayout_drc_deck("test.gds", check, reports_path=str(tmp_path))
+        for check in ("feol", "beol", "offgrid")
+    ]
+    for deck in decks:
+        batch.add(deck)
+    assert batch.threads == 1
+
+    precheck.run_drc_deck(decks[0], batch)
+    with pytest.raises(precheck.PrecheckFailure, match="Klayout beol failed"):
+        precheck.run_drc_deck(decks[1], batch)
+    precheck.run_drc_deck(decks[2], batch)
+    assert (tmp_path / "runs.txt").read_text() == "feol beol offgrid\n"
+
+
+def test_klayout_drc_batch_checks(gds_valid: str, tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    gds = str(project_dir / "TEST_valid.gds")
+    shutil.copyfile(gds_valid, gds)
+    (project_dir / "info.yaml").write_text("project:\n  top_module: TEST_valid\n")
+    reports_path = str(tmp_path / "reports")
+    cache = ResultCache(str(tmp_path / "cache"), {})
+    layout = LayoutContext(gds)
+
+    checks = precheck.project_checks(layout, "sky130A", reports_path)
+    feol = next(check for check in checks if check["name"] == "KLayout FEOL")
+    cache.store(feol, CheckResult(feol["name"], 1.0))
+
+    checks = precheck.project_checks(
+        layout, "sky130A", reports_path, klayout_batch=True, cache=cache
+    )
+    beol = next(check for check in checks if check["name"] == "KLayout BEOL")
+    batch = beol["check"].args[1]
+    decks = {deck["check"]: deck for deck in batch.decks}
+    # the cached deck is left out, and each deck keeps its threads: the batch
+    # takes the slots of nwell_urpm, the checks none of their own
+    assert "feol" not in decks and "beol" in decks
+    assert decks["nwell_urpm"]["vars"]["thr"] == str(os.cpu_count())
+    assert batch.threads == os.cpu_count()
+    assert beol["cpus"] == 0
+
+
+@pytest.mark.skipif(shutil.which("klayout") is None, reason="needs klayout")
+def test_klayout_drc_batch_matches_separate_runs(gds_fail_met1_poly: str, tmp_path):
+    scripts = {
+        "feol": f"{PDK_NAME}_mr.drc",
+        "beol": f"{PDK_NAME}_mr.drc",
+        "offgrid": f"{PDK_NAME}_mr.drc",
+        "zero_area": "zeroarea.rb.drc",
+    }
+
+    def outcome(deck, batch=None):
+        try:
+            precheck.run_drc_deck(deck, batch)
+        except precheck.PrecheckFailure as e:
+            return str(e)
+        return None
+
+    outcomes = {}
+    for mode in ("separate", "batch"):
+        reports_path = tmp_path / mode
+        reports_path.mkdir()
+        batch = None
+        if mode == "batch":
+            batch = KlayoutDrcBatch(gds_fail_met1_poly, str(reports_path))
+        decks = [
+            precheck.klayout_drc_deck(
+                gds_fail_met1_poly, check, script, reports_path=str(reports_path)
+            )
+            for check, script in scripts.items()
+        ]
+        for deck in decks:
+            if batch is not None:
+                batch.add(deck)
+        outcomes[mode] = [outcome(deck, batch) for deck in decks]
+
+    assert outcomes["batch"] == outcomes["separate"]
+    assert outcomes["separate"][1] is not None  # the met1 rect fails BEOL
+
+
+def test_klayout_drc_batch_stopped(tmp_path, monkeypatch):
+    # stands in for klayout: records each run, then hangs
+    fake_klayout = tmp_path / "bin" / "klayout"
+    fake_klayout.parent.mkdir()
+    fake_klayout.write_text(
+        textwrap.dedent(
+            f"""\
+            #!/bin/sh
+            echo run >> {tmp_path}/runs.txt
+            exec sleep 30
+            """
+        )
+    )
+    fake_klayout.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_klayout.parent}:{os.environ['PATH']}")
+
+    batch = KlayoutDrcBatch("test.gds", str(tmp_path))
+    checks = []
+    for name in ("feol", "beol", "offgrid"):
+        deck = precheck.klayout_drc_deck("test.gds", name, reports_path=str(tmp_path))
+        batch.add(deck)
+        checks.append(
+            {
+                "name": name,
+                "check": lambda deck=deck: precheck.run_drc_deck(deck, batch),
+            }
+        )
+
+    start = time.monotonic()
+    results = run_checks(checks, jobs=1, timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert all(result.resource_exceeded for result in results)
+    # the batch was stopped once, and not started again for the other decks
+    assert (tmp_path / "runs.txt").read_text() == "run\n"
+
+
+def test_klayout_drc_batch_slots(tmp_path, monkeypatch):
+    # stands in for klayout: records each run, then hangs
+    fake_klayout = tmp_path / "bin" / "klayout"
+    fake_klayout.parent.mkdir()
+    fake_klayout.write_text(
+        textwrap.dedent(
+            f"""\
+            #!/bin/sh
+            echo run >> {tmp_path}/runs.txt
+            exec sleep 30
+            """
+        )
+    )
+    fake_klayout.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_klayout.parent}:{os.environ['PATH']}")
+
+    batch = KlayoutDrcBatch("test.gds", str(tmp_path))
+    checks: list[Check] = []
+    for name, threads in (("feol", 1), ("nwell_urpm", 2)):
+        deck = precheck.klayout_drc_deck("test.gds", name, reports_path=str(tmp_path))
+        deck["vars"]["thr"] = str(threads)
+        batch.add(deck)
+        checks.append(
+            {
+                "name": name,
+                "cpus": 0,
+                "cost": 10,
+                "check": lambda deck=deck: precheck.run_drc_deck(deck, batch),
+            }
+        )
+
+    def structure_check():
+        # fails once the batch runs, which it can next to this check: it takes
+        # the 2 slots of its decks, and the checks waiting for it take none
+        deadline = time.monotonic() + 5
+        while not (tmp_path / "runs.txt").exists():
+            assert time.monotonic() < deadline, "the batch didn't start"
+            time.sleep(0.05)
+        raise precheck.PrecheckFailure("broken")
+
+    checks.append({"name": "structure", "check": structure_check, "blocking": True})
+
+    start = time.monotonic()
+    results = run_checks(checks, jobs=3, fail_fast=True)
+    assert time.monotonic() - start < 10
+    assert str(results[2].error) == "broken"
+    # the failure cancelled both the batch and the check waiting for it
+    assert results[0].skipped == results[1].skipped == "structure failed"
+    assert (tmp_path / "runs.txt").read_text() == "run\n"
+
+
+def test_verilog_syntax_batch(
+    tmp_path, monkeypatch, verilog_syntax_ok: str, verilog_syntax_error: str
+):
+    # stands in for yosys: records each session, stops at a file with "syntax error"
+    fake_yosys = tmp_path / "bin" / "yowasp-yosys"
+    fake_yosys.parent.mkdir()
+    fake_yosys.write_text(
+        textwrap.dedent(
+            f"""\
+            #!{sys.executable}
+            import re, sys
+            script = open(sys.argv[-1]).read().splitlines()
+            files = [line for line in script if line.startswith("read_verilog")]
+            with open("{tmp_path}/sessions.txt", "a") as f:
+                f.write(f"{{len(files)}}\\n")
+            for line in script:
+                if line.startswith("read_verilog"):
+                    path = re.search('"(.*)"', line).group(1)
+                    if "syntax error" in open(path).read():
+                        print("ERROR: syntax error")
+                        sys.exit(1)
+                    if "crash" in open(path).read():
+                        sys.exit(3)
+                elif line.startswith("log "):
+                    print(line[4:])
+            """
+        )
+    )
+    fake_yosys.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fake_yosys.parent}:{os.environ['PATH']}")
+    cache_dir = str(tmp_path / "cache")
+
+    other_ok = str(tmp_path / "other_ok.v")
+    with open(other_ok, "w") as f:
+        f.write("module other_ok ();\nendmodule\n")
+    batch = VerilogSyntaxBatch(cache_dir)
+    for verilog in (verilog_syntax_ok, verilog_syntax_error, other_ok):
+        batch.add(verilog)
+    precheck.verilog_syntax_check(other_ok, batch)
+    with pytest.raises(precheck.PrecheckFailure, match="Verilog syntax check failed"):
+        precheck.verilog_syntax_check(verilog_syntax_error, batch)
+    precheck.verilog_syntax_check(verilog_syntax_ok, batch)
+    # one session for all three, and another one after the failing file
+    assert (tmp_path / "sessions.txt").read_text() == "3\n1\n"
+
+    # then cached by content, in and out of batches
+    precheck.verilog_syntax_check(verilog_syntax_ok, cache_dir=cache_dir)
+    assert check_verilog_files([verilog_syntax_error, other_ok], cache_dir) == {
+        verilog_syntax_error: False,
+        other_ok: True,
+    }
+    assert (tmp_path / "sessions.txt").read_text() == "3\n1\n"
+    with open(other_ok, "a") as f:
+        f.write("// changed\n")
+    precheck.verilog_syntax_check(other_ok, cache_dir=cache_dir)
+    assert (tmp_path / "sessions.txt").read_text() == "3\n1\n1\n"
+
+    # without a cache directory, or when yosys fails for another reason, nothing is cached
+    precheck.verilog_syntax_check(other_ok)
+    crashing = str(tmp_path / "crashing.v")
+    with open(crashing, "w") as f:
+        f.write("// crash\n")
+    for _ in range(2):
+        assert check_verilog_files([crashing], cache_dir) == {crashing: None}
+    assert (tmp_path / "sessions.txt").read_text() == "3\n1\n1\n1\n1\n1\n"
+    # and the check fails without a verdict, which isn't cached either
+    with pytest.raises(precheck.ToolFailure, match="Yosys failed"):
+        precheck.verilog_syntax_check(crashing, cache_dir=cache_dir)
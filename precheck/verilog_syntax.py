@@ -0,0 +1,181 @@
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from check_metrics import run_subprocess
+from result_cache import hash_file
+
+VERILOG_SYNTAX_FORMAT = 1
+
+# logged by the yosys script after each file it read successfully
+DONE_MARKER = "precheck-verilog-read"
+
+
+def yosys_version() -> str:
+    try:
+        return importlib.metadata.version("yowasp-yosys")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def cache_file(verilog: str, cache_dir: str) -> str:
+    key_data = {
+        "format": VERILOG_SYNTAX_FORMAT,
+        "yosys": yosys_version(),
+        "source": hash_file(verilog),
+    }
+    key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_dir, "verilog_syntax", key[:32] + ".json")
+
+
+def load_cached_result(verilog: str, cache_dir: str) -> Optional[bool]:
+    """Earlier syntax check result for a file with the same content, if any."""
+    try:
+        with open(cache_file(verilog, cache_dir)) as f:
+            return json.load(f)["passed"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_result(verilog: str, passed: bool, cache_dir: str):
+    try:
+        path = cache_file(verilog, cache_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"format": VERILOG_SYNTAX_FORMAT, "passed": passed}, f)
+        os.replace(temp_file, path)
+    except OSError as e:
+        logging.warning(f"Could not cache the syntax check of {verilog}: {e}")
+
+
+def is_verilog_error(output: str, returncode: int) -> bool:
+    """Whether yosys stopped on an error in the Verilog it read.
+
+    Rather than because it crashed, was killed, or couldn't open the file.
+    """
+    errors = [line for line in output.splitlines() if "ERROR:" in line]
+    return (
+        returncode == 1
+        and len(errors) > 0
+        and not any("Can't open input file" in line for line in errors)
+    )
+
+
+def run_yosys_syntax(verilog_files: List[str]) -> Dict[str, Optional[bool]]:
+    """Read each file into a fresh design, all in as few yosys sessions as possible.
+
+    A yosys script stops at the first error, so after a file fails to read, a new
+    session picks up with the next one. Files that yosys failed on for another
+    reason than an error in the Verilog get None.
+    """
+    results: Dict[str, Optional[bool]] = {}
+    remaining = []
+    for verilog in verilog_files:
+        if os.path.exists(verilog):
+            remaining.append(os.path.realpath(verilog))
+        else:
+            logging.error(f"Verilog file {verilog} not found")
+            results[verilog] = None
+
+    with tempfile.TemporaryDirectory(prefix="precheck-yosys-") as work_dir:
+        # the WebAssembly yosys only sees the directories mounted into it
+        mounts = sorted({os.path.dirname(path) for path in remaining} | {work_dir})
+        env = os.environ.copy()
+        env["YOWASP_MOUNT"] = os.pathsep.join(f"{path}={path}" for path in mounts)
+        script_file = os.path.join(work_dir, "syntax.ys")
+        log_file = os.path.join(work_dir, "yosys.log")
+
+        while remaining:
+            with open(script_file, "w") as f:
+                for i, verilog in enumerate(remaining):
+                    f.write("design -reset\n")
+                    f.write(f'read_verilog -sv "{verilog}"\n')
+                    f.write(f"log {DONE_MARKER} {i}\n")
+            with open(log_file, "w") as log:
+                yosys = run_subprocess(
+                    ["yowasp-yosys", "-s", script_file], env=env, stdout=log
+                )
+            with open(log_file) as log:
+                output = log.read()
+            done = {line.strip() for line in output.splitlines()}
+            read = 0
+            while read < len(remaining) and f"{DONE_MARKER} {read}" in done:
+                results[remaining[read]] = True
+                read += 1
+            if read == len(remaining):
+                break
+            if yosys.returncode == 0:
+                raise RuntimeError(f"yosys stopped early without an error:\n{output}")
+            logging.error(f"Failed to read {remaining[read]}:\n{output[-4000:]}")
+            if is_verilog_error(output, yosys.returncode):
+                results[remaining[read]] = False
+            else:
+                results[remaining[read]] = None
+            remaining = remaining[read + 1 :]
+
+    return {
+        verilog: results.get(verilog, results.get(os.path.realpath(verilog)))
+        for verilog in verilog_files
+    }
+
+
+def check_verilog_files(
+    verilog_files: List[str], cache_dir: Optional[str] = None
+) -> Dict[str, Optional[bool]]:
+    """Whether each file can be read by yosys, from the cache or from one yosys session.
+
+    Files yosys gave no verdict on (e.g. because it crashed) get None. With a
+    `cache_dir`, results are cached by the content of the file and the yosys
+    version. Only clean reads and errors in the Verilog are cached: other
+    failures may not happen again.
+    """
+    results: Dict[str, Optional[bool]] = {}
+    unknown = []
+    for verilog in verilog_files:
+        passed = None
+        if cache_dir is not None and os.path.exists(verilog):
+            passed = load_cached_result(verilog, cache_dir)
+        if passed is None:
+            unknown.append(verilog)
+        else:
+            logging.info(f"Using cached syntax check result for {verilog}")
+            results[verilog] = passed
+    if unknown:
+        for verilog, read in run_yosys_syntax(unknown).items():
+            results[verilog] = read
+            if cache_dir is not None and read is not None:
+                store_result(verilog, read, cache_dir)
+    return results
+
+
+class VerilogSyntaxBatch:
+    """Checks the Verilog files of many projects in one yosys session.
+
+    The session is started by the first check asking for a result, and reads
+    every file added so far; the other checks just pick up their result. Results
+    are cached in `cache_dir`, if given.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.files: List[str] = []
+        self._lock = threading.Lock()
+        self._results: Dict[str, Optional[bool]] = {}
+
+    def add(self, verilog: str):
+        self.files.append(verilog)
+
+    def run(self, verilog: str) -> Optional[bool]:
+        with self._lock:
+            if verilog not in self._results:
+                pending = [f for f in self.files if f not in self._results]
+                if verilog not in pending:
+                    pending.append(verilog)
+                self._results.update(check_verilog_files(pending, self.cache_dir))
+            return self._results[verilog]
@@ -15,6 +15,7 @@ import yaml
 from git.repo import Repo
 
 import git_utils
+import yosys_pool
 from config_utils import read_config, write_config
 from doc_utils import DocsHelper
 from markdown_utils import limit_markdown_headings
@@ -138,37 +139,37 @@ class Project:
                 logging.error(f"{filename} doesn't exist in the repo")
                 exit(1)
 
-    def run_yosys(self, command: str, no_output: bool = False):
-        env = os.environ.copy()
-        env["YOSYS_CMD"] = command
-        yosys_cmd = 'yowasp-yosys -qp "$YOSYS_CMD"'
-        return subprocess.run(yosys_cmd, shell=True, env=env, capture_output=no_output)
+    def run_yosys(
+        self, command: str, no_output: bool = False, write_json: bool = False
+    ):
+        return yosys_pool.shared_pool().run(command, no_output, write_json)
 
     def check_ports(self, include_power_ports: bool = False):
         top = self.get_macro_name()
         if not self.is_user_project and self.is_chip_rom():
             return  # Chip ROM is auto generated, so we don't have the verilog yet
-        sources = [os.path.join(self.src_dir, src) for src in self.sources]
+        # absolute, as the yosys workers don't see the current directory
+        sources = [
+            os.path.abspath(os.path.join(self.src_dir, src)) for src in self.sources
+        ]
         source_list = " ".join(sources)
 
-        json_file = "ports.json"
-
         # Heuristic - try reading just the first source file, if that fails, try all of them
         p = self.run_yosys(
-            f"read_verilog -lib -sv {sources[0]}; hierarchy -top {top} ; proc; write_json {json_file}",
-            True,
+            f"read_verilog -lib -sv {sources[0]}; hierarchy -top {top} ; proc",
+            no_output=True,
+            write_json=True,
         )
         if p.returncode != 0:
             p = self.run_yosys(
-                f"read_verilog -lib -sv {source_list}; hierarchy -top {top} ; proc; write_json {json_file}"
+                f"read_verilog -lib -sv {source_list}; hierarchy -top {top} ; proc",
+                write_json=True,
             )
         if p.returncode != 0:
             logging.error(f"yosys port read failed for {self}")
             exit(1)
 
-        with open(json_file) as fh:
-            ports = json.load(fh)
-        os.unlink(json_file)
+        ports = p.json
 
         module_ports = ports["modules"][top]["ports"]
         if "VPWR" in module_ports:
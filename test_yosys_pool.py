@@ -0,0 +1,141 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+from yosys_pool import YosysPool
+
+# stands in for the interactive yosys shell: a failing command skips the rest of
+# its line, a syntax error ends the process, like in yosys
+FAKE_YOSYS = """\
+#!{python}
+import json, os, sys, time
+
+with open("{starts}", "a") as f:
+    f.write(f"{{os.getpid()}}\\n")
+
+class CommandError(Exception):
+    pass
+
+def run(command):
+    args = command.split()
+    if not args or args[0] in ("design", "proc"):
+        return
+    if args[0] == "script":
+        for line in open(args[1]):
+            for part in line.split(";"):
+                run(part)
+    elif args[0] == "read_verilog":
+        if "syntax error" in open(args[-1]).read():
+            print("ERROR: syntax error", file=sys.stderr, flush=True)
+            sys.exit(1)
+    elif args[0] == "hierarchy":
+        if args[-1] == "missing":
+            print("ERROR: Module `missing' not found!", file=sys.stderr, flush=True)
+            raise CommandError()
+    elif args[0] == "write_json":
+        with open(args[1], "w") as f:
+            json.dump({{"modules": {{"top": {{"ports": {{}}}}}}}}, f)
+    elif args[0] == "log":
+        stream = sys.stderr if args[1] == "-stderr" else sys.stdout
+        print(args[2], file=stream, flush=True)
+    elif args[0] == "hang":
+        time.sleep(60)
+
+for line in sys.stdin:
+    print("yosys> ", end="", flush=True)
+    try:
+        for command in line.split(";"):
+            run(command)
+    except CommandError:
+        pass
+"""
+
+
+@pytest.fixture
+def fake_yosys(tmp_path, monkeypatch):
+    """Puts a fake yowasp-yosys on the PATH, returns the file listing its starts."""
+    starts = tmp_path / "starts.txt"
+    yosys = tmp_path / "bin" / "yowasp-yosys"
+    yosys.parent.mkdir()
+    yosys.write_text(FAKE_YOSYS.format(python=sys.executable, starts=starts))
+    yosys.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{yosys.parent}:{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    return starts
+
+
+@pytest.fixture
+def verilog_files(tmp_path):
+    ok = tmp_path / "ok.v"
+    ok.write_text("module top ();\nendmodule\n")
+    error = tmp_path / "error.v"
+    error.write_text(
+        textwrap.dedent(
+            """\
+            module top ();
+              syntax error
+            endmodule
+            """
+        )
+    )
+    return str(ok), str(error)
+
+
+class TestYosysPool:
+    def test_runs_scripts_in_one_worker(self, fake_yosys, verilog_files):
+        ok, _ = verilog_files
+        pool = YosysPool(max_workers=1)
+        try:
+            for _ in range(2):
+                result = pool.run(
+                    f"read_verilog {ok}; hierarchy -top top; proc", write_json=True
+                )
+                assert result.returncode == 0
+                assert result.json == {"modules": {"top": {"ports": {}}}}
+        finally:
+            pool.close()
+        assert len(fake_yosys.read_text().splitlines()) == 1
+        # no job files left behind
+        assert sorted(os.listdir(".")) == ["bin", "error.v", "ok.v", "starts.txt"]
+        assert not os.path.exists(pool._job_dir.name)
+
+    def test_command_error_keeps_worker(self, fake_yosys, verilog_files):
+        ok, _ = verilog_files
+        pool = YosysPool(max_workers=1)
+        try:
+            result = pool.run(
+                f"read_verilog {ok}; hierarchy -top missing", no_output=True
+            )
+            assert result.returncode == 1
+            assert "Module `missing' not found" in result.stderr
+            assert pool.run(f"read_verilog {ok}").returncode == 0
+        finally:
+            pool.close()
+        assert len(fake_yosys.read_text().splitlines()) == 1
+
+    def test_syntax_error_restarts_worker(self, fake_yosys, verilog_files):
+        ok, error = verilog_files
+        pool = YosysPool(max_workers=1)
+        try:
+            result = pool.run(f"read_verilog {error}", no_output=True)
+            assert result.returncode == 1
+            assert "syntax error" in result.stderr
+            result = pool.run(f"read_verilog {ok}", write_json=True)
+            assert result.returncode == 0 and result.json is not None
+        finally:
+            pool.close()
+        assert len(fake_yosys.read_text().splitlines()) == 2
+
+    def test_timeout_restarts_worker(self, fake_yosys, verilog_files):
+        ok, _ = verilog_files
+        pool = YosysPool(max_workers=1, timeout=0.5)
+        try:
+            result = pool.run("hang", no_output=True)
+            assert result.returncode == 1
+            assert "timed out" in result.stderr
+            assert pool.run(f"read_verilog {ok}").returncode == 0
+        finally:
+            pool.close()
+        assert len(fake_yosys.read_text().splitlines()) == 2
@@ -0,0 +1,239 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+# logged by a worker when a job is done, and when it succeeded
+DONE_MARKER = "tt-yosys-pool-done"
+OK_MARKER = "tt-yosys-pool-ok"
+
+# seconds a job may run before its worker is killed
+DEFAULT_TIMEOUT = 600
+
+
+class YosysResult:
+    def __init__(self, returncode: int, stderr: str, json: typing.Any = None):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.json = json  # the design as written by write_json, if asked for
+
+
+class YosysWorker:
+    """A yowasp-yosys process running scripts sent to its interactive shell.
+
+    The WebAssembly yosys takes seconds to start, so it is started once and
+    reused. Each job runs from a script file, in a line starting with
+    `design -reset`: the shell skips the rest of a line after a failing command,
+    so the OK marker logged at the end of the line is only printed on success.
+
+    Not every error is survived: the shell only catches command errors (e.g. a
+    missing top module), while others, like Verilog syntax errors, make yosys
+    exit. The worker is then dead (`alive` is False), as it is after being
+    killed for running longer than the timeout.
+
+    Job files are written to `job_dir`, which is mounted into the WebAssembly
+    yosys at the same path, along with the root directory. Relative paths can't
+    be resolved this way, so the scripts must use absolute paths.
+    """
+
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        env = os.environ.copy()
+        env["YOWASP_MOUNT"] = f"/=/:{job_dir}={job_dir}"
+        self.proc = subprocess.Popen(
+            ["yowasp-yosys", "-q"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=env,
+        )
+        self.alive = True
+        self._jobs = itertools.count()
+
+    def _read_until(
+        self, stream: typing.TextIO, marker: str, lines: typing.List[str]
+    ) -> None:
+        for line in stream:
+            # prompts and markers may share a line
+            if marker in line:
+                return
+            lines.append(line)
+        self.alive = False
+
+    def run(
+        self,
+        script: str,
+        write_json: bool = False,
+        timeout: typing.Optional[float] = None,
+    ) -> YosysResult:
+        job = f"{id(self)}-{next(self._jobs)}"
+        script_file = os.path.join(self.job_dir, f"{job}.ys")
+        json_file = os.path.join(self.job_dir, f"{job}.json")
+        with open(script_file, "w") as f:
+            f.write(script + "\n")
+            if write_json:
+                f.write(f"write_json {json_file}\n")
+
+        done = f"{DONE_MARKER}-{job}"
+        ok = f"{OK_MARKER}-{job}"
+        stdout_lines: typing.List[str] = []
+        stderr_lines: typing.List[str] = []
+        # both streams are read up to the marker logged there, errors go to stderr
+        readers = [
+            threading.Thread(
+                target=self._read_until, args=(stream, done, lines), daemon=True
+            )
+            for stream, lines in (
+                (self.proc.stdout, stdout_lines),
+                (self.proc.stderr, stderr_lines),
+            )
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            assert self.proc.stdin is not None
+            self.proc.stdin.write(
+                f"design -reset; script {script_file}; log -stdout {ok}\n"
+                f"log -stdout {done}; log -stderr {done}\n"
+            )
+            self.proc.stdin.flush()
+        except OSError:
+            self.alive = False
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for reader in readers:
+            reader.join(
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+        timed_out = any(reader.is_alive() for reader in readers)
+        if timed_out or not self.alive:
+            # the readers see the end of the streams once the process is gone
+            self.alive = False
+            self.proc.kill()
+            for reader in readers:
+                reader.join()
+        if timed_out:
+            stderr_lines.append(f"ERROR: yosys timed out after {timeout:g} s\n")
+
+        passed = self.alive and any(ok in line for line in stdout_lines)
+        result = YosysResult(0 if passed else 1, "".join(stderr_lines))
+        if passed and write_json:
+            with open(json_file) as f:
+                result.json = json.load(f)
+        for path in (script_file, json_file):
+            if os.path.exists(path):
+                os.unlink(path)
+        return result
+
+    def close(self):
+        if self.alive and self.proc.poll() is None:
+            try:
+                if self.proc.stdin is not None:
+                    self.proc.stdin.close()  # ends the shell
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            if stream is None:
+                continue
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class YosysPool:
+    """Long-lived yosys workers, started as needed up to `max_workers`.
+
+    Workers that died (yosys exits on most errors) or were killed after
+    `timeout` seconds are dropped, and a new one is started for the next script.
+    The job files of all workers go to a temporary directory owned by the pool.
+    """
+
+    def __init__(
+        self,
+        max_workers: typing.Optional[int] = None,
+        timeout: typing.Optional[float] = DEFAULT_TIMEOUT,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._job_dir = tempfile.TemporaryDirectory(prefix="yosys-pool-")
+        self._idle: typing.List[YosysWorker] = []
+        self._started = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self) -> YosysWorker:
+        with self._cond:
+            self._cond.wait_for(lambda: self._idle or self._started < self.max_workers)
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            logging.debug("starting a yosys worker")
+            return YosysWorker(self._job_dir.name)
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker: typing.Optional[YosysWorker]):
+        if worker is not None and not worker.alive:
+            logging.debug("yosys worker exited, replacing it")
+            worker.close()
+        with self._cond:
+            if worker is not None and worker.alive:
+                self._idle.append(worker)
+            else:
+                self._started -= 1
+            self._cond.notify()
+
+    def run(
+        self, script: str, no_output: bool = False, write_json: bool = False
+    ) -> YosysResult:
+        """Run a yosys script on a fresh design, like `yowasp-yosys -qp script`.
+
+        Paths in the script must be absolute. Unless `no_output` is set, the
+        errors are printed to stderr. With `write_json`, the resulting design is
+        returned as `result.json`.
+        """
+        worker = self._acquire()
+        try:
+            result = worker.run(script, write_json, self.timeout)
+        finally:
+            self._release(worker)
+        if result.stderr and not no_output:
+            sys.stderr.write(result.stderr)
+        return result
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+        for worker in idle:
+            worker.close()
+        self._job_dir.cleanup()
+
+
+_shared_pool: typing.Optional[YosysPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_pool() -> YosysPool:
+    """The pool used by all projects, closed when the program exits."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = YosysPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool